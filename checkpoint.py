@@ -0,0 +1,73 @@
+"""Points de reprise par appareil (fichier JSON écrit de façon atomique)"""
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+
+class CheckpointStore:
+    """Point de reprise de chaque appareil, section "devices" du fichier
+
+    Un point de reprise contient la dernière présence stockée (last_sync),
+    le numéro de série de l'appareil et le curseur de lecture incrémentale
+    (nombre d'enregistrements, offset, empreinte des derniers enregistrements).
+    L'état à la racine du fichier (ancien format, appareil unique) est repris
+    pour `legacy_device` puis migré à la première écriture.
+    """
+
+    def __init__(self, path: str, legacy_device: Optional[str] = None):
+        self.path = path
+        self.legacy_device = legacy_device
+        self.lock = threading.Lock()
+
+    def read(self) -> Dict:
+        """Lit le fichier complet (vide s'il est absent ou illisible)"""
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+                return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            return {}
+
+    def load(self, device: str) -> Dict:
+        """Point de reprise d'un appareil (vide s'il est inconnu)"""
+        with self.lock:
+            data = self.read()
+        state = data.get("devices", {}).get(device)
+        if not isinstance(state, dict) and device == self.legacy_device:
+            state = {k: data[k] for k in ("last_sync", "cursor") if k in data}
+        return state if isinstance(state, dict) else {}
+
+    def update(self, device: str, **fields) -> Dict:
+        """Met à jour le point de reprise d'un appareil (champs None ignorés)
+
+        Returns:
+            Nouveau point de reprise
+        """
+        with self.lock:
+            data = self.read()
+            devices = data.setdefault("devices", {})
+            state = devices.get(device)
+            if not isinstance(state, dict):
+                state = {}
+                if device == self.legacy_device:
+                    state = {k: data[k] for k in ("last_sync", "cursor") if k in data}
+            if device == self.legacy_device:
+                data.pop("last_sync", None)
+                data.pop("cursor", None)
+            state.update((k, v) for k, v in fields.items() if v is not None)
+            devices[device] = state
+            self.write(data)
+        return state
+
+    def write(self, data: Dict) -> None:
+        """Remplace le fichier via un fichier temporaire (appelé sous le verrou)
+
+        Un arrêt pendant l'écriture laisse l'ancien fichier intact.
+        """
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
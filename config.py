@@ -9,16 +9,58 @@ class Config:
     DEVICE_IP = os.getenv('DEVICE_IP', '192.168.1.100')
     DEVICE_PORT = int(os.getenv('DEVICE_PORT', '4370'))
     DEVICE_TIMEOUT = int(os.getenv('DEVICE_TIMEOUT', '60'))
+    DEVICE_READ_WINDOW = int(os.getenv('DEVICE_READ_WINDOW', '1'))
+    CHUNK_FILE = os.getenv('CHUNK_FILE', 'chunk_sizes.json')
+
+    # Mode flotte (inventaire JSON de plusieurs appareils, vide = appareil unique)
+    DEVICES_FILE = os.getenv('DEVICES_FILE', '')
+    FLEET_WORKERS = int(os.getenv('FLEET_WORKERS', '8'))
+    FLEET_REPORT_INTERVAL = int(os.getenv('FLEET_REPORT_INTERVAL', '15'))
+    METRICS_FILE = os.getenv('METRICS_FILE', '')
 
     # API
     API_URL = os.getenv('API_URL', 'BACKEND_URL')
     API_TIMEOUT = int(os.getenv('API_TIMEOUT', '30'))
+    API_BATCH_SIZE = int(os.getenv('API_BATCH_SIZE', '500'))
+    API_BATCH_BYTES = int(os.getenv('API_BATCH_BYTES', '1048576'))
+    API_GZIP = os.getenv('API_GZIP', 'false').lower() in ('1', 'true', 'yes')
+    API_SERIALIZER = os.getenv('API_SERIALIZER', 'auto')
+
+    # Client HTTP (session partagée, pool de connexions)
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '0'))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+    HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', '0.5'))
+    HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '10'))
 
     # Synchronisation
     SYNC_INTERVAL = int(os.getenv('SYNC_INTERVAL', '5'))
+    SYNC_INTERVAL_SECONDS = int(os.getenv('SYNC_INTERVAL_SECONDS', '0'))
     SYNC_FILE = os.getenv('SYNC_FILE', 'sync_state.json')
     MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
     RETRY_DELAY = int(os.getenv('RETRY_DELAY', '10'))
+    RETRY_DELAY_MAX = int(os.getenv('RETRY_DELAY_MAX', '300'))
+    BREAKER_THRESHOLD = int(os.getenv('BREAKER_THRESHOLD', '5'))
+    BREAKER_RESET = int(os.getenv('BREAKER_RESET', '300'))
+    INCREMENTAL_SYNC = os.getenv('INCREMENTAL_SYNC', 'true').lower() in ('1', 'true', 'yes')
+    USERS_CACHE_TTL = int(os.getenv('USERS_CACHE_TTL', '3600'))
+    PERSISTENT_SESSION = os.getenv('PERSISTENT_SESSION', 'false').lower() in ('1', 'true', 'yes')
+    KEEPALIVE_INTERVAL = int(os.getenv('KEEPALIVE_INTERVAL', '60'))
+
+    # Outbox locale (présences en attente d'envoi)
+    OUTBOX_FILE = os.getenv('OUTBOX_FILE', 'outbox.db')
+    OUTBOX_DELIVERY_INTERVAL = int(os.getenv('OUTBOX_DELIVERY_INTERVAL', '60'))
+    OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', '30'))
+
+    # Rotation du log des appareils (vidé une fois archivé dans l'outbox et livré)
+    LOG_ROTATION = os.getenv('LOG_ROTATION', 'false').lower() in ('1', 'true', 'yes')
+    LOG_ROTATION_THRESHOLD = float(os.getenv('LOG_ROTATION_THRESHOLD', '0.8'))
+
+    # Temps réel (live_capture, micro-lots et balayage de rattrapage)
+    REALTIME_MODE = os.getenv('REALTIME_MODE', 'false').lower() in ('1', 'true', 'yes')
+    REALTIME_BATCH_SIZE = int(os.getenv('REALTIME_BATCH_SIZE', '50'))
+    REALTIME_FLUSH_MS = int(os.getenv('REALTIME_FLUSH_MS', '300'))
+    REALTIME_RECONCILE_INTERVAL = int(os.getenv('REALTIME_RECONCILE_INTERVAL', '15'))
 
     # Logging
     LOG_FILE = os.getenv('LOG_FILE', 'zkteco_sync.log')
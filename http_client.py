@@ -0,0 +1,75 @@
+"""Client HTTP partagé : session requests avec pool de connexions et keep-alive"""
+import logging
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config
+from resilience import backoff
+
+logger = logging.getLogger(__name__)
+
+# Statuts temporaires pour lesquels un envoi est retenté
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Session partagée (créée au premier appel), un pool par hôte"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = config.HTTP_POOL_SIZE or max(config.FLEET_WORKERS, 1)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def close() -> None:
+    """Ferme les connexions du pool"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def post(url: str, retries: Optional[int] = None, timeout: Optional[float] = None,
+         **kwargs) -> requests.Response:
+    """POST via la session partagée
+
+    Les erreurs de connexion, délais dépassés et statuts temporaires sont
+    retentés `retries` fois (HTTP_RETRIES par défaut). À réserver aux envois
+    idempotents, les autres passent retries=0.
+
+    Args:
+        url: URL appelée
+        retries: Nombre de nouvelles tentatives
+        timeout: Délai de lecture en secondes (API_TIMEOUT par défaut)
+        **kwargs: Paramètres de requests (data, json, headers, verify...)
+    """
+    retries = config.HTTP_RETRIES if retries is None else retries
+    timeout = (config.HTTP_CONNECT_TIMEOUT, timeout or config.API_TIMEOUT)
+    session = get_session()
+    for attempt in range(retries + 1):
+        try:
+            response = session.post(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            error = str(e)
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            error = f"HTTP {response.status_code}"
+        delay = backoff(attempt, config.HTTP_BACKOFF, config.HTTP_BACKOFF_MAX)
+        logger.warning(f"POST {url} échoué ({error}), nouvel essai dans {delay:.1f}s")
+        time.sleep(delay)
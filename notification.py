@@ -1,4 +1,5 @@
 from config import config
+import http_client
 import requests
 import logging
 from datetime import datetime
@@ -146,7 +147,8 @@ def send_email_notification(subject: str, message: str, html: bool = True):
         logger.debug(f"Envoi email vers {API_ENDPOINT_SEND_MAIL}")
         logger.debug(f"Destinataires: {recipients}")
 
-        response = requests.post(API_ENDPOINT_SEND_MAIL, json=data, timeout=30, verify=False)
+        # Un email n'est pas idempotent : pas de nouvel essai
+        response = http_client.post(API_ENDPOINT_SEND_MAIL, retries=0, timeout=30, json=data, verify=False)
 
         if response.status_code != 200:
             logger.error(f"Erreur API ({response.status_code}): {response.text}")
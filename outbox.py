@@ -0,0 +1,142 @@
+"""Outbox locale (SQLite en mode WAL) entre la lecture des appareils et l'API"""
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS punches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created REAL NOT NULL,
+    acked REAL,
+    UNIQUE (device, user_id, timestamp)
+);
+CREATE INDEX IF NOT EXISTS punches_pending ON punches (device, acked, timestamp);
+CREATE TABLE IF NOT EXISTS archive (
+    device TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    acked REAL NOT NULL,
+    UNIQUE (device, user_id, timestamp)
+);
+"""
+
+ARCHIVE = (
+    "INSERT OR IGNORE INTO archive (device, user_id, timestamp, acked) "
+    "SELECT device, user_id, timestamp, acked FROM punches WHERE acked IS NOT NULL"
+)
+
+
+class Outbox:
+    """Présences en attente d'envoi, clé unique (appareil, matricule, horodatage)
+
+    Les lignes acquittées sont conservées `retention_days` jours : une
+    présence relue (balayage, lecture complète) n'est pas renvoyée. La table
+    archive, jamais purgée, garde celles dont le log de l'appareil a été vidé.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db: Optional[sqlite3.Connection] = None
+
+    def connection(self) -> sqlite3.Connection:
+        """Ouvre la base au premier accès (appelé sous le verrou)"""
+        if self.db is None:
+            db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(SCHEMA)
+            self.db = db
+        return self.db
+
+    def add(self, device: str, presences: List[Dict]) -> int:
+        """Stocke des présences, les doublons sont ignorés
+
+        Returns:
+            Nombre de nouvelles présences
+        """
+        if not presences:
+            return 0
+        now = time.time()
+        rows = [(device, p['matricule'], p['timestamp'], now) for p in presences]
+        with self.lock:
+            db = self.connection()
+            with db:
+                before = db.total_changes
+                db.executemany(
+                    "INSERT OR IGNORE INTO punches (device, user_id, timestamp, created) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                return db.total_changes - before
+
+    def pending(self, device: str, limit: int) -> List[Tuple[int, Dict]]:
+        """Prochaines présences non acquittées d'un appareil, par horodatage
+
+        Returns:
+            Liste de (id, présence)
+        """
+        with self.lock:
+            rows = self.connection().execute(
+                "SELECT id, user_id, timestamp FROM punches WHERE device = ? AND acked IS NULL "
+                "ORDER BY timestamp, id LIMIT ?",
+                (device, limit)
+            ).fetchall()
+        return [(row[0], {'matricule': row[1], 'timestamp': row[2]}) for row in rows]
+
+    def ack(self, ids: List[int]) -> None:
+        """Marque des présences comme reçues par l'API"""
+        now = time.time()
+        with self.lock:
+            db = self.connection()
+            with db:
+                db.executemany("UPDATE punches SET acked = ? WHERE id = ?", [(now, i) for i in ids])
+
+    def count(self, device: Optional[str] = None) -> int:
+        """Nombre de présences en attente (d'un appareil ou de toutes)"""
+        query = "SELECT COUNT(*) FROM punches WHERE acked IS NULL"
+        args: Tuple = ()
+        if device is not None:
+            query += " AND device = ?"
+            args = (device,)
+        with self.lock:
+            return self.connection().execute(query, args).fetchone()[0]
+
+    def archive(self, device: str) -> int:
+        """Copie les présences acquittées d'un appareil dans l'archive
+
+        Returns:
+            Nombre de présences ajoutées à l'archive
+        """
+        with self.lock:
+            db = self.connection()
+            with db:
+                return db.execute(ARCHIVE + " AND device = ?", (device,)).rowcount
+
+    def purge(self, retention_days: int, archive: bool = False) -> int:
+        """Supprime les présences acquittées depuis plus de `retention_days` jours
+
+        Args:
+            retention_days: Durée de conservation
+            archive: Copie d'abord les présences supprimées dans l'archive
+                (seule copie une fois le log de l'appareil vidé)
+        """
+        limit = time.time() - retention_days * 86400
+        with self.lock:
+            db = self.connection()
+            with db:
+                if archive:
+                    db.execute(ARCHIVE + " AND acked < ?", (limit,))
+                return db.execute(
+                    "DELETE FROM punches WHERE acked IS NOT NULL AND acked < ?", (limit,)
+                ).rowcount
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
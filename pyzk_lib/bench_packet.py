@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+micro benchmark of the packet framing (checksum + header)
+
+compares the original byte by byte implementation with zk.base
+"""
+import sys
+import os
+import argparse
+import timeit
+from struct import pack, unpack
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from zk import const
+from zk.base import create_checksum, create_header
+
+
+def legacy_checksum(p):
+    """ original ZK.__create_checksum """
+    l = len(p)
+    checksum = 0
+    while l > 1:
+        checksum += unpack('H', pack('BB', p[0], p[1]))[0]
+        p = p[2:]
+        if checksum > const.USHRT_MAX:
+            checksum -= const.USHRT_MAX
+        l -= 2
+    if l:
+        checksum = checksum + p[-1]
+    while checksum > const.USHRT_MAX:
+        checksum -= const.USHRT_MAX
+    checksum = ~checksum
+    while checksum < 0:
+        checksum += const.USHRT_MAX
+    return pack('H', checksum)
+
+
+def legacy_header(command, command_string, session_id, reply_id):
+    """ original ZK.__create_header """
+    buf = pack('<4H', command, 0, session_id, reply_id) + command_string
+    buf = unpack('8B' + '%sB' % len(command_string), buf)
+    checksum = unpack('H', legacy_checksum(buf))[0]
+    reply_id += 1
+    if reply_id >= const.USHRT_MAX:
+        reply_id -= const.USHRT_MAX
+    buf = pack('<4H', command, checksum, session_id, reply_id)
+    return buf + command_string
+
+
+parser = argparse.ArgumentParser(description='ZK packet framing benchmark')
+parser.add_argument('-n', '--number', type=int,
+                    help='runs per measure [auto]', default=0)
+parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                    help='payload sizes in bytes [1024 65536]', default=[1024, 65536])
+args = parser.parse_args()
+
+for size in args.sizes:
+    payload = os.urandom(size)
+    assert legacy_header(const.CMD_DATA, payload, 1234, 42) == create_header(const.CMD_DATA, payload, 1234, 42)
+    assert unpack('H', legacy_checksum(payload))[0] == create_checksum(payload)
+    results = []
+    for name, function in (('legacy', legacy_header), ('current', create_header)):
+        timer = timeit.Timer(lambda: function(const.CMD_DATA, payload, 1234, 42))
+        number = args.number or timer.autorange()[0]
+        best = min(timer.repeat(repeat=3, number=number)) / number
+        results.append(best)
+        print ('{:>6} bytes {:>8}: {:>10.2f} us/packet'.format(size, name, best * 1e6))
+    print ('{:>6} bytes  speedup: {:>10.1f}x'.format(size, results[0] / results[1]))
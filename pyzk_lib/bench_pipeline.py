@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+benchmark of pipelined buffered reads against a local fake device
+
+the fake device answers over TCP on localhost, each reply is delayed by
+the simulated round trip time, as a device behind a WAN link would.
+"""
+import sys
+import os
+import argparse
+import threading
+import time
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from struct import pack, unpack
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from zk import ZK, const
+from zk.base import HEADER, TCP_TOP, create_tcp_top
+
+
+class FakeDevice(object):
+    """ minimal TCP device serving one prepared buffer """
+    def __init__(self, buffer, rtt):
+        self.buffer = buffer
+        self.rtt = rtt
+        self.server = socket(AF_INET, SOCK_STREAM)
+        self.server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            client, _ = self.server.accept()
+            self.handle(client)
+
+    def recv_exact(self, client, size):
+        data = b''
+        while len(data) < size:
+            more = client.recv(size - len(data))
+            if not more:
+                return None
+            data += more
+        return data
+
+    def reply(self, command, reply_id, data=b''):
+        return create_tcp_top(HEADER.pack(command, 0, 1234, reply_id) + data)
+
+    def handle(self, client):
+        replies = []
+        ready = threading.Condition()
+
+        def writer():
+            while True:
+                with ready:
+                    while not replies:
+                        ready.wait()
+                    due, packet = replies.pop(0)
+                if packet is None:
+                    return
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                client.sendall(packet)
+
+        thread = threading.Thread(target=writer)
+        thread.daemon = True
+        thread.start()
+        while True:
+            top = self.recv_exact(client, 8)
+            if top is None:
+                break
+            length = TCP_TOP.unpack(top)[2]
+            packet = self.recv_exact(client, length)
+            command, _checksum, _session_id, reply_id = HEADER.unpack_from(packet)
+            if command == const._CMD_PREPARE_BUFFER:
+                answer = self.reply(const.CMD_ACK_OK, reply_id, b'\x00' + pack('<I', len(self.buffer)))
+            elif command == const._CMD_READ_BUFFER:
+                start, size = unpack('<ii', packet[8:16])
+                answer = self.reply(const.CMD_DATA, reply_id, self.buffer[start:start + size])
+            else:
+                answer = self.reply(const.CMD_ACK_OK, reply_id)
+            with ready:
+                replies.append((time.time() + self.rtt, answer))
+                ready.notify()
+            if command == const.CMD_EXIT:
+                break
+        with ready:
+            replies.append((0, None))
+            ready.notify()
+        thread.join()
+        client.close()
+
+
+parser = argparse.ArgumentParser(description='ZK pipelined read benchmark')
+parser.add_argument('-s', '--size', type=int,
+                    help='buffer size in bytes [2000000]', default=2000000)
+parser.add_argument('-r', '--rtt', type=float,
+                    help='simulated round trip time in ms [40]', default=40.0)
+parser.add_argument('-w', '--windows', type=int, nargs='+',
+                    help='read windows to compare [1 2 4 8]', default=[1, 2, 4, 8])
+args = parser.parse_args()
+
+buffer = os.urandom(args.size)
+device = FakeDevice(buffer, args.rtt / 1000.0)
+print ('{} bytes, rtt {} ms'.format(args.size, args.rtt))
+baseline = None
+for window in args.windows:
+    zk = ZK('127.0.0.1', port=device.port, ommit_ping=True, read_window=window)
+    conn = zk.connect()
+    begin = time.time()
+    data, size = conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+    elapsed = time.time() - begin
+    conn.disconnect()
+    assert bytes(data) == buffer
+    baseline = baseline or elapsed
+    print ('window {:>2}: {:>7.3f} s {:>8.2f} MB/s  speedup {:>5.1f}x'.format(
+        window, elapsed, size / elapsed / 1e6, baseline / elapsed))
@@ -6,6 +6,12 @@ import os
 import unittest
 import codecs
 import json
+import tempfile
+import asyncio
+import threading
+from socket import timeout
+from datetime import datetime
+from struct import pack, unpack
 
 if sys.version_info[0] < 3:
     from mock import patch, Mock, MagicMock
@@ -14,12 +20,15 @@ else:
     
 mock_socket = MagicMock(name='zk.socket')
 sys.modules['zk.socket'] = mock_socket
-from zk import ZK, const
-from zk.base import ZK_helper
-from zk.user import User
+from zk import ZK, AsyncZK, const
+from zk.base import ZK_helper, create_checksum
+from zk import decoders, timecodec
+from zk.chunk import ChunkController, ChunkStore
+from zk.user import User, UserIndex
 from zk.finger import Finger
 from zk.attendance import Attendance
-from zk.exception import ZKErrorResponse, ZKNetworkError
+from zk.batch import AttendanceBatch, from_epoch, to_epoch
+from zk.exception import ZKErrorConnection, ZKErrorResponse, ZKNetworkError
 
 try:
     unittest.TestCase.assertRaisesRegex
@@ -49,6 +58,78 @@ def dump(obj, nested_level=0, output=sys.stdout):
         print >> output, '%s%s' % (nested_level * spacing, obj)
 
 
+def tcp_packet(command, data=b'', reply_id=0, session_id=0):
+    """ build a device tcp response """
+    payload = pack('<4H', command, 0, session_id, reply_id) + data
+    return pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(payload)) + payload
+
+def udp_packet(command, data=b'', reply_id=0, session_id=0):
+    """ build a device udp response """
+    return pack('<4H', command, 0, session_id, reply_id) + data
+
+def sizes_packet(users=0, records=0, rec_cap=100000, packet=tcp_packet):
+    """ build a CMD_GET_FREE_SIZES response """
+    fields = [0] * 20
+    fields[4] = users
+    fields[8] = records
+    fields[16] = rec_cap
+    return packet(const.CMD_ACK_OK, pack('20i', *fields))
+
+def attendance_record(uid, timestamp, status=1, punch=0):
+    """ build a 8 bytes attendance record """
+    t = (
+        ((timestamp.year % 100) * 12 * 31 + ((timestamp.month - 1) * 31) + timestamp.day - 1) *
+        (24 * 60 * 60) + (timestamp.hour * 60 + timestamp.minute) * 60 + timestamp.second
+    )
+    return pack('<HBIB', uid, status, t, punch)
+
+class FakeStream(object):
+    """
+    device responses, recv returns the next one, recv_into keeps what does
+    not fit. Responses without a reply_id echo the one of the last command
+    sent, as the device does
+    """
+    def __init__(self, responses):
+        self.responses = iter(responses)
+        self.pending = b''
+        self.reply_id = 0
+
+    def send(self, packet, address=None):
+        offset = 14 if address is None else 6 # tcp top
+        self.reply_id = unpack('<H', packet[offset:offset + 2])[0]
+        return len(packet)
+
+    def next(self):
+        if self.pending:
+            data, self.pending = self.pending, b''
+            return data
+        data = next(self.responses)
+        if isinstance(data, BaseException):
+            raise data # e.g. a socket timeout
+        offset = 14 if data[:4] == pack('<HH', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2) else 6
+        if len(data) >= offset + 2 and not unpack('<H', data[offset:offset + 2])[0]:
+            data = data[:offset] + pack('<H', self.reply_id) + data[offset + 2:]
+        return data
+
+    def recv(self, size):
+        return self.next()
+
+    def recv_into(self, buffer, nbytes=0):
+        data = self.next()
+        size = min(len(data), nbytes or len(buffer), len(buffer))
+        buffer[:size] = data[:size]
+        self.pending = data[size:]
+        return size
+
+def stream(socket, responses):
+    """ feed the mocked socket with device responses """
+    fake = FakeStream(responses)
+    socket.return_value.recv.side_effect = fake.recv
+    socket.return_value.recv_into.side_effect = fake.recv_into
+    socket.return_value.send.side_effect = fake.send
+    socket.return_value.sendto.side_effect = fake.send
+
+
 class PYZKTest(unittest.TestCase):
     def setup(self):
 
@@ -119,6 +200,22 @@ class PYZKTest(unittest.TestCase):
         conn.disconnect()
         socket.return_value.sendto.assert_called_with(codecs.decode('e903e6002ffb0100', 'hex'), ('192.168.1.201', 4370))
 
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_force_udp_no_tcp_probe(self, helper, socket):
+        """ UDP only device: CMD_CONNECT is the reachability check, not a tcp probe """
+        helper.return_value.test_ping.return_value = False # tcp port closed
+        socket.return_value.recv.return_value = codecs.decode('d007fffc2ffb0000','hex') # CMD_ACK_OK
+        #begin
+        zk = ZK('192.168.1.201', force_udp=True)
+        conn = zk.connect()
+        self.assertTrue(conn.is_connect)
+        helper.return_value.test_ping.assert_not_called()
+        conn.disconnect()
+        socket.return_value.recv.side_effect = timeout('timed out')
+        self.assertRaisesRegex(ZKNetworkError, "can't reach device", zk.connect)
+        socket.return_value.close.assert_called()
+
     @patch('zk.base.socket')
     @patch('zk.base.ZK_helper')
     def test_udp_connect(self, helper, socket):
@@ -139,10 +236,10 @@ class PYZKTest(unittest.TestCase):
         """ Basic unauth test """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d5075bb2cf450000', 'hex'), # tcp CMD_UNAUTH
             codecs.decode('5050827d08000000d5075ab2cf450100', 'hex') # tcp CMD_UNAUTH
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', password=12)
         self.assertRaisesRegex(ZKErrorResponse, "Unauthenticated", zk.connect)
@@ -154,12 +251,12 @@ class PYZKTest(unittest.TestCase):
         """ Basic auth test """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d5075bb2cf450000', 'hex'), # tcp CMD_UNAUTH
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex') # tcp random CMD_ACK_OK TODO: generate proper sequenced response
 
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', password=45)
         conn = zk.connect()
@@ -173,11 +270,11 @@ class PYZKTest(unittest.TestCase):
         """ can read sizes? """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'), # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') # already tested
         conn = zk.connect()
@@ -198,13 +295,13 @@ class PYZKTest(unittest.TestCase):
         """ can get empty? """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d04020000dd05942c96631500f801000001000e0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003830380000000000000000000000000000000000000000000200000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003832310000000000000000000000000000000000000000000300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833350000000000000000000000000000000000000000000400000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833310000000000000000000000000000000000000000000500000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833320000000000000000000000000000000000000000000600000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003836000000000000000000000000000000000000000000000c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000383432000000000000000000000000000000000000000000','hex'), #DATA directly(not ok)
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'), # tcp random CMD_ACK_OK TODO: generate proper sequenced response
             #codecs.decode('5050827d08000000d00745b2cf451b00', 'hex')  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201' )
         conn = zk.connect()
@@ -230,7 +327,7 @@ class PYZKTest(unittest.TestCase):
         """ test case for K20 """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d007d7d758200000','hex'), #ACK Ok
             codecs.decode('5050827d58000000d0074c49582013000000000000000000000000000000000002000000000000000000000000000000000000000000000007000000000000000000000000000000f4010000f401000050c30000f4010000f201000050c30000','hex'),#Sizes
             codecs.decode('5050827d9c000000dd053c87582015009000000001000000000000000000006366756c616e6f0000000000000000000000000000000000000000000000000000000000003130303030316c70000000000000000000000000000000000200000000000000000000726d656e67616e6f0000000000000000000000000000000000','hex'),#DATA112
@@ -239,7 +336,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for get_users TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for free_data TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for exit      TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') #, verbose=True)
         conn = zk.connect()
@@ -267,7 +364,7 @@ class PYZKTest(unittest.TestCase):
         """ tst case for https://github.com/fananimi/pyzk/pull/18#issuecomment-406250746 """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d09000000d007babb5c3c100009', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d58000000d007292c5c3c13000000000000000000000000000000000046000000000000004600000000000000990c0000000000001a010000000000000600000006000000f4010000f401000050c30000ae010000ae010000b7b60000', 'hex'), #sizes
             codecs.decode('5050827d15000000d007a7625c3c150000b4130000b4130000cdef2300','hex'), #PREPARE_BUFFER -> OK 5044
@@ -310,7 +407,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for get_users TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for free_data TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for exit      TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') # , verbose=True)
         conn = zk.connect()
@@ -337,13 +434,13 @@ class PYZKTest(unittest.TestCase):
         """ can get empty? """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d15000000d007acf93064160000941d0000941d0000b400be00', 'hex'), # ack ok with size 7572
             codecs.decode('5050827d10000000dc05477830641700941d000000000100', 'hex'), #prepare data
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'), # tcp random CMD_ACK_OK TODO: generate proper sequenced response
             #codecs.decode('5050827d08000000d00745b2cf451b00', 'hex')  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', verbose=True)
         conn = zk.connect()
@@ -368,7 +465,7 @@ class PYZKTest(unittest.TestCase):
         """ cchekc correct template 1 """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d10000000dc055558d0983200dc040000f0030000', 'hex'), # tcp PREPARE_DATA 1244
             codecs.decode('5050827df8030000dd0500f4000032004d9853533231000004dbda0408050709ced000001cda69010000008406316adb0c0012062900d000aad221001600390caf001cdbb106240031007e033bdb3b00e9067700850083d42b004300c503f40043dbd6037b005000460ea7db5900910f90009f0012d5e7005c00970a5f006ddb', 'hex'), # DATA (tcp 1016, actual 112?)
@@ -386,7 +483,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('07283b590300fef3f5f800da10f5494b031000071819061035084365650b14900834c0c1c4c104c1c5a302100e1134c1c01045c83c8806110e2185c22edd11082424fec006ff02cb052834c3c073c910d4eb965b3833ff0bc582cce18d876a051106f337f826c00410013d2b05c200ca003f4cfeff03d56454ccc101', 'hex'),  # raw 124
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             #codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', verbose=True)
         conn = zk.connect()
@@ -403,7 +500,7 @@ class PYZKTest(unittest.TestCase):
         """ cchekc correct template 1 fixed"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d10000000dc055558d0983200dc040000f0030000', 'hex'), # tcp PREPARE_DATA 1244
             codecs.decode('5050827df8030000dd0500f4000032004d9853533231000004dbda0408050709ced000001cda69010000008406316adb0c0012062900d000aad221001600390caf001cdbb106240031007e033bdb3b00e9067700850083d42b004300c503f40043dbd6037b005000460ea7db5900910f90009f0012d5e7005c00970a5f006ddb930fa1009a00560f86db9d00820e86006f007dd3f400ab00a60fcd01b7dbb00b4b00bd0079083adbc00045035d000600c1df7300cc0039049e00dddb380e8c00da00e30dd8dbdc00220e130027004dd9f500e3009d0a6a00e9db26090001ef00ea03c5dbf0002306', 'hex'), # DATA (tcp 1016, actual 112 +104
@@ -416,7 +513,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('07283b590300fef3f5f800da10f5494b031000071819061035084365650b14900834c0c1c4c104c1c5a302100e1134c1c01045c83c8806110e2185c22edd11082424fec006ff02cb052834c3c073c910d4eb965b3833ff0bc582cce18d876a051106f337f826c00410013d2b05c200ca003f4cfeff03d56454ccc101', 'hex'),  # raw 124
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') #, verbose=True)
         conn = zk.connect()
@@ -433,7 +530,7 @@ class PYZKTest(unittest.TestCase):
         """ cchekc correct template 2 fixed"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d10000000dc053b59d0983500f3030000f0030000', 'hex'), # tcp PREPARE_DATA 1011
             codecs.decode('5050827df8030000dd056855000035004ab153533231000003f2f10408050709ced000001bf36901000000831f256cf23e00740f4c008900f2f879005500fe0fe3005bf2d30a60005c00a00f32f26600580a2700ad00e3fd98007500800f000082f21a0f68008300300e5bf28d00570930004b00dafd4c009a00dd090900a8f2270f8600ad008a0b1ff2b000480f4400730040fc5400b800430f4400c6f2370ab100ca00f30ecbf2cb002f0f4a001300c7fdaa00e400b50c4300e6f2b706bf00ea00f90668f2f2002e0dad003000b7f7cf00f600350cbe0008f31f0dd0000c017101cbf20f019c01', 'hex'), # DATA (tcp 1016, actual 112 +104
@@ -446,7 +543,7 @@ class PYZKTest(unittest.TestCase):
 
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201')#, verbose=True)
         conn = zk.connect()
@@ -463,7 +560,7 @@ class PYZKTest(unittest.TestCase):
         """ check live_capture 12 bytes"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d04020000dd05942c96631500f801000001000e0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003830380000000000000000000000000000000000000000000200000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003832310000000000000000000000000000000000000000000300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833350000000000000000000000000000000000000000000400000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833310000000000000000000000000000000000000000000500000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833320000000000000000000000000000000000000000000600000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003836000000000000000000000000000000000000000000000c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000383432000000000000000000000000000000000000000000','hex'), #DATA directly(not ok)
@@ -473,7 +570,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827df8030000f401ae4301000000f19449000000120c07130906', 'hex'), # reg_event!
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201')#, verbose=True)
         conn = zk.connect()
@@ -490,7 +587,7 @@ class PYZKTest(unittest.TestCase):
         """ check live_capture 32 bytes"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d04020000dd05942c96631500f801000001000e0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003830380000000000000000000000000000000000000000000200000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003832310000000000000000000000000000000000000000000300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833350000000000000000000000000000000000000000000400000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833310000000000000000000000000000000000000000000500000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833320000000000000000000000000000000000000000000600000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003836000000000000000000000000000000000000000000000c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000383432000000000000000000000000000000000000000000','hex'), #DATA directly(not ok)
@@ -500,7 +597,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827df8030000f401ae43010000003131343030363400000000000000000000000000000000000f00120b1d0c3703', 'hex'), # reg_event!
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201')#, verbose=True)
         conn = zk.connect()
@@ -511,6 +608,744 @@ class PYZKTest(unittest.TestCase):
             self.assertEqual(att.user_id, "1140064", "incorrect user_id %s" % att.user_id)
         conn.disconnect()
 
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_new_attendance(self, helper, socket):
+        """ incremental read only downloads the new records """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [
+            attendance_record(1, datetime(2026, 1, 5, 8, 0, 0)),
+            attendance_record(2, datetime(2026, 1, 5, 8, 1, 0)),
+            attendance_record(1, datetime(2026, 1, 5, 17, 30, 0)),
+        ]
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=3),
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 24)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 24)), # buffer header
+            tcp_packet(const.CMD_DATA, b''.join(records[1:])), # last known record + new one
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        cursor = {'records': 2, 'record_size': 8, 'offset': 20, 'tail': codecs.encode(records[1], 'hex').decode('ascii')}
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        attendances, new_cursor = conn.get_new_attendance(cursor)
+        sent = [c[0][0] for c in socket.return_value.send.call_args_list]
+        self.assertTrue(sent[4].endswith(pack('<ii', 12, 16)), "tail not read from the cursor")
+        conn.disconnect()
+        self.assertEqual(len(attendances), 1, "incorrect size %s" % len(attendances))
+        self.assertEqual(attendances[0].user_id, "1")
+        self.assertEqual(attendances[0].timestamp, datetime(2026, 1, 5, 17, 30, 0))
+        self.assertTrue(new_cursor['incremental'])
+        self.assertEqual(new_cursor['records'], 3)
+        self.assertEqual(new_cursor['offset'], 28)
+        self.assertEqual(new_cursor['tail'], codecs.encode(records[2], 'hex').decode('ascii'))
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_new_attendance_replaced_log(self, helper, socket):
+        """ full read when the last known record is gone """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [
+            attendance_record(3, datetime(2026, 2, 1, 8, 0, 0)),
+            attendance_record(4, datetime(2026, 2, 1, 8, 5, 0)),
+            attendance_record(5, datetime(2026, 2, 1, 8, 9, 0)),
+        ]
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=3),
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 24)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 24)), # buffer header
+            tcp_packet(const.CMD_DATA, b''.join(records[1:])), # not the last known record
+            tcp_packet(const.CMD_DATA, b''.join(records)), # full read
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        cursor = {'records': 2, 'record_size': 8, 'offset': 20, 'tail': '0100010000000000'}
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        attendances, new_cursor = conn.get_new_attendance(cursor)
+        conn.disconnect()
+        self.assertEqual(len(attendances), 3, "incorrect size %s" % len(attendances))
+        self.assertFalse(new_cursor['incremental'])
+        self.assertEqual(new_cursor['records'], 3)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_new_attendance_nothing_new(self, helper, socket):
+        """ same record count: only read sizes """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=2),
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        cursor = {'records': 2, 'record_size': 8, 'offset': 20, 'tail': '0100010000000000'}
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        attendances, new_cursor = conn.get_new_attendance(cursor)
+        conn.disconnect()
+        self.assertEqual(attendances, [])
+        self.assertEqual(new_cursor['records'], 2)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_new_attendance_digest(self, helper, socket):
+        """ the cursor digest covers the last records, not only the tail """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [
+            attendance_record(1, datetime(2026, 3, 2, 8, 0, 0)),
+            attendance_record(2, datetime(2026, 3, 2, 8, 0, 0)),
+            attendance_record(1, datetime(2026, 3, 2, 12, 0, 0)),
+            attendance_record(2, datetime(2026, 3, 2, 12, 30, 0)),
+        ]
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=2),
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 16)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 16)), # buffer header
+            tcp_packet(const.CMD_DATA, b''.join(records[:2])), # full read
+            tcp_packet(const.CMD_ACK_OK), # free data
+            sizes_packet(records=3),
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 24)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 24)), # buffer header
+            tcp_packet(const.CMD_DATA, b''.join(records[:3])), # known records + new one
+            tcp_packet(const.CMD_ACK_OK), # free data
+            sizes_packet(records=4),
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 32)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 32)), # buffer header
+            tcp_packet(const.CMD_DATA, b''.join(records[3:] + records[1:3] + records[3:])), # first record replaced
+            tcp_packet(const.CMD_DATA, b''.join(records[3:] + records[1:3] + records[3:])), # full read
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        attendances, cursor = conn.get_new_attendance()
+        self.assertEqual(len(attendances), 2)
+        self.assertEqual(cursor['depth'], 2)
+        attendances, cursor = conn.get_new_attendance(cursor)
+        sent = [c[0][0] for c in socket.return_value.send.call_args_list]
+        self.assertTrue(sent[-2].endswith(pack('<ii', 4, 24)), "known records not read back")
+        self.assertTrue(cursor['incremental'])
+        self.assertEqual(len(attendances), 1, "same second punches must not be lost")
+        self.assertEqual(attendances[0].timestamp, datetime(2026, 3, 2, 12, 0, 0))
+        self.assertEqual(cursor['depth'], 3)
+        attendances, cursor = conn.get_new_attendance(cursor)
+        conn.disconnect()
+        self.assertFalse(cursor['incremental'], "replaced record not detected")
+        self.assertEqual(len(attendances), 4)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_new_attendance_batch(self, helper, socket):
+        """ columnar batch: filter, sort, slice and payload """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [
+            attendance_record(2, datetime(2026, 4, 1, 8, 5, 0)),
+            attendance_record(1, datetime(2026, 4, 1, 8, 0, 0)),
+            attendance_record(2, datetime(2026, 4, 1, 17, 0, 0)),
+        ]
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=3),
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 24)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 24)), # buffer header
+            tcp_packet(const.CMD_DATA, b''.join(records)), # full read
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        batch, cursor = conn.get_new_attendance(batch=True)
+        conn.disconnect()
+        self.assertIsInstance(batch, AttendanceBatch)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.user_ids, ['2', '1'], "user ids not interned")
+        self.assertEqual(cursor['records'], 3)
+        batch = batch.sort()
+        self.assertEqual([att.user_id for att in batch], ['1', '2', '2'])
+        self.assertEqual(batch[-1].timestamp, datetime(2026, 4, 1, 17, 0, 0))
+        self.assertEqual(len(batch[1:]), 2)
+        self.assertEqual(from_epoch(batch.max_time()), datetime(2026, 4, 1, 17, 0, 0))
+        recent = batch.filter(since=datetime(2026, 4, 1, 8, 5, 0), until=datetime(2026, 4, 1, 12, 0, 0))
+        self.assertEqual(recent.to_payload(), [{'matricule': '2', 'timestamp': '2026-04-01T08:05:00'}])
+        self.assertEqual(len(batch.filter(since=to_epoch(datetime(2026, 4, 2)))), 0)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_since_until(self, helper, socket):
+        """ time bounds applied to the raw device time """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [attendance_record(i, datetime(2026, 4, 1, 8 + i, 0, 0)) for i in range(6)]
+        buffer = pack('<I', 8 * 6) + b''.join(records)
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=6), # no users
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer))), # prepare buffer
+            tcp_packet(const.CMD_DATA, buffer),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        since, until = datetime(2026, 4, 1, 10, 0, 0), datetime(2026, 4, 1, 12, 0, 0)
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        attendances = conn.get_attendance(since=since, until=until)
+        conn.disconnect()
+        self.assertEqual([att.user_id for att in attendances], ['2', '3'])
+        self.assertEqual(attendances[0].timestamp, since) # since included, until excluded
+        users = UserIndex()
+        for backend in decoders.BACKENDS:
+            if backend == 'numpy' and decoders.numpy is None:
+                continue
+            columns = decoders.decode_attendance(buffer[4:], 8, users, backend, since=since)
+            self.assertEqual(list(columns['user_id']), ['2', '3', '4', '5'], backend)
+        self.assertEqual(timecodec.device_bounds(datetime(2026, 4, 1, 10, 0, 0, 500)),
+                         (timecodec.encode_time(since) + 1, timecodec.DEVICE_MAX))
+        self.assertEqual(timecodec.device_bounds(datetime(1999, 12, 31), datetime(2100, 1, 1)),
+                         (0, timecodec.DEVICE_MAX))
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_clear_attendance_checked(self, helper, socket):
+        """ the log is cleared only when the count matches, device disabled """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            tcp_packet(const.CMD_ACK_OK), # disable device
+            sizes_packet(records=5), # a punch was recorded since
+            tcp_packet(const.CMD_ACK_OK), # enable device
+            tcp_packet(const.CMD_ACK_OK), # disable device
+            sizes_packet(records=4),
+            tcp_packet(const.CMD_ACK_OK), # clear attendance
+            tcp_packet(const.CMD_ACK_OK), # enable device
+            tcp_packet(const.CMD_ACK_OK), # disable device (caller)
+            sizes_packet(records=0),
+            tcp_packet(const.CMD_ACK_OK), # clear attendance
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        self.assertFalse(conn.clear_attendance_checked(4))
+        self.assertTrue(conn.clear_attendance_checked(4))
+        conn.disable_device()
+        self.assertTrue(conn.clear_attendance_checked(0))
+        self.assertFalse(conn.is_enabled, "disabled by the caller, left disabled")
+        conn.disconnect()
+        sent = [unpack('<H', c[0][0][8:10])[0] for c in socket.return_value.send.call_args_list]
+        self.assertEqual(sent[1:], [
+            const.CMD_DISABLEDEVICE, const.CMD_GET_FREE_SIZES, const.CMD_ENABLEDEVICE,
+            const.CMD_DISABLEDEVICE, const.CMD_GET_FREE_SIZES, const.CMD_CLEAR_ATTLOG, const.CMD_ENABLEDEVICE,
+            const.CMD_DISABLEDEVICE, const.CMD_GET_FREE_SIZES, const.CMD_CLEAR_ATTLOG,
+            const.CMD_EXIT])
+        self.assertEqual(conn.records, 0)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_udp_iter_attendance_chunks(self, helper, socket):
+        """ records split between two buffer chunks """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        records = [attendance_record(i % 50, datetime(2026, 3, 1, 6, i // 60 % 60, i % 60)) for i in range(2100)]
+        buffer = pack('<I', 8 * 2100) + b''.join(records)
+        stream(socket, [
+            udp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=2100, packet=udp_packet), # no users
+            udp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer))), # prepare buffer
+            udp_packet(const.CMD_DATA, buffer[:16 * 1024]),
+            udp_packet(const.CMD_DATA, buffer[16 * 1024:]),
+            udp_packet(const.CMD_ACK_OK), # free data
+            udp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201', force_udp=True)
+        conn = zk.connect()
+        attendances = list(conn.iter_attendance())
+        conn.disconnect()
+        self.assertEqual(len(attendances), 2100, "incorrect size %s" % len(attendances))
+        self.assertEqual(attendances[2047].user_id, str(2047 % 50)) # split record
+        self.assertEqual(attendances[2047].timestamp, datetime(2026, 3, 1, 6, 34, 7))
+        self.assertEqual(attendances[-1].timestamp, datetime(2026, 3, 1, 6, 34, 59))
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_pipelined(self, helper, socket):
+        """ chunk replies matched by reply_id, whatever their order """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [attendance_record(i % 50, datetime(2026, 3, 1, 6, i // 60 % 60, i % 60)) for i in range(16400)]
+        buffer = pack('<I', 8 * 16400) + b''.join(records)
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=16400), # no users
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer))), # prepare buffer
+            tcp_packet(const.CMD_DATA, buffer[0xFFc0:2 * 0xFFc0], reply_id=4),
+            tcp_packet(const.CMD_DATA, buffer[:0xFFc0], reply_id=3),
+            tcp_packet(const.CMD_DATA, buffer[2 * 0xFFc0:], reply_id=5),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201', read_window=3)
+        conn = zk.connect()
+        attendances = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(len(attendances), 16400, "incorrect size %s" % len(attendances))
+        self.assertEqual(attendances[8184].user_id, str(8184 % 50)) # first record of the second chunk
+        self.assertEqual(attendances[-1].timestamp, datetime(2026, 3, 1, 6, 33, 19))
+        sent = [call[0][0] for call in socket.return_value.send.call_args_list]
+        self.assertEqual(sent[3][16:], pack('<ii', 0, 0xFFc0))
+        self.assertEqual(sent[5][16:], pack('<ii', 2 * 0xFFc0, len(buffer) - 2 * 0xFFc0))
+        self.assertEqual([unpack('<H', packet[14:16])[0] for packet in sent[3:6]], [3, 4, 5])
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_iter_attendance_pipelined_break(self, helper, socket):
+        """ stopping early drains the chunk replies in flight before CMD_FREE_DATA """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [attendance_record(i % 50, datetime(2026, 3, 1, 6, i // 60 % 60, i % 60)) for i in range(16400)]
+        buffer = pack('<I', 8 * 16400) + b''.join(records)
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=16400), # no users
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer))), # prepare buffer
+            tcp_packet(const.CMD_DATA, buffer[:0xFFc0], reply_id=3),
+            tcp_packet(const.CMD_DATA, buffer[0xFFc0:2 * 0xFFc0], reply_id=4),
+            tcp_packet(const.CMD_DATA, buffer[2 * 0xFFc0:], reply_id=5),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            sizes_packet(records=16401),
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201', read_window=3)
+        conn = zk.connect()
+        for attendance in conn.iter_attendance():
+            break
+        self.assertEqual(attendance.timestamp, datetime(2026, 3, 1, 6, 0, 0))
+        conn.read_sizes()
+        self.assertEqual(conn.records, 16401)
+        conn.disconnect()
+        sent = [unpack('<H', c[0][0][8:10])[0] for c in socket.return_value.send.call_args_list]
+        self.assertEqual(sent[-3:], [const.CMD_FREE_DATA, const.CMD_GET_FREE_SIZES, const.CMD_EXIT])
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_resolve_users(self, helper, socket):
+        """ 8 bytes records get the user_id from the user table """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        users = [
+            pack('<HB8s24sIx7sx24s', 1, 0, b'', b'Alice', 0, b'', b'A100'),
+            pack('<HB8s24sIx7sx24s', 2, 0, b'', b'Bob', 0, b'', b'B200'),
+        ]
+        records = [
+            attendance_record(2, datetime(2026, 4, 2, 7, 55, 0)),
+            attendance_record(9, datetime(2026, 4, 2, 7, 58, 0)),
+        ]
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(users=2, records=2),
+            tcp_packet(const.CMD_DATA, pack('<I', 144) + b''.join(users)), # user buffer
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 16)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 16) + b''.join(records)),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        attendances = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(attendances[0].user_id, "B200")
+        self.assertEqual(attendances[0].uid, 2)
+        self.assertEqual(attendances[1].user_id, "9") # unknown uid
+        self.assertEqual(conn.user_index.get_by_user_id("A100").uid, 1)
+
+    def test_async_get_attendance(self):
+        """ AsyncZK against a local tcp device """
+        users = [
+            pack('<HB8s24sIx7sx24s', 1, 0, b'', b'Alice', 0, b'', b'A100'),
+            pack('<HB8s24sIx7sx24s', 2, 0, b'', b'Bob', 0, b'', b'B200'),
+        ]
+        records = [
+            attendance_record(2, datetime(2026, 4, 2, 7, 55, 0)),
+            attendance_record(1, datetime(2026, 4, 2, 8, 1, 30)),
+        ]
+        buffer = pack('<I', 16) + b''.join(records)
+        responses = [
+            [tcp_packet(const.CMD_ACK_OK, session_id=1234)], # connect
+            [sizes_packet(users=2, records=2)],
+            [tcp_packet(const.CMD_DATA, pack('<I', 144) + b''.join(users))], # user buffer
+            [tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer)))], # prepare buffer
+            [
+                tcp_packet(const.CMD_PREPARE_DATA, pack('<I', len(buffer))),
+                tcp_packet(const.CMD_DATA, buffer[:10]),
+                tcp_packet(const.CMD_DATA, buffer[10:]),
+                tcp_packet(const.CMD_ACK_OK),
+            ], # read buffer
+            [tcp_packet(const.CMD_ACK_OK)], # free data
+            [tcp_packet(const.CMD_ACK_OK)], # exit
+        ]
+        commands = []
+
+        async def device(reader, writer):
+            for response in responses:
+                top = await reader.readexactly(8)
+                packet = await reader.readexactly(unpack('<HHI', top)[2])
+                commands.append(unpack('<4H', packet[:8]))
+                for packet in response:
+                    writer.write(packet[:12])
+                    await writer.drain()
+                    writer.write(packet[12:]) # split packets
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(device, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            zk = AsyncZK('127.0.0.1', port=port, timeout=5)
+            async with zk as conn:
+                attendances = await conn.get_attendance()
+            server.close()
+            return attendances
+
+        attendances = asyncio.run(run())
+        self.assertEqual(len(attendances), 2)
+        self.assertEqual(attendances[0].user_id, "B200")
+        self.assertEqual(attendances[0].uid, 2)
+        self.assertEqual(attendances[1].timestamp, datetime(2026, 4, 2, 8, 1, 30))
+        self.assertEqual([command[0] for command in commands], [
+            const.CMD_CONNECT, const.CMD_GET_FREE_SIZES, const._CMD_PREPARE_BUFFER,
+            const._CMD_PREPARE_BUFFER, const._CMD_READ_BUFFER, const.CMD_FREE_DATA, const.CMD_EXIT])
+        self.assertEqual(commands[1][2], 1234) # session id
+
+    def test_async_connect_timeout_closes(self):
+        """ AsyncZK closes the connection when the handshake times out """
+        closed = []
+
+        async def device(reader, writer):
+            await reader.readexactly(16) # CMD_CONNECT, never answered
+            closed.append(await reader.read()) # b'' once the client closes
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(device, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            zk = AsyncZK('127.0.0.1', port=port, timeout=0.2)
+            with self.assertRaises(ZKNetworkError):
+                await zk.connect()
+            await asyncio.sleep(0.1)
+            server.close()
+
+        asyncio.run(run())
+        self.assertEqual(closed, [b''])
+
+    def test_async_live_capture_holds_session(self):
+        """ no other command can take the frames of a live capture """
+        responses = [tcp_packet(const.CMD_ACK_OK)] + [sizes_packet()] + [tcp_packet(const.CMD_ACK_OK)] * 6
+        commands = []
+
+        async def device(reader, writer):
+            for response in responses:
+                top = await reader.readexactly(8)
+                packet = await reader.readexactly(unpack('<HHI', top)[2])
+                commands.append(unpack('<4H', packet[:8])[0])
+                writer.write(response)
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(device, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            zk = AsyncZK('127.0.0.1', port=port, timeout=5)
+            async with zk as conn:
+                async for event in conn.live_capture(new_timeout=0.1):
+                    self.assertIsNone(event)
+                    with self.assertRaisesRegex(ZKErrorConnection, "live capture"):
+                        await conn.read_sizes()
+                    conn.end_live_capture = True
+            server.close()
+
+        asyncio.run(run())
+        self.assertEqual(commands, [
+            const.CMD_CONNECT, const.CMD_GET_FREE_SIZES, const.CMD_CANCELCAPTURE, const.CMD_STARTVERIFY,
+            const.CMD_ENABLEDEVICE, const.CMD_REG_EVENT, const.CMD_REG_EVENT, const.CMD_EXIT])
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_cached_users(self, helper, socket):
+        """ warm read reuses the user table until sizes change """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        users = pack('<I', 72) + pack('<HB8s24sIx7sx24s', 1, 0, b'', b'Alice', 0, b'', b'A100')
+        record = attendance_record(1, datetime(2026, 4, 2, 7, 55, 0))
+        attendance = [
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 8)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 8) + record),
+            tcp_packet(const.CMD_ACK_OK), # free data
+        ]
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(users=1, records=1),
+            tcp_packet(const.CMD_DATA, users), # user buffer
+        ] + attendance + [
+            sizes_packet(users=1, records=1), # warm: no user buffer
+        ] + attendance + [
+            sizes_packet(users=2, records=1), # new user enrolled
+            tcp_packet(const.CMD_DATA, users), # user buffer
+        ] + attendance + [
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        for _ in range(3):
+            attendances = conn.get_attendance()
+            self.assertEqual(attendances[0].user_id, "A100")
+        conn.disconnect()
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_users_download_failed(self, helper, socket):
+        """ a failed user download is not cached as an empty table """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        users = pack('<I', 72) + pack('<HB8s24sIx7sx24s', 1, 0, b'', b'Alice', 0, b'', b'A100')
+        record = attendance_record(1, datetime(2026, 4, 2, 7, 55, 0))
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(users=1, records=1),
+            tcp_packet(const.CMD_ACK_ERROR), # user buffer refused
+            sizes_packet(users=1, records=1),
+            tcp_packet(const.CMD_DATA, users), # user buffer downloaded again
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', 4 + 8)), # prepare buffer
+            tcp_packet(const.CMD_DATA, pack('<I', 8) + record),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201', users_ttl=3600)
+        conn = zk.connect()
+        with self.assertRaises(ZKErrorResponse):
+            conn.get_attendance()
+        attendances = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(attendances[0].user_id, "A100")
+
+    @unittest.skipIf(decoders.numpy is None, "numpy not installed")
+    def test_decoders_backends_match(self):
+        """ numpy columns equal the python ones """
+        users = UserIndex([User(3, 'Alice', 0, user_id='A3'), User(7, 'Bob', 0, user_id='70')])
+        times = [datetime(2026, 1, 31, 23, 59, 59), datetime(2026, 2, 1, 0, 0, 0), datetime(2024, 2, 29, 12, 30, 5)]
+        encoded = [unpack('<I', attendance_record(0, t)[3:7])[0] for t in times]
+        layouts = {
+            8: b''.join(pack('<HBIB', uid, 1, t, 0) for uid, t in zip([3, 9, 7], encoded)),
+            16: b''.join(pack('<IIBB2sI', user_id, t, 1, 4, b'', 0) for user_id, t in zip([70, 9, 70], encoded)),
+            40: b''.join(pack('<H24sBIB8s', uid, user_id, 15, t, 1, b'') for uid, user_id, t in zip([3, 9, 7], [b'A3', b'9\x00x', b'70'], encoded)),
+        }
+        for record_size, data in layouts.items():
+            expected = decoders.decode_attendance(data, record_size, users, 'python')
+            sut = decoders.decode_attendance(data, record_size, users, 'numpy')
+            self.assertEqual(expected['timestamp'], times)
+            for name in decoders.ATTENDANCE_COLUMNS:
+                self.assertEqual(sut[name].tolist(), expected[name], "%i bytes %s" % (record_size, name))
+        layouts = {
+            28: b''.join(pack('<HB5s8sIxBhI', uid, 0, b'12', name, 99, 1, 0, uid * 10) for uid, name in [(1, b'Ann'), (2, b'')]),
+            72: b''.join(pack('<HB8s24sIx7sx24s', uid, 14, b'', name, 5, b'2', b'U%i' % uid) for uid, name in [(1, b'Ann\x00z'), (2, b'')]),
+        }
+        for packet_size, data in layouts.items():
+            expected = decoders.decode_users(data, packet_size, backend='python')
+            sut = decoders.decode_users(data, packet_size, backend='numpy')
+            for name in decoders.USER_COLUMNS:
+                self.assertEqual(sut[name].tolist(), expected[name], "%i bytes %s" % (packet_size, name))
+            self.assertEqual(expected['name'][0], 'Ann')
+
+    def test_checksum(self):
+        """ one pass checksum equals the zkemsdk.c loop """
+        def reference(p):
+            checksum = 0
+            while len(p) > 1:
+                checksum += unpack('H', p[:2])[0]
+                p = p[2:]
+                if checksum > const.USHRT_MAX:
+                    checksum -= const.USHRT_MAX
+            if p:
+                checksum += p[-1]
+            while checksum > const.USHRT_MAX:
+                checksum -= const.USHRT_MAX
+            checksum = ~checksum
+            while checksum < 0:
+                checksum += const.USHRT_MAX
+            return checksum
+        payloads = [b'', b'\x00' * 9, b'\xff' * 8, b'\xff' * 7, b'\xfe\xff\x01', os.urandom(1023), os.urandom(4096)]
+        payloads += [os.urandom(size) for size in range(1, 40)]
+        for payload in payloads:
+            self.assertEqual(create_checksum(payload), reference(payload), payload)
+
+    def test_helper_probe(self):
+        """ in-process reachability, cached per device """
+        import socket
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        helper = ZK_helper('127.0.0.1', port)
+        with patch('subprocess.call') as call:
+            self.assertTrue(helper.test_ping())
+            self.assertEqual(helper.test_tcp(), 0)
+            server.close()
+            self.assertEqual(ZK_helper('127.0.0.1', port).test_tcp(), 0) # cached
+            ZK_helper.ttl, ttl = 0, ZK_helper.ttl
+            try:
+                self.assertTrue(helper.test_ping()) # refused: host is up
+                self.assertNotEqual(helper.test_tcp(), 0)
+            finally:
+                ZK_helper.ttl = ttl
+            self.assertFalse(call.called)
+
+    def test_record_slots(self):
+        """ slotted records keep attribute access and json round trips """
+        template = codecs.decode('4d98535332310000' + '00' * 16 + 'feff03d56454ccc1', 'hex')
+        finger = Finger(14, 1, 1, template)
+        user = User(14, 'Fred', const.USER_DEFAULT, '123', '1', '14', 42)
+        att = Attendance('14', datetime(2026, 1, 5, 8, 0, 0), 1, 0, 14)
+        for record in (finger, user, att):
+            self.assertFalse(hasattr(record, '__dict__'), "%s has a __dict__" % type(record).__name__)
+        self.assertEqual(finger.mark, b"4d98535332310000...feff03d56454ccc1")
+        self.assertEqual(Finger.json_unpack(json.loads(json.dumps(finger.json_pack()))), finger)
+        self.assertNotEqual(Finger(14, 2, 1, template), finger)
+        restored = User.json_unpack(json.loads(json.dumps(user.json_pack())))
+        self.assertEqual(restored.json_pack(), user.json_pack())
+        self.assertEqual(str(att), "14|2026-01-05 08:00:00|1|0")
+
+    def test_timecodec(self):
+        """ memoized day tables match the datetime based decoding """
+        for t in list(range(0, 3 * 86400, 3599)) + [826534800 + 45296, 0x7FFFFFFF - 86400 * 20]:
+            expected = timecodec.decode_time(t)
+            self.assertEqual(timecodec.from_epoch(timecodec.device_to_epoch(t)), expected)
+            self.assertEqual(timecodec.device_to_iso(t), expected.isoformat())
+            self.assertEqual(timecodec.epoch_to_iso(timecodec.to_epoch(expected)), expected.isoformat())
+            self.assertEqual(timecodec.encode_time(expected), t)
+        with self.assertRaises(ValueError):
+            timecodec.device_to_epoch(61 * 86400) # February 31
+        self.assertEqual(timecodec.device_to_iso(30 * 86400 - 1), '2000-01-30T23:59:59')
+
+    def test_chunk_controller(self):
+        """ chunk size grows on success, shrinks on failure, persists by serial """
+        chunks = ChunkController(1024, 1024, 0xFFc0, grow_after=2)
+        for _ in range(12):
+            chunks.success()
+        self.assertEqual(chunks.size, 0xFFc0) # capped
+        chunks.failure()
+        chunks.failure()
+        self.assertEqual(chunks.size, 0xFFc0 // 4)
+        self.assertTrue(chunks.changed)
+        path = os.path.join(tempfile.mkdtemp(), 'chunks.json')
+        store = ChunkStore(path)
+        self.assertEqual(store.load('A123'), {})
+        store.save('A123', {'read_tcp': chunks.size})
+        store.save('B456', {'read_tcp': 2048})
+        store.save('A123', {'write_tcp': 4096})
+        self.assertEqual(ChunkStore(path).load('A123'), {'read_tcp': 0xFFc0 // 4, 'write_tcp': 4096})
+        self.assertEqual(ChunkStore(path).load('B456'), {'read_tcp': 2048})
+        chunks = ChunkController(1024, 1024, 0xFFc0, grow_after=1)
+        for _ in range(2):
+            chunks.success()
+            chunks.failure() # 2048 failed twice: limit
+        self.assertEqual(chunks.limit, 1024)
+        for _ in range(8):
+            chunks.success()
+        self.assertEqual(chunks.size, 1024, "grown past a size that failed")
+        threads = [threading.Thread(target=ChunkStore(path).save, args=('S%i' % i, {'read_tcp': i}))
+                   for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ChunkStore(path).load('S15'), {'read_tcp': 15})
+        self.assertEqual(len([name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]), 0)
+        self.assertEqual(sum(1 for i in range(16) if ChunkStore(path).load('S%i' % i)), 16, "lost update")
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_send_chunks_limit(self, helper, socket):
+        """ a chunk refused twice at a size caps the size, chunks are retried smaller """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        ok, refused = tcp_packet(const.CMD_ACK_OK), tcp_packet(const.CMD_ACK_ERROR)
+        stream(socket, [
+            ok, # connect
+            ok, # free data
+            ok, # prepare data
+        ] + [ok] * 4 + [refused, ok] + [ok] * 3 + [refused, ok] + [ok] * 3 + [
+            ok, # exit
+        ])
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        conn._send_with_buffer(bytes(12 * 1024))
+        conn.disconnect()
+        sizes = [len(c[0][0]) - 16 for c in socket.return_value.send.call_args_list[3:-1]]
+        self.assertEqual(sizes, [1024] * 4 + [2048, 1024] + [1024] * 3 + [2048, 1024] + [1024] * 3)
+        self.assertEqual(conn.write_chunks.limit, 1024)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_read_chunk_timeout_retried(self, helper, socket):
+        """ a chunk that timed out is read again at the smaller size """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [attendance_record(i % 50, datetime(2026, 3, 1, 6, i // 60 % 60, i % 60)) for i in range(300)]
+        buffer = pack('<I', 8 * 300) + b''.join(records)
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=300), # no users
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer))), # prepare buffer
+            timeout('timed out'), # 2048 bytes too large
+            tcp_packet(const.CMD_DATA, buffer[:1024]),
+            tcp_packet(const.CMD_DATA, buffer[1024:2048]),
+            tcp_packet(const.CMD_DATA, buffer[2048:]),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        zk.read_chunks = ChunkController(2048, 1024, 2048)
+        conn = zk.connect()
+        attendances = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(len(attendances), 300)
+        self.assertEqual(attendances[-1].timestamp, datetime(2026, 3, 1, 6, 4, 59))
+        sent = [c[0][0] for c in socket.return_value.send.call_args_list]
+        self.assertEqual([unpack('<ii', packet[16:]) for packet in sent[3:7]],
+                         [(0, 2048), (0, 1024), (1024, 1024), (2048, len(buffer) - 2048)])
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_read_chunk_late_reply(self, helper, socket):
+        """ the late reply to a chunk that timed out is not taken for the retry """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        records = [attendance_record(i % 50, datetime(2026, 3, 1, 6, i // 60 % 60, i % 60)) for i in range(300)]
+        buffer = pack('<I', 8 * 300) + b''.join(records)
+        stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            sizes_packet(records=300), # no users
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(buffer))), # prepare buffer
+            timeout('timed out'), # chunk request 3
+            tcp_packet(const.CMD_DATA, buffer[:2048], reply_id=3), # late, retry sent as 4
+            tcp_packet(const.CMD_DATA, buffer[:1024]),
+            tcp_packet(const.CMD_DATA, buffer[1024:2048]),
+            tcp_packet(const.CMD_DATA, buffer[2048:]),
+            tcp_packet(const.CMD_ACK_OK), # free data
+            tcp_packet(const.CMD_ACK_OK), # exit
+        ])
+        zk = ZK('192.168.1.201')
+        zk.read_chunks = ChunkController(2048, 1024, 2048)
+        conn = zk.connect()
+        attendances = list(conn.iter_attendance())
+        conn.disconnect()
+        self.assertEqual(len(attendances), 300, "incorrect size %s" % len(attendances))
+        self.assertEqual([a.timestamp for a in attendances], [datetime(2026, 3, 1, 6, i // 60 % 60, i % 60) for i in range(300)])
+
     def test_finger_pack(self):
         fing = Finger(26,1,1,codecs.decode("0123456789ABCDEF", "hex"))
         expected = {
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from .base import ZK
+from .aio import AsyncZK
+from .batch import AttendanceBatch
 
 VERSION = (0, 9, 1)
 
-__all__ = ['ZK']
+__all__ = ['ZK', 'AsyncZK', 'AttendanceBatch']
 
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client, one event loop can drive many devices at once
+
+same packets as ZK (zk.base framing and checksum, zk.decoders), over
+asyncio streams (tcp) or a datagram endpoint (udp)
+"""
+import asyncio
+from struct import pack, unpack
+
+from . import const, decoders
+from .attendance import Attendance
+from .base import HEADER, create_header, create_tcp_top, make_commkey, tcp_top_length
+from .exception import ZKErrorConnection, ZKErrorResponse, ZKNetworkError
+from .user import User, UserIndex
+
+
+class _DatagramQueue(asyncio.DatagramProtocol):
+    """
+    udp endpoint feeding a queue
+    """
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+    def error_received(self, exc):
+        self.queue.put_nowait(exc)
+
+
+class AsyncZK(object):
+    """
+    ZK asyncio client
+    """
+    def __init__(self, ip, port=4370, timeout=60, password=0, force_udp=False, verbose=False, encoding='UTF-8'):
+        """
+        Construct a new 'AsyncZK' object.
+
+        :param ip: machine's IP address
+        :param port: machine's port
+        :param timeout: timeout number
+        :param password: passint
+        :param force_udp: use UDP connection
+        :param verbose: showing log while run the commands
+        :param encoding: user encoding
+        """
+        User.encoding = encoding
+        self.__address = (ip, port)
+        self.__timeout = timeout
+        self.__password = password # passint
+        self.__session_id = 0
+        self.__reply_id = const.USHRT_MAX - 1
+        self.__reader = None
+        self.__writer = None
+        self.__transport = None
+        self.__datagrams = None
+        self.__lock = asyncio.Lock()
+        self.__capturing = False
+
+        self.is_connect = False
+        self.force_udp = force_udp
+        self.verbose = verbose
+        self.encoding = encoding
+        self.tcp = not force_udp
+        self.users = 0
+        self.fingers = 0
+        self.records = 0
+        self.cards = 0
+        self.fingers_cap = 0
+        self.users_cap = 0
+        self.rec_cap = 0
+        self.faces = 0
+        self.faces_cap = 0
+        self.fingers_av = 0
+        self.users_av = 0
+        self.rec_av = 0
+        self.user_packet_size = 72 if self.tcp else 28
+        self.user_index = UserIndex()
+        self.end_live_capture = False
+
+    def __repr__(self):
+        return "<AsyncZK>: {}:{} ({})".format(self.__address[0], self.__address[1], 'tcp' if self.tcp else 'udp')
+
+    async def __open(self):
+        if self.tcp:
+            self.__reader, self.__writer = await asyncio.wait_for(
+                asyncio.open_connection(*self.__address), self.__timeout)
+        else:
+            loop = asyncio.get_running_loop()
+            self.__transport, protocol = await loop.create_datagram_endpoint(
+                _DatagramQueue, remote_addr=self.__address)
+            self.__datagrams = protocol.queue
+
+    def __session(self):
+        """
+        the lock serializing commands, refused during live_capture: the
+        event frames would be taken as replies
+        """
+        if self.__capturing:
+            raise ZKErrorConnection("live capture running")
+        return self.__lock
+
+    def __close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+        if self.__transport is not None:
+            self.__transport.close()
+        self.__reader = self.__writer = self.__transport = self.__datagrams = None
+
+    def __send(self, command, command_string=b'', reply_id=None):
+        if reply_id is None:
+            reply_id = self.__reply_id
+        buf = create_header(command, command_string, self.__session_id, reply_id)
+        if self.tcp:
+            self.__writer.write(create_tcp_top(buf))
+        else:
+            self.__transport.sendto(buf)
+
+    async def __recieve(self, timeout=None):
+        """
+        :return: (header, data) of the next packet
+        """
+        timeout = self.__timeout if timeout is None else timeout
+        if self.tcp:
+            top = await asyncio.wait_for(self.__reader.readexactly(16), timeout)
+            length = tcp_top_length(top)
+            if length < 8:
+                raise ZKNetworkError("TCP packet invalid")
+            data = await asyncio.wait_for(self.__reader.readexactly(length - 8), timeout)
+            return HEADER.unpack_from(top, 8), data
+        packet = await asyncio.wait_for(self.__datagrams.get(), timeout)
+        if isinstance(packet, Exception):
+            raise packet
+        return HEADER.unpack_from(packet), packet[8:]
+
+    async def __command(self, command, command_string=b''):
+        """
+        send a command and wait for its reply
+
+        :return: (header, data) of the reply
+        """
+        if command not in [const.CMD_CONNECT, const.CMD_AUTH] and not self.is_connect:
+            raise ZKErrorConnection("instance are not connected.")
+        try:
+            self.__send(command, command_string)
+            if self.tcp:
+                await self.__writer.drain()
+            header, data = await self.__recieve()
+        except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            raise ZKNetworkError(str(e) or e.__class__.__name__)
+        self.__reply_id = header[3]
+        return header, data
+
+    def __ok(self, header):
+        return header[0] in [const.CMD_ACK_OK, const.CMD_PREPARE_DATA, const.CMD_DATA]
+
+    async def connect(self):
+        """
+        connect to the device
+
+        :return: self
+        """
+        self.end_live_capture = False
+        self.__lock = asyncio.Lock()
+        self.__capturing = False
+        try:
+            await self.__open()
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ZKNetworkError("can't reach device (%s)" % (str(e) or e.__class__.__name__))
+        self.__session_id = 0
+        self.__reply_id = const.USHRT_MAX - 1
+        try:
+            header, _ = await self.__command(const.CMD_CONNECT)
+            self.__session_id = header[2]
+            if header[0] == const.CMD_ACK_UNAUTH:
+                if self.verbose: print ("try auth")
+                command_string = make_commkey(self.__password, self.__session_id)
+                header, _ = await self.__command(const.CMD_AUTH, command_string)
+        except ZKNetworkError:
+            self.__close()
+            raise
+        if self.__ok(header):
+            self.is_connect = True
+            return self
+        self.__close()
+        if header[0] == const.CMD_ACK_UNAUTH:
+            raise ZKErrorResponse("Unauthenticated")
+        raise ZKErrorResponse("Invalid response: Can't connect")
+
+    async def disconnect(self):
+        """
+        diconnect from the connected device
+
+        :return: bool
+        """
+        async with self.__session():
+            try:
+                header, _ = await self.__command(const.CMD_EXIT)
+            finally:
+                self.is_connect = False
+                self.__close()
+        if not self.__ok(header):
+            raise ZKErrorResponse("can't disconnect")
+        return True
+
+    async def __aenter__(self):
+        if not self.is_connect:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.is_connect:
+            await self.disconnect()
+
+    async def read_sizes(self):
+        """
+        read the memory ussage
+        """
+        async with self.__session():
+            header, data = await self.__command(const.CMD_GET_FREE_SIZES)
+        if not self.__ok(header):
+            raise ZKErrorResponse("can't read sizes")
+        if len(data) >= 80:
+            fields = unpack('20i', data[:80])
+            self.users = fields[4]
+            self.fingers = fields[6]
+            self.records = fields[8]
+            self.cards = fields[12]
+            self.fingers_cap = fields[14]
+            self.users_cap = fields[15]
+            self.rec_cap = fields[16]
+            self.fingers_av = fields[17]
+            self.users_av = fields[18]
+            self.rec_av = fields[19]
+            data = data[80:]
+        if len(data) >= 12: #face info
+            fields = unpack('3i', data[:12])
+            self.faces = fields[0]
+            self.faces_cap = fields[2]
+        return True
+
+    async def __read_chunk(self, start, size):
+        """
+        read a chunk from buffer
+        """
+        for _retries in range(3):
+            header, data = await self.__command(const._CMD_READ_BUFFER, pack('<ii', start, size))
+            if header[0] == const.CMD_DATA:
+                return data
+            if header[0] == const.CMD_PREPARE_DATA:
+                chunk = []
+                while True:
+                    packet, data = await self.__recieve()
+                    if packet[0] == const.CMD_DATA:
+                        chunk.append(data)
+                    elif packet[0] == const.CMD_ACK_OK:
+                        return b''.join(chunk)
+                    else:
+                        break
+            if self.verbose: print ("retry chunk {}".format(start))
+        raise ZKErrorResponse("can't read chunk %i:[%i]" % (start, size))
+
+    async def read_with_buffer(self, command, fct=0, ext=0):
+        """
+        buffered read (ZK6: 1503)
+
+        :return: (data, size)
+        """
+        async with self.__session():
+            command_string = pack('<bhii', 1, command, fct, ext)
+            header, data = await self.__command(const._CMD_PREPARE_BUFFER, command_string)
+            if not self.__ok(header):
+                raise ZKErrorResponse("RWB Not supported")
+            if header[0] == const.CMD_DATA:
+                return data, len(data)
+            size = unpack('I', data[1:5])[0]
+            max_chunk = 0xFFc0 if self.tcp else 16 * 1024
+            chunks = []
+            for start in range(0, size, max_chunk):
+                chunks.append(await self.__read_chunk(start, min(max_chunk, size - start)))
+            await self.__command(const.CMD_FREE_DATA)
+        data = b''.join(chunks)
+        return data, len(data)
+
+    async def get_users(self):
+        """
+        :return: list of User object
+        """
+        await self.read_sizes()
+        self.user_index = UserIndex()
+        if self.users == 0:
+            return []
+        userdata, size = await self.read_with_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER)
+        if size <= 4:
+            if self.verbose: print("WRN: missing user data")
+            return []
+        self.user_packet_size = unpack('I', userdata[:4])[0] // self.users
+        columns = decoders.decode_users(memoryview(userdata)[4:], self.user_packet_size, self.encoding, 'python')
+        users = [User(*row) for row in zip(*[columns[name] for name in decoders.USER_COLUMNS])]
+        self.user_index = UserIndex(users)
+        return users
+
+    async def get_attendance(self, since=None, until=None):
+        """
+        return attendance record
+
+        :param since: keep records at or after this datetime
+        :param until: keep records before this datetime
+        :return: list of Attendance object
+        """
+        users = UserIndex(await self.get_users())
+        if self.records == 0:
+            return []
+        attendance_data, size = await self.read_with_buffer(const.CMD_ATTLOG_RRQ)
+        if size < 4:
+            if self.verbose: print ("WRN: no attendance data")
+            return []
+        record_size = unpack('I', attendance_data[:4])[0] // self.records
+        columns = decoders.decode_attendance(memoryview(attendance_data)[4:], record_size, users, 'python', since, until)
+        return [Attendance(*row) for row in zip(*[columns[name] for name in decoders.ATTENDANCE_COLUMNS])]
+
+    async def __device_command(self, command, command_string=b'', error="command failed"):
+        async with self.__session():
+            header, _ = await self.__command(command, command_string)
+        if not self.__ok(header):
+            raise ZKErrorResponse(error)
+        return True
+
+    async def enable_device(self):
+        """
+        re-enable the connected device
+
+        :return: bool
+        """
+        return await self.__device_command(const.CMD_ENABLEDEVICE, error="Can't enable device")
+
+    async def disable_device(self):
+        """
+        disable (lock) device, to ensure no user activity in device while some process run
+
+        :return: bool
+        """
+        return await self.__device_command(const.CMD_DISABLEDEVICE, error="Can't disable device")
+
+    async def reg_event(self, flags):
+        """
+        reg events
+        """
+        return await self.__device_command(const.CMD_REG_EVENT, pack("I", flags), "cant' reg events %i" % flags)
+
+    async def live_capture(self, new_timeout=10):
+        """
+        async iterator of live attendance events, yields None after
+        new_timeout seconds without event (set end_live_capture to stop)
+
+        the session is held for the whole capture: other methods raise
+        ZKErrorConnection until it ends, use another client meanwhile
+        """
+        users = UserIndex(await self.get_users())
+        await self.__device_command(const.CMD_CANCELCAPTURE, error="Can't cancel capture")
+        await self.__device_command(const.CMD_STARTVERIFY, error="Cant Verify")
+        await self.enable_device()
+        if self.verbose: print ("start live_capture")
+        async with self.__session():
+            self.__capturing = True
+            try:
+                header, _ = await self.__command(const.CMD_REG_EVENT, pack("I", const.EF_ATTLOG))
+                if not self.__ok(header):
+                    raise ZKErrorResponse("cant' reg events %i" % const.EF_ATTLOG)
+                self.end_live_capture = False
+                while not self.end_live_capture:
+                    try:
+                        header, data = await self.__recieve(new_timeout)
+                    except asyncio.TimeoutError:
+                        if self.verbose: print ("time out")
+                        yield None # return to keep watching
+                        continue
+                    except (OSError, EOFError, asyncio.IncompleteReadError) as e:
+                        raise ZKNetworkError(str(e) or e.__class__.__name__)
+                    self.__send(const.CMD_ACK_OK, reply_id=const.USHRT_MAX - 1)
+                    if header[0] != const.CMD_REG_EVENT:
+                        if self.verbose: print("not event! %x" % header[0])
+                        continue
+                    for user_id, timestamp, status, punch in decoders.decode_events(data):
+                        tuser = users.get_by_user_id(user_id)
+                        yield Attendance(user_id, timestamp, status, punch, int(user_id) if tuser is None else tuser.uid)
+            finally:
+                self.__capturing = False
+                if self.is_connect:
+                    header, _ = await self.__command(const.CMD_REG_EVENT, pack("I", 0))
+                    if not self.__ok(header):
+                        raise ZKErrorResponse("cant' reg events 0")
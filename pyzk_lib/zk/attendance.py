@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 class Attendance(object):
+    __slots__ = ('uid', 'user_id', 'timestamp', 'status', 'punch')
+
     def __init__(self, user_id, timestamp, status, punch=0, uid=0):
         self.uid = uid
         self.user_id = user_id
@@ -1,15 +1,24 @@
 # -*- coding: utf-8 -*-
 import sys
-from datetime import datetime
+import errno
 from socket import AF_INET, SOCK_DGRAM, SOCK_STREAM, socket, timeout
-from struct import pack, unpack
+from itertools import chain
+from struct import Struct, pack, unpack
+from time import monotonic
 import codecs
+import hashlib
 
-from . import const
+from . import const, decoders, timecodec
 from .attendance import Attendance
 from .exception import ZKErrorConnection, ZKErrorResponse, ZKNetworkError
-from .user import User
+from .user import User, UserIndex
+from .batch import AttendanceBatch
 from .finger import Finger
+from .chunk import ChunkController, ChunkStore
+from .decoders import ATTENDANCE_8, ATTENDANCE_16, ATTENDANCE_40
+
+HEADER = Struct('<4H')          # command, checksum, session_id, reply_id
+TCP_TOP = Struct('<HHI')        # MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, length
 
 
 def safe_cast(val, to_type, default=None):
@@ -20,6 +29,66 @@ def safe_cast(val, to_type, default=None):
         return default
 
 
+def create_checksum(buf):
+    """
+    Calculates the checksum of the packet to be sent to the time clock
+    Copied from zkemsdk.c
+
+    the original loop sums the packet as native 16 bits words, folding
+    the carry (one's complement sum), so it only depends on the sum
+    modulo 0xFFFF. As 0x10000 == 1 (mod 0xFFFF), the words read as one
+    big base 0x10000 integer have the same remainder: int.from_bytes does
+    it in one linear pass.
+
+    :param buf: bytes-like packet (header + command string)
+    :return: int checksum
+    """
+    view = memoryview(buf)
+    even = len(view) & ~1
+    checksum = int.from_bytes(view[:even], sys.byteorder)
+    if len(view) & 1:
+        checksum += view[-1]
+    if checksum:
+        checksum = (checksum - 1) % const.USHRT_MAX + 1
+    if checksum == const.USHRT_MAX:
+        return const.USHRT_MAX - 1
+    return const.USHRT_MAX - 1 - checksum
+
+
+def create_header(command, command_string, session_id, reply_id):
+    """
+    Puts a the parts that make up a packet together and packs them into a byte string
+    """
+    buf = bytearray(HEADER.size + len(command_string))
+    buf[HEADER.size:] = command_string
+    HEADER.pack_into(buf, 0, command, 0, session_id, reply_id)
+    checksum = create_checksum(buf)
+    reply_id += 1
+    if reply_id >= const.USHRT_MAX:
+        reply_id -= const.USHRT_MAX
+    HEADER.pack_into(buf, 0, command, checksum, session_id, reply_id)
+    return bytes(buf)
+
+
+def create_tcp_top(packet):
+    """
+    witch the complete packet set top header
+    """
+    return TCP_TOP.pack(const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+
+def tcp_top_length(packet):
+    """
+    return size!
+    """
+    if len(packet)<=8:
+        return 0
+    tcp_header = TCP_TOP.unpack_from(packet)
+    if tcp_header[0] == const.MACHINE_PREPARE_DATA_1 and tcp_header[1] == const.MACHINE_PREPARE_DATA_2:
+        return tcp_header[2]
+    return 0
+
+
 def make_commkey(key, session_id, ticks=50):
     """
     take a password and session_id and scramble them to send to the machine.
@@ -57,10 +126,19 @@ def make_commkey(key, session_id, ticks=50):
     return k
 
 
+# (ip, port) -> (monotonic time, connect_ex result), shared by the helpers
+_reachability = {}
+
+# connect_ex results of a device that answers
+REACHABLE = {0, errno.ECONNREFUSED, getattr(errno, 'WSAECONNREFUSED', errno.ECONNREFUSED)}
+
+
 class ZK_helper(object):
     """
     ZK helper class
     """
+    ttl = 30        # seconds a reachability result is reused
+    timeout = 5     # probe timeout
 
     def __init__(self, ip, port=4370):
         """
@@ -70,33 +148,48 @@ class ZK_helper(object):
         self.ip = ip
         self.port = port
 
+    def record(self, result):
+        """
+        remember the result of a tcp connect to the device
+
+        :param result: connect_ex result (0: port open)
+        """
+        _reachability[self.address] = (monotonic(), result)
+
+    def __probe(self):
+        """
+        connect_ex result for the device port, from the cache when fresh
+        """
+        entry = _reachability.get(self.address)
+        if entry is not None and monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        client = socket(AF_INET, SOCK_STREAM)
+        client.settimeout(self.timeout)
+        try:
+            result = client.connect_ex(self.address)
+        except (OSError, OverflowError) as e:
+            result = getattr(e, 'errno', None) or errno.EHOSTUNREACH
+        finally:
+            client.close()
+        self.record(result)
+        return result
+
     def test_ping(self):
         """
-        Returns True if host responds to a ping request
+        Returns True if host responds: its port accepts or refuses a tcp
+        connection (no subprocess, result cached for ttl seconds)
 
         :return: bool
         """
-        import subprocess, platform
-        # Ping parameters as function of OS
-        ping_str = "-n 1" if  platform.system().lower()=="windows" else "-c 1 -W 5"
-        args = "ping " + " " + ping_str + " " + self.ip
-        need_sh = False if  platform.system().lower()=="windows" else True
-        # Ping
-        return subprocess.call(args,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=need_sh) == 0
+        return self.__probe() in REACHABLE
 
     def test_tcp(self):
         """
         test TCP connection
-        """
 
-        self.client = socket(AF_INET, SOCK_STREAM)
-        self.client.settimeout(10)
-        res = self.client.connect_ex(self.address)
-        self.client.close()
-        return res
+        :return: 0 when the tcp port is open
+        """
+        return self.__probe()
 
     def test_udp(self):
         """
@@ -110,7 +203,9 @@ class ZK(object):
     """
     ZK main class
     """
-    def __init__(self, ip, port=4370, timeout=60, password=0, force_udp=False, ommit_ping=False, verbose=False, encoding='UTF-8'):
+    connect_timeout = 5     # seconds to open the connection (tcp connect, udp CMD_CONNECT)
+    cursor_depth = 8        # last records hashed in the get_new_attendance cursor
+    def __init__(self, ip, port=4370, timeout=60, password=0, force_udp=False, ommit_ping=False, verbose=False, encoding='UTF-8', users_ttl=None, read_window=1, chunk_store=None):
         """
         Construct a new 'ZK' object.
 
@@ -122,6 +217,12 @@ class ZK(object):
         :param omit_ping: check ip using ping before connect
         :param verbose: showing log while run the commands
         :param encoding: user encoding
+        :param users_ttl: seconds the user table is reused by attendance
+            reads (None: until the device sizes change, 0: no cache)
+        :param read_window: buffered read chunk requests kept in flight
+            (1: wait for each chunk before asking the next one)
+        :param chunk_store: json file (or ChunkStore) keeping the learned
+            chunk sizes by device serial number
         """
         User.encoding = encoding
         self.__address = (ip, port)
@@ -133,6 +234,8 @@ class ZK(object):
         self.__reply_id = const.USHRT_MAX - 1
         self.__data_recv = None
         self.__data = None
+        self.__top = bytearray(16)
+        self.__recv_buf = bytearray(0x10000)
 
         self.is_connect = False
         self.is_enabled = True
@@ -158,6 +261,18 @@ class ZK(object):
         self.next_uid = 1
         self.next_user_id='1'
         self.user_packet_size = 28 # default zk6
+        self.user_index = UserIndex()
+        self.users_ttl = users_ttl
+        self.read_window = max(1, read_window)
+        max_chunk = 0xFFc0 if self.tcp else 16 * 1024
+        self.read_chunks = ChunkController(max_chunk, 1024, max_chunk)
+        self.write_chunks = ChunkController(1024, 1024, max_chunk)
+        if isinstance(chunk_store, str):
+            chunk_store = ChunkStore(chunk_store)
+        self.chunk_store = chunk_store
+        self.__serialnumber = None
+        self.__users_key = None
+        self.__users_time = 0
         self.end_live_capture = False
 
     def __nonzero__(self):
@@ -167,10 +282,13 @@ class ZK(object):
         return self.is_connect
 
     def __create_socket(self):
+        if self.__sock:
+            self.__sock.close() # previous session, maybe left with unread packets
         if self.tcp:
             self.__sock = socket(AF_INET, SOCK_STREAM)
+            self.__sock.settimeout(min(self.__timeout, self.connect_timeout))
+            self.helper.record(self.__sock.connect_ex(self.__address))
             self.__sock.settimeout(self.__timeout)
-            self.__sock.connect_ex(self.__address)
         else:
             self.__sock = socket(AF_INET, SOCK_DGRAM)
             self.__sock.settimeout(self.__timeout)
@@ -179,73 +297,27 @@ class ZK(object):
         """
         witch the complete packet set top header
         """
-        length = len(packet)
-        top = pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, length)
-        return top + packet
+        return create_tcp_top(packet)
 
     def __create_header(self, command, command_string, session_id, reply_id):
         """
         Puts a the parts that make up a packet together and packs them into a byte string
         """
-        buf = pack('<4H', command, 0, session_id, reply_id) + command_string
-        buf = unpack('8B' + '%sB' % len(command_string), buf)
-        checksum = unpack('H', self.__create_checksum(buf))[0]
-        reply_id += 1
-        if reply_id >= const.USHRT_MAX:
-            reply_id -= const.USHRT_MAX
-
-        buf = pack('<4H', command, checksum, session_id, reply_id)
-        return buf + command_string
-
-    def __create_checksum(self, p):
-        """
-        Calculates the checksum of the packet to be sent to the time clock
-        Copied from zkemsdk.c
-        """
-        l = len(p)
-        checksum = 0
-        while l > 1:
-            checksum += unpack('H', pack('BB', p[0], p[1]))[0]
-            p = p[2:]
-            if checksum > const.USHRT_MAX:
-                checksum -= const.USHRT_MAX
-            l -= 2
-        if l:
-            checksum = checksum + p[-1]
-
-        while checksum > const.USHRT_MAX:
-            checksum -= const.USHRT_MAX
-
-        checksum = ~checksum
-
-        while checksum < 0:
-            checksum += const.USHRT_MAX
-
-        return pack('H', checksum)
+        return create_header(command, command_string, session_id, reply_id)
 
     def __test_tcp_top(self, packet):
         """
         return size!
         """
-        if len(packet)<=8:
-            return 0
-        tcp_header = unpack('<HHI', packet[:8])
-        if tcp_header[0] == const.MACHINE_PREPARE_DATA_1 and tcp_header[1] == const.MACHINE_PREPARE_DATA_2:
-            return tcp_header[2]
-        return 0
+        return tcp_top_length(packet)
 
     def __send_command(self, command, command_string=b'', response_size=8):
         """
         send command to the terminal
         """
-        if command not in [const.CMD_CONNECT, const.CMD_AUTH] and not self.is_connect:
-            raise ZKErrorConnection("instance are not connected.")
-
-        buf = self.__create_header(command, command_string, self.__session_id, self.__reply_id)
+        self.__send_packet(command, command_string)
         try:
             if self.tcp:
-                top = self.__create_tcp_top(buf)
-                self.__sock.send(top)
                 self.__tcp_data_recv = self.__sock.recv(response_size + 8)
                 self.__tcp_length = self.__test_tcp_top(self.__tcp_data_recv)
                 if self.__tcp_length == 0:
@@ -253,7 +325,6 @@ class ZK(object):
                 self.__header = unpack('<4H', self.__tcp_data_recv[8:16])
                 self.__data_recv = self.__tcp_data_recv[8:]
             else:
-                self.__sock.sendto(buf, self.__address)
                 self.__data_recv = self.__sock.recv(response_size)
                 self.__header = unpack('<4H', self.__data_recv[:8])
         except Exception as e:
@@ -272,6 +343,26 @@ class ZK(object):
             'code': self.__response
         }
 
+    def __send_packet(self, command, command_string=b''):
+        """
+        send command to the terminal, the reply is left to the caller
+
+        :return: reply_id of the packet, echoed by the device reply
+        """
+        if command not in [const.CMD_CONNECT, const.CMD_AUTH] and not self.is_connect:
+            raise ZKErrorConnection("instance are not connected.")
+
+        buf = self.__create_header(command, command_string, self.__session_id, self.__reply_id)
+        try:
+            if self.tcp:
+                self.__sock.send(self.__create_tcp_top(buf))
+            else:
+                self.__sock.sendto(buf, self.__address)
+        except Exception as e:
+            raise ZKNetworkError(str(e))
+        self.__reply_id = HEADER.unpack_from(buf)[3]
+        return self.__reply_id
+
     def __ack_ok(self):
         """
         event ack ok
@@ -286,20 +377,6 @@ class ZK(object):
         except Exception as e:
             raise ZKNetworkError(str(e))
 
-    def __get_data_size(self):
-        """
-        Checks a returned packet to see if it returned CMD_PREPARE_DATA,
-        indicating that data packets are to be sent
-
-        Returns the amount of bytes that are going to be sent
-        """
-        response = self.__response
-        if response == const.CMD_PREPARE_DATA:
-            size = unpack('I', self.__data[:4])[0]
-            return size
-        else:
-            return 0
-
     def __reverse_hex(self, hex):
         data = ''
         for i in reversed(range(len(hex) / 2)):
@@ -312,49 +389,21 @@ class ZK(object):
 
         copied from zkemsdk.c - DecodeTime
         """
-
-        t = unpack("<I", t)[0]
-        second = t % 60
-        t = t // 60
-
-        minute = t % 60
-        t = t // 60
-
-        hour = t % 24
-        t = t // 24
-
-        day = t % 31 + 1
-        t = t // 31
-
-        month = t % 12 + 1
-        t = t // 12
-
-        year = t + 2000
-
-        d = datetime(year, month, day, hour, minute, second)
-
-        return d
+        if not isinstance(t, int):
+            t = unpack("<I", t)[0]
+        return decoders.decode_time(t)
 
     def __decode_timehex(self, timehex):
         """
         timehex string of six bytes
         """
-        year, month, day, hour, minute, second = unpack("6B", timehex)
-        year += 2000
-        d = datetime(year, month, day, hour, minute, second)
-        return d
+        return decoders.decode_timehex(timehex)
 
     def __encode_time(self, t):
         """
         Encode a timestamp so that it can be read on the timeclock
         """
-        # formula taken from zkemsdk.c - EncodeTime
-        # can also be found in the technical manual
-        d = (
-            ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
-            (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
-        )
-        return d
+        return timecodec.encode_time(t)
 
     def connect(self):
         """
@@ -363,14 +412,20 @@ class ZK(object):
         :return: bool
         """
         self.end_live_capture = False
-        if not self.ommit_ping and not self.helper.test_ping():
+        # the real connect is the reachability probe: the tcp connect, or
+        # the CMD_CONNECT exchange in udp mode (no tcp port to probe)
+        self.__create_socket()
+        if self.tcp and not self.ommit_ping and not self.helper.test_ping():
+            self.__sock.close()
             raise ZKNetworkError("can't reach device (ping %s)" % self.__address[0])
         if not self.force_udp and self.helper.test_tcp() == 0:
             self.user_packet_size = 72 # default zk8
-        self.__create_socket()
         self.__session_id = 0
         self.__reply_id = const.USHRT_MAX - 1
-        cmd_response = self.__send_command(const.CMD_CONNECT)
+        if self.tcp:
+            cmd_response = self.__send_command(const.CMD_CONNECT)
+        else:
+            cmd_response = self.__udp_connect()
         self.__session_id = self.__header[2]
         if cmd_response.get('code') == const.CMD_ACK_UNAUTH:
             if self.verbose: print ("try auth")
@@ -378,6 +433,8 @@ class ZK(object):
             cmd_response = self.__send_command(const.CMD_AUTH, command_string)
         if cmd_response.get('status'):
             self.is_connect = True
+            if self.chunk_store is not None:
+                self.__load_chunks()
             return self
         else:
             if cmd_response["code"] == const.CMD_ACK_UNAUTH:
@@ -385,6 +442,63 @@ class ZK(object):
             if self.verbose: print ("connect err response {} ".format(cmd_response["code"]))
             raise ZKErrorResponse("Invalid response: Can't connect")
 
+    def __udp_connect(self):
+        """
+        CMD_CONNECT over udp, within connect_timeout
+
+        :return: command response
+        """
+        self.__sock.settimeout(min(self.__timeout, self.connect_timeout))
+        try:
+            return self.__send_command(const.CMD_CONNECT)
+        except ZKNetworkError as e:
+            if not isinstance(e.__context__, OSError):
+                raise
+            self.__sock.close()
+            raise ZKNetworkError("can't reach device (udp %s: %s)" % (self.__address[0], e))
+        finally:
+            self.__sock.settimeout(self.__timeout)
+
+    def __chunks_keys(self):
+        transport = 'tcp' if self.tcp else 'udp'
+        return 'read_' + transport, 'write_' + transport
+
+    def __load_chunks(self):
+        """
+        restore the chunk sizes learned for this device
+        """
+        if self.__serialnumber is None:
+            self.__serialnumber = self.get_serialnumber()
+        sizes = self.chunk_store.load(self.__serialnumber)
+        for key, chunks in zip(self.__chunks_keys(), (self.read_chunks, self.write_chunks)):
+            if key + '_limit' in sizes:
+                chunks.limit = sizes[key + '_limit']
+            if key in sizes:
+                chunks.size = sizes[key]
+
+    def __save_chunks(self):
+        """
+        keep the chunk sizes learned for this device, if they changed
+        """
+        if self.chunk_store is None or self.__serialnumber is None:
+            return
+        if not (self.read_chunks.changed or self.write_chunks.changed):
+            return
+        read_key, write_key = self.__chunks_keys()
+        try:
+            self.chunk_store.save(self.__serialnumber, {
+                read_key: self.read_chunks.size,
+                read_key + '_limit': self.read_chunks.limit,
+                write_key: self.write_chunks.size,
+                write_key + '_limit': self.write_chunks.limit
+            })
+        except (IOError, OSError, ValueError) as e:
+            # the sizes are only a hint, never fail the transfer for them
+            print ("WRN: can't save chunk sizes: %s" % e)
+            return
+        self.read_chunks.changed = False
+        self.write_chunks.changed = False
+
     def disconnect(self):
         """
         diconnect from the connected device
@@ -921,6 +1035,7 @@ class ZK(object):
         if self.verbose: print("Response: %s" % cmd_response)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't set user")
+        self.invalidate_users()
         self.refresh_data()
         if self.next_uid == uid:
             self.next_uid += 1 # better recalculate again
@@ -935,16 +1050,11 @@ class ZK(object):
         :param fingers: list of finger. (The maximum index 0-9)
         """
         if not isinstance(user, User):
-            users = self.get_users()
-            tusers = list(filter(lambda x: x.uid==user, users))
-            if len(tusers) == 1:
-                user = tusers[0]
-            else:
-                tusers = list(filter(lambda x: x.user_id==str(user), users))
-                if len(tusers) == 1:
-                    user = tusers[0]
-                else:
-                    raise ZKErrorResponse("Can't find user")
+            users = self.__get_user_index()
+            tuser = users.get_by_uid(user) or users.get_by_user_id(user)
+            if tuser is None:
+                raise ZKErrorResponse("Can't find user")
+            user = tuser
         if isinstance(fingers, Finger):
             fingers = [fingers]
         self.HR_save_usertemplates ([(user, fingers)])
@@ -982,10 +1092,13 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't save usertemplates")
+        self.invalidate_users()
         self.refresh_data()
 
     def _send_with_buffer(self, buffer):
-        MAX_CHUNK = 1024
+        """
+        upload a buffer, in chunks sized by write_chunks
+        """
         size = len(buffer)
         self.free_data()
         command = const.CMD_PREPARE_DATA
@@ -993,22 +1106,38 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't prepare data")
-        remain = size % MAX_CHUNK
-        packets = (size - remain) // MAX_CHUNK
+        buffer = memoryview(buffer)
         start = 0
-        for _wlk in range(packets):
-            self.__send_chunk(buffer[start:start+MAX_CHUNK])
-            start += MAX_CHUNK
-        if remain:
-            self.__send_chunk(buffer[start:start+remain])
+        try:
+            while start < size:
+                start += self.__send_chunk(buffer, start)
+        finally:
+            self.__save_chunks()
 
-    def __send_chunk(self, command_string):
+    def __send_chunk(self, buffer, start):
+        """
+        send the chunk of buffer at start, retried at the (smaller) chunk
+        size after a failure
+
+        :return: number of bytes sent
+        """
         command = const.CMD_DATA
-        cmd_response = self.__send_command(command, command_string)
-        if cmd_response.get('status'):
-            return True
-        else:
-            raise ZKErrorResponse("Can't send chunk")
+        for retries in range(3):
+            chunk = buffer[start:start + self.write_chunks.size]
+            try:
+                cmd_response = self.__send_command(command, chunk)
+            except ZKNetworkError:
+                self.write_chunks.failure()
+                if retries == 2:
+                    raise
+                if self.verbose: print ("retry chunk {} with {} bytes".format(start, self.write_chunks.size))
+                continue
+            if cmd_response.get('status'):
+                self.write_chunks.success()
+                return len(chunk)
+            self.write_chunks.failure()
+            if self.verbose: print ("retry chunk {} with {} bytes".format(start, self.write_chunks.size))
+        raise ZKErrorResponse("Can't send chunk")
 
     def delete_user_template(self, uid=0, temp_id=0, user_id=''):
         """
@@ -1027,11 +1156,10 @@ class ZK(object):
             else:
                 return False # probably empty!
         if not uid:
-            users = self.get_users()
-            users = list(filter(lambda x: x.user_id==str(user_id), users))
-            if not users:
+            user = self.__get_user_index().get_by_user_id(user_id)
+            if user is None:
                 return False
-            uid = users[0].uid
+            uid = user.uid
         command = const.CMD_DELETE_USERTEMP
         command_string = pack('hb', uid, temp_id)
         cmd_response = self.__send_command(command, command_string)
@@ -1049,16 +1177,16 @@ class ZK(object):
         :return: bool
         """
         if not uid:
-            users = self.get_users()
-            users = list(filter(lambda x: x.user_id==str(user_id), users))
-            if not users:
+            user = self.__get_user_index().get_by_user_id(user_id)
+            if user is None:
                 return False
-            uid = users[0].uid
+            uid = user.uid
         command = const.CMD_DELETE_USER
         command_string = pack('h', uid)
         cmd_response = self.__send_command(command, command_string)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't delete user")
+        self.invalidate_users()
         self.refresh_data()
         if uid == (self.next_uid - 1):
             self.next_uid = uid
@@ -1070,19 +1198,17 @@ class ZK(object):
         :return: list Finger object of the selected user
         """
         if not uid:
-            users = self.get_users()
-            users = list(filter(lambda x: x.user_id==str(user_id), users))
-            if not users:
+            user = self.__get_user_index().get_by_user_id(user_id)
+            if user is None:
                 return False
-            uid = users[0].uid
+            uid = user.uid
         for _retries in range(3):
             command = const._CMD_GET_USERTEMP # command secret!!! GET_USER_TEMPLATE
             command_string = pack('hb', uid, temp_id)
-            response_size = 1024 + 8
-            cmd_response = self.__send_command(command, command_string, response_size)
+            self.__send_packet(command, command_string)
             data = self.__recieve_chunk()
             if data is not None:
-                resp = data[:-1]
+                resp = bytes(data[:-1])
                 if resp[-6:] == b'\x00\x00\x00\x00\x00\x00': # padding? bug?
                     resp = resp[:-6]
                 return Finger(uid, temp_id, 1, resp)
@@ -1121,12 +1247,25 @@ class ZK(object):
         :return: list of User object
         """
         self.read_sizes()
+        return self.__read_users()
+
+    def __read_users(self):
+        """
+        download the user table, sizes must be fresh (read_sizes)
+
+        :return: list of User object
+        """
+        # the cache key is committed only once the table is decoded: a failed
+        # download must not leave an empty index that looks fresh
+        key = self.__users_fingerprint()
+        started = monotonic()
+        self.__users_key = None
         if self.users == 0:
             self.next_uid = 1
             self.next_user_id='1'
+            self.user_index = UserIndex()
+            self.__users_key, self.__users_time = key, started
             return []
-        users = []
-        max_uid = 0
         userdata, size = self.read_with_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER)
         if self.verbose: print("user size {} (= {})".format(size, len(userdata)))
         if size <= 4:
@@ -1136,46 +1275,55 @@ class ZK(object):
         self.user_packet_size = total_size / self.users
         if not self.user_packet_size in [28, 72]:
             if self.verbose: print("WRN packet size would be  %i" % self.user_packet_size)
-        userdata = userdata[4:]
-        if self.user_packet_size == 28:
-            while len(userdata) >= 28:
-                uid, privilege, password, name, card, group_id, timezone, user_id = unpack('<HB5s8sIxBhI',userdata.ljust(28, b'\x00')[:28])
-                if uid > max_uid: max_uid = uid
-                password = (password.split(b'\x00')[0]).decode(self.encoding, errors='ignore')
-                name = (name.split(b'\x00')[0]).decode(self.encoding, errors='ignore').strip()
-                group_id = str(group_id)
-                user_id = str(user_id)
-                #TODO: check card value and find in ver8
-                if not name:
-                    name = "NN-%s" % user_id
-                user = User(uid, name, privilege, password, group_id, user_id, card)
-                users.append(user)
-                if self.verbose: print("[6]user:",uid, privilege, password, name, card, group_id, timezone, user_id)
-                userdata = userdata[28:]
-        else:
-            while len(userdata) >= 72:
-                uid, privilege, password, name, card, group_id, user_id = unpack('<HB8s24sIx7sx24s', userdata.ljust(72, b'\x00')[:72])
-                password = (password.split(b'\x00')[0]).decode(self.encoding, errors='ignore')
-                name = (name.split(b'\x00')[0]).decode(self.encoding, errors='ignore').strip()
-                group_id = (group_id.split(b'\x00')[0]).decode(self.encoding, errors='ignore').strip()
-                user_id = (user_id.split(b'\x00')[0]).decode(self.encoding, errors='ignore')
-                if uid > max_uid: max_uid = uid
-                if not name:
-                    name = "NN-%s" % user_id
-                user = User(uid, name, privilege, password, group_id, user_id, card)
-                users.append(user)
-                userdata = userdata[72:]
+        packet_size = 28 if self.user_packet_size == 28 else 72
+        columns = decoders.decode_users(memoryview(userdata)[4:], packet_size, self.encoding, 'python')
+        users = [User(*row) for row in zip(*[columns[name] for name in decoders.USER_COLUMNS])]
+        if self.verbose: print("users: %i" % len(users))
+        max_uid = max(columns['uid'], default=0)
         max_uid += 1
         self.next_uid = max_uid
         self.next_user_id = str(max_uid)
-        while True:
-            if any(u for u in users if u.user_id == self.next_user_id):
-                max_uid += 1
-                self.next_user_id = str(max_uid)
-            else:
-                break
+        self.user_index = UserIndex(users)
+        self.__users_key, self.__users_time = key, started
+        while self.user_index.get_by_user_id(self.next_user_id) is not None:
+            max_uid += 1
+            self.next_user_id = str(max_uid)
         return users
 
+    def __users_fingerprint(self):
+        """
+        cheap fingerprint of the user table, from the read_sizes counters
+
+        the device has no content hash: a user_id renumbered on the device
+        changes no counter, only users_ttl bounds how long it goes unseen
+        """
+        return (self.users, self.users_av, self.fingers, self.cards, self.faces)
+
+    def __get_user_index(self, sizes_read=False):
+        """
+        return the users indexed by uid and user_id
+
+        the cached table is reused while the device sizes are unchanged,
+        it is not older than users_ttl and it was not invalidated.
+
+        :param sizes_read: read_sizes was just called, don't call it again
+        :return: UserIndex
+        """
+        if not sizes_read:
+            self.read_sizes()
+        fresh = self.users_ttl is None or monotonic() - self.__users_time < self.users_ttl
+        if self.users_ttl != 0 and fresh and self.__users_key == self.__users_fingerprint():
+            if self.verbose: print ("using cached users")
+            return self.user_index
+        self.__read_users()
+        return self.user_index
+
+    def invalidate_users(self):
+        """
+        forget the cached user table, the next attendance read downloads it
+        """
+        self.__users_key = None
+
     def cancel_capture(self):
         """
         cancel capturing finger
@@ -1229,12 +1377,10 @@ class ZK(object):
         command = const.CMD_STARTENROLL
         done = False
         if  not user_id:
-            users = self.get_users()
-            users = list(filter(lambda x: x.uid==uid, users))
-            if len(users) >= 1:
-                user_id = users[0].user_id
-            else:
+            user = self.__get_user_index().get_by_uid(uid)
+            if user is None:
                 return False
+            user_id = user.user_id
         if self.tcp:
             command_string = pack('<24sbb',str(user_id).encode(), temp_id, 1)
         else:
@@ -1317,7 +1463,7 @@ class ZK(object):
         try live capture of events
         """
         was_enabled = self.is_enabled
-        users = self.get_users()
+        users = self.__get_user_index()
         self.cancel_capture()
         self.verify_user()
         if not self.is_enabled:
@@ -1345,38 +1491,12 @@ class ZK(object):
                 if not len(data):
                     if self.verbose: print ("empty")
                     continue
-                while len(data) >= 10:
-                    if len(data) == 10:
-                        user_id, status, punch, timehex = unpack('<HBB6s', data)
-                        data = data[10:]
-                    elif len(data) == 12:
-                        user_id, status, punch, timehex = unpack('<IBB6s', data)
-                        data = data[12:]
-                    elif len(data) == 14:
-                        user_id, status, punch, timehex, _other = unpack('<HBB6s4s', data)
-                        data = data[14:]
-                    elif len(data) == 32:
-                        user_id,  status, punch, timehex = unpack('<24sBB6s', data[:32])
-                        data = data[32:]
-                    elif len(data) == 36:
-                        user_id,  status, punch, timehex, _other = unpack('<24sBB6s4s', data[:36])
-                        data = data[36:]
-                    elif len(data) == 37:
-                        user_id,  status, punch, timehex, _other = unpack('<24sBB6s5s', data[:37])
-                        data = data[37:]
-                    elif len(data) >= 52:
-                        user_id,  status, punch, timehex, _other = unpack('<24sBB6s20s', data[:52])
-                        data = data[52:]
-                    if isinstance(user_id, int):
-                        user_id = str(user_id)
-                    else:
-                        user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
-                    timestamp = self.__decode_timehex(timehex)
-                    tuser = list(filter(lambda x: x.user_id == user_id, users))
-                    if not tuser:
+                for user_id, timestamp, status, punch in decoders.decode_events(data):
+                    tuser = users.get_by_user_id(user_id)
+                    if tuser is None:
                         uid = int(user_id)
                     else:
-                        uid = tuser[0].uid
+                        uid = tuser.uid
                     yield Attendance(user_id, timestamp, status, punch, uid)
             except timeout:
                 if self.verbose: print ("time out")
@@ -1401,267 +1521,616 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string)
         if cmd_response.get('status'):
             self.next_uid = 1
+            self.invalidate_users()
             return True
         else:
             raise ZKErrorResponse("can't clear data")
 
-    def __recieve_tcp_data(self, data_recv, size):
-        """ data_recv, raw tcp packet
-         must analyze tcp_length
-
-         must return data, broken
-         """
-        data = []
-        tcp_length = self.__test_tcp_top(data_recv)
-        if self.verbose: print ("tcp_length {}, size {}".format(tcp_length, size))
-        if tcp_length <= 0:
-            if self.verbose: print ("Incorrect tcp packet")
-            return None, b""
-        if (tcp_length - 8) < size:
-            if self.verbose: print ("tcp length too small... retrying")
-            resp, bh = self.__recieve_tcp_data(data_recv, tcp_length - 8)
-            data.append(resp)
-            size -= len(resp)
-            if self.verbose: print ("new tcp DATA packet to fill misssing {}".format(size))
-            data_recv = bh + self.__sock.recv(size + 16 )
-            if self.verbose: print ("new tcp DATA starting with {} bytes".format(len(data_recv)))
-            resp, bh = self.__recieve_tcp_data(data_recv, size)
-            data.append(resp)
-            if self.verbose: print ("for misssing {} recieved {} with extra {}".format(size, len(resp), len(bh)))
-            return b''.join(data), bh
-        recieved = len(data_recv)
-        if self.verbose: print ("recieved {}, size {}".format(recieved, size))
-        response = unpack('HHHH', data_recv[8:16])[0]
-        if recieved >= (size + 32):
-            if response == const.CMD_DATA:
-                resp = data_recv[16 : size + 16]
-                if self.verbose: print ("resp complete len {}".format(len(resp)))
-                return resp, data_recv[size + 16:]
-            else:
-                if self.verbose: print("incorrect response!!! {}".format(response))
-                return None, b""
+    def __recv_into(self, view):
+        """
+        fill a writable view from the tcp stream
+        """
+        size = len(view)
+        recieved = 0
+        try:
+            while recieved < size:
+                count = self.__sock.recv_into(view[recieved:], size - recieved)
+                if not count:
+                    raise ZKNetworkError("connection closed by the device")
+                recieved += count
+        except OSError as e:
+            raise ZKNetworkError(str(e))
+
+    def __recv_view(self, size):
+        """
+        :return: writable view on the reused receive buffer, valid until
+            the next read
+        """
+        if len(self.__recv_buf) < size:
+            self.__recv_buf = bytearray(size)
+        return memoryview(self.__recv_buf)[:size]
+
+    def __recieve_packet(self, reply=True):
+        """
+        read the header of the next packet, its data is left in the
+        socket (tcp) or in the receive buffer (udp)
+
+        :param reply: the packet answers the last command (keep its ids)
+        :return: (header, data size)
+        """
+        if self.tcp:
+            top = memoryview(self.__top)
+            self.__recv_into(top)
+            length = tcp_top_length(top)
+            if length < 8:
+                raise ZKNetworkError("TCP packet invalid")
+            size = length - 8
+            header = HEADER.unpack_from(top, 8)
         else:
-            if self.verbose: print ("try DATA incomplete (actual valid {})".format(recieved-16))
-            data.append(data_recv[16 : size + 16 ])
-            size -= recieved - 16
-            broken_header = b""
-            if size < 0:
-                broken_header = data_recv[size:]
-                if self.verbose: print ("broken", (broken_header).encode('hex'))
-            if size > 0:
-                data_recv = self.__recieve_raw_data(size)
-                data.append(data_recv)
-            return b''.join(data), broken_header
-
-    def __recieve_raw_data(self, size):
-        """ partial data ? """
-        data = []
-        if self.verbose: print ("expecting {} bytes raw data".format(size))
-        while size > 0:
-            data_recv = self.__sock.recv(size)
-            recieved = len(data_recv)
-            if self.verbose: print ("partial recv {}".format(recieved))
-            if recieved < 100 and self.verbose: print ("   recv {}".format(codecs.encode(data_recv, 'hex')))
-            data.append(data_recv)
-            size -= recieved
-            if self.verbose: print ("still need {}".format(size))
-        return b''.join(data)
-
-    def __recieve_chunk(self):
-        """ recieve a chunk """
-        if self.__response == const.CMD_DATA:
-            if self.tcp:
-                if self.verbose: print ("_rc_DATA! is {} bytes, tcp length is {}".format(len(self.__data), self.__tcp_length))
-                if len(self.__data) < (self.__tcp_length - 8):
-                    need = (self.__tcp_length - 8) - len(self.__data)
-                    if self.verbose: print ("need more data: {}".format(need))
-                    more_data = self.__recieve_raw_data(need)
-                    return b''.join([self.__data, more_data])
-                else:
-                    if self.verbose: print ("Enough data")
-                    return self.__data
+            try:
+                size = self.__sock.recv_into(self.__recv_buf) - 8
+                header = HEADER.unpack_from(self.__recv_buf)
+            except Exception as e:
+                raise ZKNetworkError(str(e))
+        if reply:
+            self.__header = header
+            self.__response = header[0]
+            self.__reply_id = header[3]
+        return header, size
+
+    def __recieve_data(self, size, out=None):
+        """
+        read the data of the packet from __recieve_packet
+
+        :param out: writable view to fill, the receive buffer when None
+        :return: view of the data
+        """
+        if self.tcp:
+            view = self.__recv_view(size) if out is None else out[:size]
+            self.__recv_into(view)
+            return view
+        data = memoryview(self.__recv_buf)[8:8 + size]
+        if out is None:
+            return data
+        out[:size] = data
+        return out[:size]
+
+    def __recieve_chunk(self, out=None):
+        """
+        recieve a chunk, tcp data packets are read straight into out
+
+        :param out: writable view of the expected size, None to use the
+            receive buffer
+        :return: view of the data, None on an unexpected reply
+        """
+        header, size = self.__recieve_packet()
+        return self.__recieve_chunk_data(header[0], size, out)
+
+    def __recieve_chunk_data(self, response, size, out=None):
+        """
+        recieve the rest of a chunk once its first packet header is read
+        """
+        if response == const.CMD_DATA:
+            if self.verbose: print ("_rc_DATA! is {} bytes".format(size))
+            if out is not None and len(out) < size:
+                if self.verbose: print ("chunk larger than expected")
+                self.__recieve_data(size)
+                return None
+            return self.__recieve_data(size, out)
+        if response != const.CMD_PREPARE_DATA:
+            if self.verbose: print ("invalid response %s" % response)
+            self.__recieve_data(size)
+            return None
+        total = unpack('<I', self.__recieve_data(size)[:4])[0]
+        if self.verbose: print ("recieve chunk: prepare data size is {}".format(total))
+        if out is None:
+            out = memoryview(bytearray(total))
+        recieved = 0
+        while True:
+            header, size = self.__recieve_packet(reply=False)
+            response = header[0]
+            if response == const.CMD_DATA and recieved + size <= len(out):
+                self.__recieve_data(size, out[recieved:])
+                recieved += size
+                if self.verbose: print ("still needs %s" % (total - recieved))
+            elif response == const.CMD_ACK_OK:
+                self.__recieve_data(size)
+                if self.verbose: print ("chunk ACK OK!")
+                return out[:recieved]
             else:
-                if self.verbose: print ("_rc len is {}".format(len(self.__data)))
-                return self.__data
-        elif self.__response == const.CMD_PREPARE_DATA:
-            data = []
-            size = self.__get_data_size()
-            if self.verbose: print ("recieve chunk: prepare data size is {}".format(size))
-            if self.tcp:
-                if len(self.__data) >= (8 + size):
-                    data_recv = self.__data[8:]
-                else:
-                    data_recv = self.__data[8:] + self.__sock.recv(size + 32)
-                resp, broken_header = self.__recieve_tcp_data(data_recv, size)
-                data.append(resp)
-                # get CMD_ACK_OK
-                if len(broken_header) < 16:
-                    data_recv = broken_header + self.__sock.recv(16)
-                else:
-                    data_recv = broken_header
-                if len(data_recv) < 16:
-                    print ("trying to complete broken ACK %s /16" % len(data_recv))
-                    if self.verbose: print (data_recv.encode('hex'))
-                    data_recv += self.__sock.recv(16 - len(data_recv)) #TODO: CHECK HERE_!
-                if not self.__test_tcp_top(data_recv):
-                    if self.verbose: print ("invalid chunk tcp ACK OK")
-                    return None
-                response = unpack('HHHH', data_recv[8:16])[0]
-                if response == const.CMD_ACK_OK:
-                    if self.verbose: print ("chunk tcp ACK OK!")
-                    return b''.join(data)
-                if self.verbose: print("bad response %s" % data_recv)
-                if self.verbose: print (codecs.encode(data,'hex'))
+                if self.verbose: print ("broken! response %s" % response)
+                self.__recieve_data(size)
                 return None
 
-                return resp
-            while True:
-                data_recv = self.__sock.recv(1024+8)
-                response = unpack('<4H', data_recv[:8])[0]
-                if self.verbose: print ("# packet response is: {}".format(response))
-                if response == const.CMD_DATA:
-                    data.append(data_recv[8:])
-                    size -= 1024
-                elif response == const.CMD_ACK_OK:
-                    break
-                else:
-                    if self.verbose: print ("broken!")
-                    break
-                if self.verbose: print ("still needs %s" % size)
-            return b''.join(data)
-        else:
-            if self.verbose: print ("invalid response %s" % self.__response)
-            return None
+    def __recieve_reply(self, reply_id, out=None):
+        """
+        recieve the chunk answering reply_id, late replies to a request
+        that timed out are dropped
+
+        :return: view of the data, None on an unexpected reply
+        """
+        while True:
+            header, size = self.__recieve_packet(reply=False)
+            if header[3] == reply_id:
+                return self.__recieve_chunk_data(header[0], size, out)
+            self.__drop_reply(header, size)
 
-    def __read_chunk(self, start, size):
+    def __drop_reply(self, header, size):
         """
-        read a chunk from buffer
+        skip a reply matching no request in flight
         """
-        for _retries in range(3):
-            command = const._CMD_READ_BUFFER
-            command_string = pack('<ii', start, size)
-            if self.tcp:
-                response_size = size + 32
-            else:
-                response_size = 1024 + 8
-            cmd_response = self.__send_command(command, command_string, response_size)
-            data = self.__recieve_chunk()
-            if data is not None:
-                return data
-        else:
-            raise ZKErrorResponse("can't read chunk %i:[%i]" % (start, size))
+        if self.verbose: print ("unexpected reply_id {}".format(header[3]))
+        self.__recieve_chunk_data(header[0], size)
 
-    def read_with_buffer(self, command, fct=0 ,ext=0):
+    def __read_chunk(self, start, size, out=None):
         """
-        Test read info with buffered command (ZK6: 1503)
+        read a chunk from buffer, retried at the (smaller) chunk size after
+        a failure
+
+        :return: (data, size read), size is smaller when it was retried smaller
+        """
+        for retries in range(3):
+            command = const._CMD_READ_BUFFER
+            command_string = pack('<ii', start, size)
+            try:
+                reply_id = self.__send_packet(command, command_string)
+                data = self.__recieve_reply(reply_id, out)
+            except ZKNetworkError:
+                if retries == 2:
+                    self.read_chunks.failure()
+                    raise
+                data = None
+            if data is not None and len(data) == size:
+                self.read_chunks.success()
+                return data, size
+            self.read_chunks.failure()
+            size = min(size, self.read_chunks.size)
+            if out is not None:
+                out = out[:size]
+            if self.verbose: print ("retry chunk {} with {} bytes".format(start, size))
+        raise ZKErrorResponse("can't read chunk %i:[%i]" % (start, size))
+
+    def __prepare_buffer(self, command, fct=0, ext=0):
+        """
+        ask the device to prepare a buffered read (ZK6: 1503)
+
+        :return: (size, data), data is the whole buffer when the device
+            sends it inline, None when it must be read with __read_chunk
         """
-        if self.tcp:
-            MAX_CHUNK = 0xFFc0
-        else:
-            MAX_CHUNK = 16 * 1024
         command_string = pack('<bhii', 1, command, fct, ext)
         if self.verbose: print ("rwb cs", command_string)
-        response_size = 1024
-        data = []
-        start = 0
-        cmd_response = self.__send_command(const._CMD_PREPARE_BUFFER, command_string, response_size)
-        if not cmd_response.get('status'):
+        self.__send_packet(const._CMD_PREPARE_BUFFER, command_string)
+        header, size = self.__recieve_packet()
+        response = header[0]
+        data = self.__recieve_data(size)
+        if response not in [const.CMD_ACK_OK, const.CMD_PREPARE_DATA, const.CMD_DATA]:
             raise ZKErrorResponse("RWB Not supported")
-        if cmd_response['code'] == const.CMD_DATA:
-            if self.tcp:
-                if self.verbose: print ("DATA! is {} bytes, tcp length is {}".format(len(self.__data), self.__tcp_length))
-                if len(self.__data) < (self.__tcp_length - 8):
-                    need = (self.__tcp_length - 8) - len(self.__data)
-                    if self.verbose: print ("need more data: {}".format(need))
-                    more_data = self.__recieve_raw_data(need)
-                    return b''.join([self.__data, more_data]), len(self.__data) + len(more_data)
-                else:
-                    if self.verbose: print ("Enough data")
-                    size = len(self.__data)
-                    return self.__data, size
-            else:
-                size = len(self.__data)
-                return self.__data, size
-        size = unpack('I', self.__data[1:5])[0]
+        if response == const.CMD_DATA:
+            if self.verbose: print ("DATA! is {} bytes".format(size))
+            return size, bytes(data)
+        size = unpack('I', data[1:5])[0]
         if self.verbose: print ("size fill be %i" % size)
-        remain = size % MAX_CHUNK
-        packets = (size-remain) // MAX_CHUNK # should be size /16k
-        if self.verbose: print ("rwb: #{} packets of max {} bytes, and extra {} bytes remain".format(packets, MAX_CHUNK, remain))
-        for _wlk in range(packets):
-            data.append(self.__read_chunk(start,MAX_CHUNK))
-            start += MAX_CHUNK
-        if remain:
-            data.append(self.__read_chunk(start, remain))
-            start += remain
+        return size, None
+
+    def __iter_buffer(self, size, start=0, out=None):
+        """
+        yield a prepared buffer from start to size, chunk by chunk
+
+        each chunk is a view on the receive buffer, only valid until the
+        next one is read, unless out is given: chunks are then read in
+        place into it. With read_window > 1 the chunk requests are
+        pipelined. The chunk size follows read_chunks.
+        """
+        if self.verbose: print ("rwb: {} bytes from {} in chunks of {} bytes".format(size - start, start, self.read_chunks.size))
+        if self.read_window > 1:
+            chunks = self.__iter_pipelined(size, start, out)
+        else:
+            chunks = self.__iter_chunks(size, start, out)
+        position = 0
+        try:
+            for data in chunks:
+                position += len(data)
+                yield data
+        finally:
+            chunks.close() # stopped early: drain the replies in flight
+            self.__save_chunks()
+        if self.verbose: print ("_read w/chunk %i bytes" % position)
+
+    def __iter_chunks(self, size, start, out):
+        """
+        one chunk request at a time
+        """
+        offset = start
+        position = 0
+        while offset < size:
+            chunk = min(self.read_chunks.size, size - offset)
+            data, chunk = self.__read_chunk(offset, chunk, None if out is None else out[position:position + chunk])
+            position += len(data)
+            offset += chunk
+            yield data
+
+    def __iter_pipelined(self, size, start, out):
+        """
+        keep up to read_window chunk requests in flight, replies are
+        matched to their request by reply_id and yielded in order
+        """
+        pending = []
+        in_flight = {}
+        offset = start
+        timeouts = 0
+        try:
+            while offset < size or pending:
+                while offset < size and len(in_flight) < self.read_window:
+                    chunk = min(self.read_chunks.size, size - offset)
+                    if out is None:
+                        dest = memoryview(bytearray(chunk))
+                    else:
+                        dest = out[offset - start:offset - start + chunk]
+                    request = {'start': offset, 'dest': dest, 'data': None, 'retries': 0}
+                    pending.append(request)
+                    self.__request_chunk(request, in_flight)
+                    offset += chunk
+                if pending[0]['data'] is not None:
+                    yield pending.pop(0)['data']
+                    continue
+                try:
+                    header, length = self.__recieve_packet(reply=False)
+                except ZKNetworkError:
+                    self.read_chunks.failure()
+                    timeouts += 1
+                    if timeouts > 2:
+                        raise
+                    # ask again from the first missing chunk at the smaller
+                    # size, late replies are dropped by their reply_id
+                    if self.verbose: print ("retry from chunk {} with {} bytes".format(pending[0]['start'], self.read_chunks.size))
+                    offset = pending[0]['start']
+                    del pending[:]
+                    in_flight.clear()
+                    continue
+                request = in_flight.pop(header[3], None)
+                if request is None:
+                    self.__drop_reply(header, length)
+                    continue
+                data = self.__recieve_chunk_data(header[0], length, request['dest'])
+                if data is not None and len(data) == len(request['dest']):
+                    self.read_chunks.success()
+                    timeouts = 0
+                    request['data'] = data
+                    continue
+                self.read_chunks.failure()
+                if request['retries'] < 2:
+                    if self.verbose: print ("retry chunk {}".format(request['start']))
+                    request['retries'] += 1
+                    self.__request_chunk(request, in_flight)
+                else:
+                    raise ZKErrorResponse("can't read chunk %i:[%i]" % (request['start'], len(request['dest'])))
+        except GeneratorExit:
+            # reader stopped early, drop the replies still on the way
+            while in_flight:
+                header, length = self.__recieve_packet(reply=False)
+                in_flight.pop(header[3], None)
+                self.__recieve_chunk_data(header[0], length)
+            raise
+
+    def __request_chunk(self, request, in_flight):
+        """
+        send a _CMD_READ_BUFFER for a pipelined chunk request
+        """
+        command_string = pack('<ii', request['start'], len(request['dest']))
+        in_flight[self.__send_packet(const._CMD_READ_BUFFER, command_string)] = request
+
+    def __read_buffer(self, size, start=0):
+        """
+        read a prepared buffer from start to size into a single bytearray
+        """
+        data = bytearray(max(size - start, 0))
+        recieved = sum(len(chunk) for chunk in self.__iter_buffer(size, start, memoryview(data)))
+        if recieved < len(data):
+            data = data[:recieved]
+        return data, recieved
+
+    def read_with_buffer(self, command, fct=0 ,ext=0, start=0):
+        """
+        Test read info with buffered command (ZK6: 1503)
+
+        :param start: first byte of the buffer to read (skip what is already known)
+        :return: (data, size)
+        """
+        size, data = self.__prepare_buffer(command, fct, ext)
+        if data is not None:
+            data = data[start:]
+            return data, len(data)
+        data, size = self.__read_buffer(size, start)
         self.free_data()
-        if self.verbose: print ("_read w/chunk %i bytes" % start)
-        return b''.join(data), start
+        return data, size
 
-    def get_attendance(self):
+    def __iter_records(self, chunks, record_size):
+        """
+        regroup a stream of chunks on record boundaries
+
+        yield views holding a whole number of records, only the bytes of a
+        record split between two chunks are copied
+        """
+        pending = b''
+        for chunk in chunks:
+            view = memoryview(chunk)
+            if pending:
+                need = record_size - len(pending)
+                pending += bytes(view[:need])
+                view = view[need:]
+                if len(pending) < record_size:
+                    continue
+                yield pending
+                pending = b''
+            usable = len(view) - len(view) % record_size
+            if usable:
+                yield view[:usable]
+            pending = bytes(view[usable:])
+
+    def __iter_decode_attendance(self, chunks, record_size, users, low=0, high=timecodec.DEVICE_MAX):
+        """
+        decode raw attendance records (without the 4 bytes size header)
+
+        :param chunks: iterable of bytes-like objects
+        :param users: UserIndex used to resolve user ids
+        :param low: first raw device time kept
+        :param high: raw device time bound, excluded
+        :return: generator of Attendance object
+        """
+        if record_size == 8:
+            for data in self.__iter_records(chunks, record_size):
+                for uid, status, timestamp, punch in ATTENDANCE_8.iter_unpack(data):
+                    if not low <= timestamp < high:
+                        continue
+                    tuser = users.get_by_uid(uid)
+                    if tuser is None:
+                        user_id = str(uid)
+                    else:
+                        user_id = tuser.user_id
+                    timestamp = self.__decode_time(timestamp)
+                    yield Attendance(user_id, timestamp, status, punch, uid)
+        elif record_size == 16:
+            for data in self.__iter_records(chunks, record_size):
+                for user_id, timestamp, status, punch, reserved, workcode in ATTENDANCE_16.iter_unpack(data):
+                    if not low <= timestamp < high:
+                        continue
+                    user_id = str(user_id)
+                    tuser = users.get_by_user_id(user_id)
+                    if tuser is None:
+                        if self.verbose: print("no uid {}", user_id)
+                        uid = str(user_id)
+                    else:
+                        uid = tuser.uid
+                    timestamp = self.__decode_time(timestamp)
+                    yield Attendance(user_id, timestamp, status, punch, uid)
+        elif record_size >= 40:
+            record = Struct(ATTENDANCE_40.format + '%ix' % (record_size - 40))
+            for data in self.__iter_records(chunks, record_size):
+                for uid, user_id, status, timestamp, punch, space in record.iter_unpack(data):
+                    if not low <= timestamp < high:
+                        continue
+                    user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
+                    timestamp = self.__decode_time(timestamp)
+                    yield Attendance(user_id, timestamp, status, punch, uid)
+        else:
+            if self.verbose: print ("WRN: unknown record size %i" % record_size)
+
+    def __decode_attendance(self, attendance_data, record_size, users, since=None, until=None):
+        """
+        decode raw attendance records (without the 4 bytes size header)
+
+        :return: List of Attendance object
+        """
+        low, high = timecodec.device_bounds(since, until)
+        return list(self.__iter_decode_attendance([attendance_data], record_size, users, low, high))
+
+    def iter_attendance(self, since=None, until=None):
+        """
+        yield attendance records while the log is downloaded
+
+        records are decoded as each buffer chunk arrives, so memory stays
+        at one chunk whatever the size of the log. Records out of the
+        since/until range are skipped on their raw device time once the
+        record is unpacked, before its time is decoded or its user looked up.
+
+        :param since: keep records at or after this datetime
+        :param until: keep records before this datetime
+        :return: generator of Attendance object
+        """
+        low, high = timecodec.device_bounds(since, until)
+        self.read_sizes()
+        if self.records == 0:
+            return
+        users = self.__get_user_index(sizes_read=True)
+        if self.verbose: print (users.users)
+        size, attendance_data = self.__prepare_buffer(const.CMD_ATTLOG_RRQ)
+        buffer = self.__iter_buffer(size) if attendance_data is None else None
+        chunks = iter([attendance_data]) if buffer is None else buffer
+        try:
+            header = b''
+            for chunk in chunks:
+                header += chunk
+                if len(header) >= 4:
+                    break
+            if len(header) < 4:
+                if self.verbose: print ("WRN: no attendance data")
+                return
+            total_size = unpack("I", header[:4])[0]
+            record_size = total_size // self.records
+            if self.verbose: print ("record_size is ", record_size)
+            chunks = chain([memoryview(header)[4:]], chunks)
+            for attendance in self.__iter_decode_attendance(chunks, record_size, users, low, high):
+                yield attendance
+        finally:
+            if buffer is not None:
+                # the chunk replies still in flight come before CMD_FREE_DATA's
+                buffer.close()
+                self.free_data()
+
+    def get_attendance(self, since=None, until=None):
         """
         return attendance record
 
+        :param since: keep records at or after this datetime
+        :param until: keep records before this datetime
         :return: List of Attendance object
         """
+        return list(self.iter_attendance(since, until))
+
+    def get_attendance_columns(self, backend=None, since=None, until=None):
+        """
+        return the attendance log decoded in columns, for bulk exports
+
+        :param backend: 'python', 'numpy' or None (numpy when installed)
+        :param since: keep records at or after this datetime
+        :param until: keep records before this datetime
+        :return: dict of columns user_id, timestamp, status, punch, uid
+            (lists, or numpy arrays with datetime64 timestamps)
+        """
         self.read_sizes()
         if self.records == 0:
-            return []
-        users = self.get_users()
-        if self.verbose: print (users)
-        attendances = []
+            return decoders.decode_attendance(b'', 8, UserIndex(), backend)
+        users = self.__get_user_index(sizes_read=True)
         attendance_data, size = self.read_with_buffer(const.CMD_ATTLOG_RRQ)
         if size < 4:
             if self.verbose: print ("WRN: no attendance data")
-            return []
+            return decoders.decode_attendance(b'', 8, users, backend)
         total_size = unpack("I", attendance_data[:4])[0]
         record_size = total_size // self.records
-        if self.verbose: print ("record_size is ", record_size)
-        attendance_data = attendance_data[4:]
-        if record_size == 8:
-            while len(attendance_data) >= 8:
-                uid, status, timestamp, punch = unpack('HB4sB', attendance_data.ljust(8, b'\x00')[:8])
-                if self.verbose: print (codecs.encode(attendance_data[:8], 'hex'))
-                attendance_data = attendance_data[8:]
-                tuser = list(filter(lambda x: x.uid == uid, users))
-                if not tuser:
-                    user_id = str(uid)
-                else:
-                    user_id = tuser[0].user_id
-                timestamp = self.__decode_time(timestamp)
-                attendance = Attendance(user_id, timestamp, status, punch, uid)
-                attendances.append(attendance)
-        elif record_size == 16:
-            while len(attendance_data) >= 16:
-                user_id, timestamp, status, punch, reserved, workcode = unpack('<I4sBB2sI', attendance_data.ljust(16, b'\x00')[:16])
-                user_id = str(user_id)
-                if self.verbose: print(codecs.encode(attendance_data[:16], 'hex'))
-                attendance_data = attendance_data[16:]
-                tuser = list(filter(lambda x: x.user_id == user_id, users))
-                if not tuser:
-                    if self.verbose: print("no uid {}", user_id)
-                    uid = str(user_id)
-                    tuser = list(filter(lambda x: x.uid == user_id, users))
-                    if not tuser:
-                        uid = str(user_id)
-                    else:
-                        uid = tuser[0].uid
-                        user_id = tuser[0].user_id
-                else:
-                    uid = tuser[0].uid
-                timestamp = self.__decode_time(timestamp)
-                attendance = Attendance(user_id, timestamp, status, punch, uid)
-                attendances.append(attendance)
-        else:
-            while len(attendance_data) >= 40:
-                uid, user_id, status, timestamp, punch, space = unpack('<H24sB4sB8s', attendance_data.ljust(40, b'\x00')[:40])
-                if self.verbose: print (codecs.encode(attendance_data[:40], 'hex'))
-                user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
-                timestamp = self.__decode_time(timestamp)
+        return decoders.decode_attendance(memoryview(attendance_data)[4:], record_size, users, backend, since, until)
 
-                attendance = Attendance(user_id, timestamp, status, punch, uid)
-                attendances.append(attendance)
-                attendance_data = attendance_data[record_size:]
-        return attendances
+    def get_users_columns(self, backend=None):
+        """
+        return the user table decoded in columns, for bulk exports
+
+        :param backend: 'python', 'numpy' or None (numpy when installed)
+        :return: dict of columns uid, name, privilege, password, group_id, user_id, card
+        """
+        self.read_sizes()
+        if self.users == 0:
+            return decoders.decode_users(b'', 72, self.encoding, backend)
+        userdata, size = self.read_with_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER)
+        if size <= 4:
+            if self.verbose: print("WRN: missing user data")
+            return decoders.decode_users(b'', 72, self.encoding, backend)
+        total_size = unpack("I", userdata[:4])[0]
+        packet_size = total_size // self.users
+        return decoders.decode_users(memoryview(userdata)[4:], packet_size, self.encoding, backend)
+
+    def __attendance_cursor(self, records, record_size, records_data, incremental):
+        """
+        build the cursor that lets get_new_attendance resume after the last record
+
+        :param records_data: the last records of the log (at least the new ones)
+        """
+        depth = min(self.cursor_depth, len(records_data) // record_size) if record_size else 0
+        window = bytes(records_data[len(records_data) - depth * record_size:]) if depth else b''
+        return {
+            'records': records,
+            'record_size': record_size,
+            'offset': 4 + records * record_size,
+            'tail': codecs.encode(window[-record_size:] if depth else b'', 'hex').decode('ascii'),
+            'depth': depth,
+            'digest': hashlib.sha1(window).hexdigest(),
+            'incremental': incremental
+        }
+
+    def __cursor_matches(self, cursor, known, record_size):
+        """
+        check the records read back at the cursor are the known ones
+
+        :param known: the last `depth` records known by the cursor
+        """
+        if cursor.get('digest') and cursor.get('depth'):
+            return len(known) == cursor['depth'] * record_size and \
+                hashlib.sha1(bytes(known)).hexdigest() == cursor['digest']
+        return codecs.encode(known[-record_size:], 'hex').decode('ascii') == cursor['tail']
+
+    def get_new_attendance(self, cursor=None, batch=False, since=None, until=None):
+        """
+        return only the attendance records added since a previous call
+
+        the device log is read from the byte offset saved in the cursor,
+        the last known records (``depth`` of them, checked against the
+        cursor ``digest``) are read again to check the log was not
+        replaced. A full read is done when there is no cursor, when the log
+        was cleared or is full (it may wrap), or when the record layout
+        changed; in that case the new cursor has ``incremental`` False.
+        Save the returned cursor only once the records are safely stored.
+
+        :param cursor: dict returned by a previous call, or None
+        :param batch: return an AttendanceBatch instead of a list
+        :param since: keep new records at or after this datetime
+        :param until: keep new records before this datetime
+        :return: (List of Attendance object or AttendanceBatch, new cursor)
+        """
+        empty = AttendanceBatch() if batch else []
+        self.read_sizes()
+        if self.records == 0:
+            return empty, self.__attendance_cursor(0, 0, b'', cursor is not None)
+        incremental = bool(cursor and cursor.get('record_size') and cursor.get('tail'))
+        if incremental and self.records < cursor['records']:
+            if self.verbose: print ("attendance log cleared, full read")
+            incremental = False
+        if incremental and self.rec_cap and self.records >= self.rec_cap:
+            if self.verbose: print ("attendance log full, full read")
+            incremental = False
+        if incremental and self.records == cursor['records']:
+            return empty, dict(cursor, incremental=True)
+        size, attendance_data = self.__prepare_buffer(const.CMD_ATTLOG_RRQ)
+        if attendance_data is not None:
+            prefetched = attendance_data
+            header = attendance_data[:4]
+        else:
+            prefetched = None
+            header, _ = self.__read_buffer(min(4, size))
+        if len(header) < 4:
+            if self.verbose: print ("WRN: no attendance data")
+            if prefetched is None:
+                self.free_data()
+            return empty, self.__attendance_cursor(0, 0, b'', False)
+        total_size = unpack("I", header[:4])[0]
+        record_size = total_size // self.records
+        if not record_size:
+            if self.verbose: print ("WRN: invalid attendance size %i" % total_size)
+            if prefetched is None:
+                self.free_data()
+            return empty, self.__attendance_cursor(0, 0, b'', False)
+        if incremental and record_size != cursor['record_size']:
+            if self.verbose: print ("record size changed, full read")
+            incremental = False
+        records_data = None
+        known = b''
+        if incremental:
+            depth = min(cursor.get('depth') or 1, cursor['records'])
+            start = 4 + (cursor['records'] - depth) * record_size
+            if prefetched is not None:
+                records_data = prefetched[start:]
+            else:
+                records_data, _ = self.__read_buffer(size, start)
+            known = records_data[:depth * record_size]
+            if not self.__cursor_matches(cursor, known, record_size):
+                if self.verbose: print ("last known records not found, full read")
+                incremental = False
+                records_data = None
+                known = b''
+            else:
+                records_data = records_data[depth * record_size:]
+        if records_data is None:
+            if prefetched is not None:
+                records_data = prefetched[4:]
+            else:
+                records_data, _ = self.__read_buffer(size, 4)
+        if prefetched is None:
+            self.free_data()
+        records = len(records_data) // record_size
+        if incremental:
+            records += cursor['records']
+        new_cursor = self.__attendance_cursor(records, record_size, bytes(known) + bytes(records_data), incremental)
+        users = self.__get_user_index(sizes_read=True) if records_data else UserIndex()
+        if batch:
+            return AttendanceBatch.decode(records_data, record_size, users, since, until), new_cursor
+        return self.__decode_attendance(records_data, record_size, users, since, until), new_cursor
 
     def clear_attendance(self):
         """
@@ -1675,3 +2144,30 @@ class ZK(object):
             return True
         else:
             raise ZKErrorResponse("Can't clear response")
+
+    def clear_attendance_checked(self, records):
+        """
+        clear the attendance log only if it still holds ``records`` records,
+        e.g. the count of a cursor whose records are archived
+
+        the device is disabled from the count check to the clear, so no
+        punch can be recorded (and lost) in between. It is left disabled
+        when the caller had disabled it.
+
+        :param records: expected number of records
+        :return: bool, False when the count differs (nothing cleared)
+        """
+        was_enabled = self.is_enabled
+        if was_enabled:
+            self.disable_device()
+        try:
+            self.read_sizes()
+            if self.records != records:
+                if self.verbose: print ("attendance count %i, expected %i: not cleared" % (self.records, records))
+                return False
+            self.clear_attendance()
+            self.records = 0
+            return True
+        finally:
+            if was_enabled:
+                self.enable_device()
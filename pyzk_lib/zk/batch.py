@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+columnar attendance container
+
+the log is kept as parallel array columns: epoch seconds (the naive device
+time read as UTC), status, punch, uid, and an index into a table of
+interned user ids. Attendance objects are only built on access.
+"""
+import sys
+from array import array
+from struct import Struct
+
+from .attendance import Attendance
+from .decoders import ATTENDANCE_8, ATTENDANCE_16, ATTENDANCE_40
+from .timecodec import device_bounds, device_to_epoch, epoch_to_iso, from_epoch, to_epoch
+
+COLUMNS = ('user_index', 'times', 'statuses', 'punches', 'uids')
+
+
+class AttendanceBatch(object):
+    """
+    attendance records stored as array columns
+    """
+    __slots__ = ('user_ids', 'user_index', 'times', 'statuses', 'punches', 'uids', '__ids')
+
+    def __init__(self, user_ids=None):
+        """
+        :param user_ids: table of distinct user ids, shared with a parent batch
+        """
+        self.user_ids = [] if user_ids is None else user_ids
+        self.__ids = dict((user_id, i) for i, user_id in enumerate(self.user_ids))
+        self.user_index = array('I')
+        self.times = array('q')
+        self.statuses = array('B')
+        self.punches = array('B')
+        self.uids = array('q')
+
+    def __repr__(self):
+        return "<AttendanceBatch>: {} records, {} users".format(len(self.times), len(self.user_ids))
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        for i in range(len(self.times)):
+            yield self.attendance(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.__slice(key)
+        return self.attendance(range(len(self.times))[key])
+
+    def attendance(self, i):
+        """
+        :return: Attendance object of the record i
+        """
+        return Attendance(self.user_ids[self.user_index[i]], from_epoch(self.times[i]),
+                          self.statuses[i], self.punches[i], self.uids[i])
+
+    def user_id(self, i):
+        return self.user_ids[self.user_index[i]]
+
+    def append(self, user_id, timestamp, status, punch=0, uid=0):
+        """
+        :param timestamp: naive datetime or epoch seconds
+        """
+        index = self.__ids.get(user_id)
+        if index is None:
+            index = self.__ids[user_id] = len(self.user_ids)
+            self.user_ids.append(sys.intern(str(user_id)))
+        self.user_index.append(index)
+        self.times.append(to_epoch(timestamp))
+        self.statuses.append(status)
+        self.punches.append(punch)
+        self.uids.append(int(uid))
+
+    def extend(self, other):
+        """
+        append the records of another batch
+        """
+        for i in range(len(other)):
+            self.append(other.user_id(i), other.times[i], other.statuses[i], other.punches[i], other.uids[i])
+
+    def take(self, indices):
+        """
+        :param indices: iterable of record indices
+        :return: new AttendanceBatch of these records, sharing the user table
+        """
+        indices = list(indices)
+        batch = AttendanceBatch(self.user_ids)
+        for column in COLUMNS:
+            source = getattr(self, column)
+            getattr(batch, column).extend(source[i] for i in indices)
+        return batch
+
+    def __slice(self, key):
+        batch = AttendanceBatch(self.user_ids)
+        for column in COLUMNS:
+            setattr(batch, column, getattr(self, column)[key])
+        return batch
+
+    def filter(self, since=None, until=None):
+        """
+        records with since <= time < until
+
+        :param since: datetime, epoch seconds or None
+        :param until: datetime, epoch seconds or None
+        :return: AttendanceBatch
+        """
+        if since is None and until is None:
+            return self
+        low = to_epoch(since) if since is not None else None
+        high = to_epoch(until) if until is not None else None
+        return self.take([i for i, t in enumerate(self.times)
+                          if (low is None or t >= low) and (high is None or t < high)])
+
+    def sort(self):
+        """
+        :return: AttendanceBatch ordered by time (stable)
+        """
+        times = self.times
+        return self.take(sorted(range(len(times)), key=times.__getitem__))
+
+    def max_time(self):
+        """
+        :return: latest epoch seconds, None when empty
+        """
+        return max(self.times) if self.times else None
+
+    def to_payload(self):
+        """
+        :return: list of {'matricule', 'timestamp'} dicts, ISO timestamps
+        """
+        user_ids = self.user_ids
+        return [{'matricule': user_ids[index], 'timestamp': epoch_to_iso(t)}
+                for index, t in zip(self.user_index, self.times)]
+
+    @staticmethod
+    def decode(data, record_size, users, since=None, until=None):
+        """
+        decode raw attendance records (without the 4 bytes size header)
+
+        :param data: bytes-like object
+        :param record_size: 8, 16 or 40 (and more) bytes
+        :param users: UserIndex used to resolve user ids
+        :param since: keep records at or after this datetime (or epoch seconds)
+        :param until: keep records before this datetime (or epoch seconds)
+        :return: AttendanceBatch
+        """
+        low, high = device_bounds(since, until)
+        batch = AttendanceBatch()
+        data = memoryview(data)
+        data = data[:len(data) - len(data) % record_size] if record_size else data[:0]
+        append = batch.append
+        if record_size == 8:
+            for uid, status, timestamp, punch in ATTENDANCE_8.iter_unpack(data):
+                if not low <= timestamp < high:
+                    continue
+                tuser = users.get_by_uid(uid)
+                append(str(uid) if tuser is None else tuser.user_id, device_to_epoch(timestamp),
+                       status, punch, uid)
+        elif record_size == 16:
+            for user_id, timestamp, status, punch, _reserved, _workcode in ATTENDANCE_16.iter_unpack(data):
+                if not low <= timestamp < high:
+                    continue
+                tuser = users.get_by_user_id(user_id)
+                append(str(user_id), device_to_epoch(timestamp), status, punch,
+                       user_id if tuser is None else tuser.uid)
+        elif record_size >= 40:
+            record = Struct(ATTENDANCE_40.format + '%ix' % (record_size - 40))
+            for uid, user_id, status, timestamp, punch, _space in record.iter_unpack(data):
+                if not low <= timestamp < high:
+                    continue
+                append((user_id.split(b'\x00')[0]).decode(errors='ignore'), device_to_epoch(timestamp),
+                       status, punch, uid)
+        return batch
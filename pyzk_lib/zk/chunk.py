@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+adaptive chunk sizes for buffered reads and writes
+
+the size doubles after a run of good chunks and is halved after a
+timeout or a retried chunk. A size that fails again once it was
+already halved becomes a ceiling the size no longer grows past.
+ChunkStore keeps the learned sizes and ceilings per device serial
+number between runs.
+"""
+import json
+import os
+import tempfile
+import threading
+
+
+class ChunkController(object):
+    """
+    chunk size between minimum and maximum, driven by chunk outcomes
+    """
+    def __init__(self, size, minimum, maximum, grow_after=4):
+        """
+        :param size: initial size
+        :param minimum: smallest size
+        :param maximum: largest size
+        :param grow_after: good chunks in a row before growing
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.grow_after = grow_after
+        self.__limit = maximum
+        self.size = size
+        self.successes = 0
+        self.failed = None
+        self.changed = False
+
+    def __repr__(self):
+        return "<ChunkController>: size: {} [{}:{}]".format(self.size, self.minimum, self.limit)
+
+    @property
+    def size(self):
+        return self.__size
+
+    @size.setter
+    def size(self, size):
+        self.__size = max(self.minimum, min(self.limit, int(size)))
+
+    @property
+    def limit(self):
+        """
+        largest size allowed, lowered below the sizes that failed twice
+        """
+        return self.__limit
+
+    @limit.setter
+    def limit(self, limit):
+        self.__limit = max(self.minimum, min(self.maximum, int(limit)))
+        self.size = self.size
+
+    def success(self):
+        """
+        a chunk went through at the current size
+        """
+        self.successes += 1
+        if self.successes >= self.grow_after and self.size < self.limit:
+            self.size *= 2
+            self.successes = 0
+            self.changed = True
+
+    def failure(self):
+        """
+        a chunk timed out or had to be retried
+
+        a first failure only halves the size, it may be transient. When a
+        size at least as large as one that already failed fails again, the
+        limit is lowered below it.
+        """
+        self.successes = 0
+        size = self.size
+        if self.failed is not None and size >= self.failed and self.limit > size // 2:
+            self.limit = size // 2
+            self.changed = True
+        self.failed = size if self.failed is None else min(self.failed, size)
+        if size > self.minimum:
+            self.size = size // 2
+            self.changed = True
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _path_lock(path):
+    """
+    one lock per file, shared by the ChunkStore objects of all devices
+    """
+    path = os.path.abspath(path)
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+class ChunkStore(object):
+    """
+    learned chunk sizes by device serial number, in a json file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = _path_lock(path)
+
+    def __repr__(self):
+        return "<ChunkStore>: {}".format(self.path)
+
+    def __read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self, serial):
+        """
+        :param serial: device serial number
+        :return: dict of sizes by name, empty for an unknown device
+        """
+        return self.__read().get(serial, {})
+
+    def save(self, serial, sizes):
+        """
+        update the sizes of one device, the file is replaced atomically
+
+        :param serial: device serial number
+        :param sizes: dict of sizes by name
+        """
+        with self.lock:
+            devices = self.__read()
+            devices.setdefault(serial, {}).update(sizes)
+            fd, temp = tempfile.mkstemp(prefix='.chunks-', suffix='.tmp',
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(devices, f, indent=2, sort_keys=True)
+                os.replace(temp, self.path)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
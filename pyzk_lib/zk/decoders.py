@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+columnar decoders for bulk attendance and user buffers
+
+two backends give the same columns: 'python' (struct, lists) and 'numpy'
+(structured dtypes, arrays). ``column.tolist()`` of a numpy column equals
+the python column.
+"""
+from struct import Struct, unpack
+
+from .timecodec import DEVICE_MAX, decode_time, decode_timehex, device_bounds
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# attendance record layouts, the device time is read as an int
+ATTENDANCE_8 = Struct('<HBIB')          # uid, status, time, punch
+ATTENDANCE_16 = Struct('<IIBB2sI')      # user_id, time, status, punch, reserved, workcode
+ATTENDANCE_40 = Struct('<H24sBIB8s')    # uid, user_id, status, time, punch, space
+
+# user record layouts
+USER_28 = Struct('<HB5s8sIxBhI')        # uid, privilege, password, name, card, group_id, timezone, user_id
+USER_72 = Struct('<HB8s24sIx7sx24s')    # uid, privilege, password, name, card, group_id, user_id
+
+ATTENDANCE_COLUMNS = ('user_id', 'timestamp', 'status', 'punch', 'uid')
+USER_COLUMNS = ('uid', 'name', 'privilege', 'password', 'group_id', 'user_id', 'card')
+
+BACKENDS = ('python', 'numpy')
+
+
+def default_backend():
+    """
+    :return: 'numpy' when numpy is installed, else 'python'
+    """
+    return 'numpy' if numpy is not None else 'python'
+
+
+def decode_events(data):
+    """
+    split the data of a CMD_REG_EVENT packet (EF_ATTLOG)
+
+    :param data: bytes-like object
+    :return: list of (user_id, timestamp, status, punch)
+    """
+    data = bytes(data)
+    events = []
+    while len(data) >= 10:
+        if len(data) == 10:
+            user_id, status, punch, timehex = unpack('<HBB6s', data)
+            data = data[10:]
+        elif len(data) == 12:
+            user_id, status, punch, timehex = unpack('<IBB6s', data)
+            data = data[12:]
+        elif len(data) == 14:
+            user_id, status, punch, timehex, _other = unpack('<HBB6s4s', data)
+            data = data[14:]
+        elif len(data) == 32:
+            user_id,  status, punch, timehex = unpack('<24sBB6s', data[:32])
+            data = data[32:]
+        elif len(data) == 36:
+            user_id,  status, punch, timehex, _other = unpack('<24sBB6s4s', data[:36])
+            data = data[36:]
+        elif len(data) == 37:
+            user_id,  status, punch, timehex, _other = unpack('<24sBB6s5s', data[:37])
+            data = data[37:]
+        elif len(data) >= 52:
+            user_id,  status, punch, timehex, _other = unpack('<24sBB6s20s', data[:52])
+            data = data[52:]
+        else:
+            break # unknown event layout
+        if isinstance(user_id, int):
+            user_id = str(user_id)
+        else:
+            user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
+        events.append((user_id, decode_timehex(timehex), status, punch))
+    return events
+
+
+def _check_backend(backend):
+    if backend is None:
+        backend = default_backend()
+    if backend not in BACKENDS:
+        raise ValueError("unknown decoder backend %s" % backend)
+    if backend == 'numpy' and numpy is None:
+        raise ImportError("numpy is required by the numpy decoder backend")
+    return backend
+
+
+def _whole_records(data, record_size):
+    data = memoryview(data)
+    return data[:len(data) - len(data) % record_size]
+
+
+def decode_attendance(data, record_size, users, backend=None, since=None, until=None):
+    """
+    decode raw attendance records (without the 4 bytes size header)
+
+    :param data: bytes-like object
+    :param record_size: 8, 16 or 40 (and more) bytes
+    :param users: UserIndex used to resolve user ids
+    :param backend: 'python', 'numpy' or None for the default one
+    :param since: keep records at or after this datetime
+    :param until: keep records before this datetime
+    :return: dict of columns user_id, timestamp, status, punch, uid
+    """
+    backend = _check_backend(backend)
+    data = _whole_records(data, record_size)
+    low, high = device_bounds(since, until)
+    if backend == 'numpy':
+        return _attendance_numpy(data, record_size, users, low, high)
+    return _attendance_python(data, record_size, users, low, high)
+
+
+def decode_users(data, packet_size, encoding='UTF-8', backend=None):
+    """
+    decode raw user records (without the 4 bytes size header)
+
+    :param data: bytes-like object
+    :param packet_size: 28 (zk6) or 72 (zk8) bytes
+    :param encoding: user encoding
+    :param backend: 'python', 'numpy' or None for the default one
+    :return: dict of columns uid, name, privilege, password, group_id, user_id, card
+    """
+    backend = _check_backend(backend)
+    data = _whole_records(data, packet_size)
+    if backend == 'numpy':
+        return _users_numpy(data, packet_size, encoding)
+    return _users_python(data, packet_size, encoding)
+
+
+def _attendance_python(data, record_size, users, low, high):
+    columns = dict((name, []) for name in ATTENDANCE_COLUMNS)
+    user_ids, timestamps, statuses, punches, uids = (columns[name] for name in ATTENDANCE_COLUMNS)
+    if record_size == 8:
+        for uid, status, timestamp, punch in ATTENDANCE_8.iter_unpack(data):
+            if not low <= timestamp < high:
+                continue
+            tuser = users.get_by_uid(uid)
+            user_ids.append(str(uid) if tuser is None else tuser.user_id)
+            timestamps.append(decode_time(timestamp))
+            statuses.append(status)
+            punches.append(punch)
+            uids.append(uid)
+    elif record_size == 16:
+        for user_id, timestamp, status, punch, _reserved, _workcode in ATTENDANCE_16.iter_unpack(data):
+            if not low <= timestamp < high:
+                continue
+            user_id = str(user_id)
+            tuser = users.get_by_user_id(user_id)
+            user_ids.append(user_id)
+            timestamps.append(decode_time(timestamp))
+            statuses.append(status)
+            punches.append(punch)
+            uids.append(str(user_id) if tuser is None else tuser.uid)
+    elif record_size >= 40:
+        record = Struct(ATTENDANCE_40.format + '%ix' % (record_size - 40))
+        for uid, user_id, status, timestamp, punch, _space in record.iter_unpack(data):
+            if not low <= timestamp < high:
+                continue
+            user_ids.append((user_id.split(b'\x00')[0]).decode(errors='ignore'))
+            timestamps.append(decode_time(timestamp))
+            statuses.append(status)
+            punches.append(punch)
+            uids.append(uid)
+    return columns
+
+
+def _users_python(data, packet_size, encoding):
+    columns = dict((name, []) for name in USER_COLUMNS)
+    if packet_size == 28:
+        for uid, privilege, password, name, card, group_id, _timezone, user_id in USER_28.iter_unpack(data):
+            user_id = str(user_id)
+            name = (name.split(b'\x00')[0]).decode(encoding, errors='ignore').strip()
+            _append_user(columns, uid, name or "NN-%s" % user_id, privilege,
+                         (password.split(b'\x00')[0]).decode(encoding, errors='ignore'),
+                         str(group_id), user_id, card)
+    elif packet_size == 72:
+        for uid, privilege, password, name, card, group_id, user_id in USER_72.iter_unpack(data):
+            user_id = (user_id.split(b'\x00')[0]).decode(encoding, errors='ignore')
+            name = (name.split(b'\x00')[0]).decode(encoding, errors='ignore').strip()
+            _append_user(columns, uid, name or "NN-%s" % user_id, privilege,
+                         (password.split(b'\x00')[0]).decode(encoding, errors='ignore'),
+                         (group_id.split(b'\x00')[0]).decode(encoding, errors='ignore').strip(),
+                         user_id, card)
+    return columns
+
+
+def _append_user(columns, uid, name, privilege, password, group_id, user_id, card):
+    columns['uid'].append(uid)
+    columns['name'].append(name)
+    columns['privilege'].append(privilege)
+    columns['password'].append(password)
+    columns['group_id'].append(group_id)
+    columns['user_id'].append(user_id)
+    columns['card'].append(card)
+
+
+def _dtype(fields, itemsize):
+    """
+    structured dtype from (name, format, offset) tuples, records are packed
+    """
+    return numpy.dtype({
+        'names': [field[0] for field in fields],
+        'formats': [field[1] for field in fields],
+        'offsets': [field[2] for field in fields],
+        'itemsize': itemsize
+    })
+
+
+def _attendance_dtype(record_size):
+    if record_size == 8:
+        return _dtype([('uid', '<u2', 0), ('status', 'u1', 2), ('time', '<u4', 3), ('punch', 'u1', 7)], 8)
+    if record_size == 16:
+        return _dtype([('user_id', '<u4', 0), ('time', '<u4', 4), ('status', 'u1', 8), ('punch', 'u1', 9)], 16)
+    return _dtype([('uid', '<u2', 0), ('user_id', 'S24', 2), ('status', 'u1', 26),
+                   ('time', '<u4', 27), ('punch', 'u1', 31)], record_size)
+
+
+def _user_dtype(packet_size):
+    if packet_size == 28:
+        return _dtype([('uid', '<u2', 0), ('privilege', 'u1', 2), ('password', 'S5', 3), ('name', 'S8', 8),
+                       ('card', '<u4', 16), ('group_id', 'u1', 21), ('user_id', '<u4', 24)], 28)
+    return _dtype([('uid', '<u2', 0), ('privilege', 'u1', 2), ('password', 'S8', 3), ('name', 'S24', 11),
+                   ('card', '<u4', 35), ('group_id', 'S7', 40), ('user_id', 'S24', 48)], 72)
+
+
+def _times_numpy(t):
+    """
+    vectorized decode_time, to a datetime64[s] array
+    """
+    t = t.astype('int64')
+    second = t % 60
+    t = t // 60
+    minute = t % 60
+    t = t // 60
+    hour = t % 24
+    t = t // 24
+    day = t % 31
+    t = t // 31
+    month = t % 12
+    t = t // 12
+    months = numpy.datetime64('2000-01', 'M') + (t * 12 + month)
+    days = months.astype('datetime64[D]') + day
+    if (days.astype('datetime64[M]') != months).any():
+        raise ValueError("day is out of range for month")
+    return days.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second)
+
+
+def _map_unique(values, function):
+    """
+    apply a python function once per distinct value
+
+    :return: object array
+    """
+    unique, inverse = numpy.unique(values, return_inverse=True)
+    mapped = numpy.empty(len(unique), dtype=object)
+    mapped[:] = [function(value) for value in unique.tolist()]
+    return mapped[inverse]
+
+
+def _attendance_numpy(data, record_size, users, low, high):
+    if record_size not in (8, 16) and record_size < 40:
+        return dict((name, numpy.empty(0, dtype=object)) for name in ATTENDANCE_COLUMNS)
+    records = numpy.frombuffer(data, dtype=_attendance_dtype(record_size))
+    if low > 0 or high < DEVICE_MAX:
+        times = records['time']
+        records = records[(times >= low) & (times < high)]
+    if record_size == 8:
+        uid = records['uid']
+
+        def resolve(value):
+            tuser = users.get_by_uid(value)
+            return str(value) if tuser is None else tuser.user_id
+        user_id = _map_unique(uid, resolve)
+    elif record_size == 16:
+        user_id = _map_unique(records['user_id'], str)
+
+        def resolve(value):
+            tuser = users.get_by_user_id(value)
+            return value if tuser is None else tuser.uid
+        uid = _map_unique(user_id.astype(str), resolve)
+    else:
+        uid = records['uid']
+        user_id = _map_unique(records['user_id'], lambda value: value.split(b'\x00')[0].decode(errors='ignore'))
+    return {
+        'user_id': user_id,
+        'timestamp': _times_numpy(records['time']),
+        'status': records['status'],
+        'punch': records['punch'],
+        'uid': uid,
+    }
+
+
+def _users_numpy(data, packet_size, encoding):
+    if packet_size not in (28, 72):
+        return dict((name, numpy.empty(0, dtype=object)) for name in USER_COLUMNS)
+    records = numpy.frombuffer(data, dtype=_user_dtype(packet_size))
+
+    def text(value):
+        return (value.split(b'\x00')[0]).decode(encoding, errors='ignore')
+
+    if packet_size == 28:
+        user_id = _map_unique(records['user_id'], str)
+        group_id = _map_unique(records['group_id'], str)
+    else:
+        user_id = _map_unique(records['user_id'], text)
+        group_id = _map_unique(records['group_id'], lambda value: text(value).strip())
+    name = numpy.empty(len(records), dtype=object)
+    name[:] = [text(value).strip() or "NN-%s" % user
+               for value, user in zip(records['name'].tolist(), user_id.tolist())]
+    return {
+        'uid': records['uid'],
+        'name': name,
+        'privilege': records['privilege'],
+        'password': _map_unique(records['password'], text),
+        'group_id': group_id,
+        'user_id': user_id,
+        'card': records['card'],
+    }
@@ -4,6 +4,7 @@ import codecs
 
 
 class Finger(object):
+    __slots__ = ('size', 'uid', 'fid', 'valid', 'template')
 
     def __init__(self, uid, fid, valid, template):
         self.size = len(template) # template only
@@ -11,8 +12,13 @@ class Finger(object):
         self.fid = int(fid)
         self.valid = int(valid)
         self.template = template
-        #self.mark = str().encode("hex")
-        self.mark = codecs.encode(template[:8], 'hex') + b'...' + codecs.encode(template[-8:], 'hex')
+
+    @property
+    def mark(self):
+        """
+        short hex preview of the template, built on access
+        """
+        return codecs.encode(self.template[:8], 'hex') + b'...' + codecs.encode(self.template[-8:], 'hex')
 
     def repack(self): #full
         return pack("<HHbb%is" % (self.size), self.size+6, self.uid, self.fid, self.valid, self.template)
@@ -39,7 +45,9 @@ class Finger(object):
         }
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        return isinstance(other, Finger) and \
+            (self.size, self.uid, self.fid, self.valid, self.template) == \
+            (other.size, other.uid, other.fid, other.valid, other.template)
 
     def __str__(self):
         return "<Finger> [uid:{:>3}, fid:{}, size:{:>4} v:{} t:{}]".format(self.uid, self.fid, self.size, self.valid, self.mark)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+device time codec
+
+the device counts seconds in a calendar of 31 days months starting in 2000
+(zkemsdk.c - EncodeTime). The time of day is the same in both calendars, so
+a timestamp is split with one divmod and its day is looked up in memoized
+tables: no datetime is built per record. Epoch seconds read the naive device
+time as UTC; ISO strings are only built when serializing.
+"""
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+EPOCH = datetime(1970, 1, 1)
+DAY = 24 * 60 * 60
+DEVICE_MAX = 1 << 32  # device times are unsigned 32 bits
+
+# 'HH:MM:' for each minute of the day, 'SS' for each second
+_MINUTES = ['%02d:%02d:' % divmod(minute, 60) for minute in range(24 * 60)]
+_SECONDS = ['%02d' % second for second in range(60)]
+
+
+# the day tables are bounded: 2**32 device seconds are less than 50000 days
+@lru_cache(maxsize=None)
+def _device_date(day):
+    """
+    :param day: device seconds // DAY
+    :return: datetime of midnight, ValueError for an invalid date
+    """
+    month, mday = divmod(day, 31)
+    year, month = divmod(month, 12)
+    return datetime(year + 2000, month + 1, mday + 1)
+
+
+@lru_cache(maxsize=None)
+def _device_day_epoch(day):
+    return (_device_date(day) - EPOCH) // timedelta(seconds=1)
+
+
+@lru_cache(maxsize=None)
+def _device_day_iso(day):
+    return _device_date(day).strftime('%Y-%m-%dT')
+
+
+@lru_cache(maxsize=None)
+def _epoch_day_iso(day):
+    return (EPOCH + timedelta(days=day)).strftime('%Y-%m-%dT')
+
+
+def to_epoch(timestamp):
+    """
+    :param timestamp: naive datetime, or epoch seconds
+    :return: epoch seconds
+    """
+    if isinstance(timestamp, datetime):
+        return (timestamp - EPOCH) // timedelta(seconds=1)
+    return int(timestamp)
+
+
+def from_epoch(seconds):
+    """
+    :return: naive datetime
+    """
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def device_to_epoch(t):
+    """
+    :param t: device encoded time
+    :return: epoch seconds
+    """
+    day, second = divmod(t, DAY)
+    return _device_day_epoch(day) + second
+
+
+def device_to_iso(t):
+    """
+    :param t: device encoded time
+    :return: 'YYYY-MM-DDTHH:MM:SS'
+    """
+    day, second = divmod(t, DAY)
+    minute, second = divmod(second, 60)
+    return _device_day_iso(day) + _MINUTES[minute] + _SECONDS[second]
+
+
+def epoch_to_iso(seconds):
+    """
+    :return: 'YYYY-MM-DDTHH:MM:SS', same as from_epoch(seconds).isoformat()
+    """
+    day, second = divmod(seconds, DAY)
+    minute, second = divmod(second, 60)
+    return _epoch_day_iso(day) + _MINUTES[minute] + _SECONDS[second]
+
+
+def device_bounds(since=None, until=None):
+    """
+    raw device time bounds of since <= time < until, so unpacked records
+    can be skipped with one integer comparison before the time is decoded: the
+    device encoding follows the calendar order (years 2000 to 2099)
+
+    :param since: datetime, epoch seconds or None
+    :param until: datetime, epoch seconds or None
+    :return: (low, high), keep the records with low <= t < high
+    """
+    return _device_bound(since, 0), _device_bound(until, DEVICE_MAX)
+
+
+def _device_bound(timestamp, default):
+    if timestamp is None:
+        return default
+    if not isinstance(timestamp, datetime):
+        timestamp = from_epoch(timestamp)
+    if timestamp.year < 2000:
+        return 0
+    if timestamp.year > 2099:
+        return DEVICE_MAX
+    # device times are whole seconds: 08:00:00.5 starts the bound at 08:00:01
+    return encode_time(timestamp) + (1 if timestamp.microsecond else 0)
+
+
+def decode_time(t):
+    """
+    Decode a timestamp retrieved from the timeclock
+
+    copied from zkemsdk.c - DecodeTime
+    """
+    second = t % 60
+    t = t // 60
+
+    minute = t % 60
+    t = t // 60
+
+    hour = t % 24
+    t = t // 24
+
+    day = t % 31 + 1
+    t = t // 31
+
+    month = t % 12 + 1
+    t = t // 12
+
+    year = t + 2000
+
+    return datetime(year, month, day, hour, minute, second)
+
+
+def encode_time(t):
+    """
+    Encode a timestamp so that it can be read on the timeclock
+    """
+    # formula taken from zkemsdk.c - EncodeTime
+    # can also be found in the technical manual
+    d = (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+    return d
+
+
+def decode_timehex(timehex):
+    """
+    timehex string of six bytes
+    """
+    year, month, day, hour, minute, second = bytearray(timehex)
+    return datetime(year + 2000, month, day, hour, minute, second)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from struct import pack #, unpack
 class User(object):
+    __slots__ = ('uid', 'name', 'privilege', 'password', 'group_id', 'user_id', 'card')
     encoding = 'UTF-8'
 
     def __init__(self, uid, name, privilege, password='', group_id='', user_id='', card=0):
@@ -25,6 +26,17 @@ class User(object):
             card=json['card']
         )
 
+    def json_pack(self): #packs for json
+        return {
+            "uid": self.uid,
+            "name": self.name,
+            "privilege": self.privilege,
+            "password": self.password,
+            "group_id": self.group_id,
+            "user_id": self.user_id,
+            "card": self.card
+        }
+
     def repack29(self): # with 02 for zk6 (size 29)
         return pack("<BHB5s8sIxBhI", 2, self.uid, self.privilege, self.password.encode(User.encoding, errors='ignore'), self.name.encode(User.encoding, errors='ignore'), self.card, int(self.group_id) if self.group_id else 0, 0, int(self.user_id))
 
@@ -38,3 +50,30 @@ class User(object):
 
     def __repr__(self):
         return u'<User>: [uid:{}, name:{} user_id:{}]'.format(self.uid, self.name, self.user_id)
+
+
+class UserIndex(object):
+    """
+    lookup table of users by uid and by user_id
+    """
+
+    def __init__(self, users=()):
+        self.users = list(users)
+        self.by_uid = {}
+        self.by_user_id = {}
+        for user in self.users:
+            # first user wins, like the first match of a linear search
+            self.by_uid.setdefault(user.uid, user)
+            self.by_user_id.setdefault(str(user.user_id), user)
+
+    def get_by_uid(self, uid):
+        return self.by_uid.get(uid)
+
+    def get_by_user_id(self, user_id):
+        return self.by_user_id.get(str(user_id))
+
+    def __len__(self):
+        return len(self.users)
+
+    def __iter__(self):
+        return iter(self.users)
@@ -0,0 +1,73 @@
+"""Délais de reprise et disjoncteurs (circuit breakers) des appareils et de l'API"""
+import random
+import threading
+import time
+from typing import Optional
+
+
+def backoff(attempt: int, base: float, maximum: float) -> float:
+    """Délai avant la tentative `attempt` (0 pour la première reprise)
+
+    Exponentiel borné à `maximum`, dont la moitié est tirée au hasard pour
+    étaler les reprises des appareils et des envois.
+    """
+    delay = min(maximum, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitBreaker:
+    """Disjoncteur : ouvert après `threshold` échecs consécutifs
+
+    Ouvert, il refuse les appels pendant `reset_timeout` secondes puis en
+    laisse passer un seul (semi-ouvert) : un succès le referme, un échec le
+    rouvre pour une nouvelle période.
+    """
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+
+    @property
+    def state(self) -> str:
+        """closed, open ou half-open"""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        """Indique si un appel peut être tenté"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial:
+                return False
+            self.trial = True
+            return True
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self) -> bool:
+        """Enregistre un échec
+
+        Returns:
+            True si le disjoncteur vient de s'ouvrir
+        """
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                opened = self.opened_at is None
+                self.opened_at = time.monotonic()
+                return opened
+            return False
@@ -0,0 +1,66 @@
+"""Sérialisation JSON des lots envoyés à l'API (orjson s'il est installé)"""
+import json
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# Encodeurs disponibles : objet -> JSON compact en octets UTF-8
+SERIALIZERS: Dict[str, Callable] = {'json': _json_dumps}
+if orjson is not None:
+    SERIALIZERS['orjson'] = orjson.dumps
+
+
+def get_serializer(name: str = 'auto') -> Callable:
+    """Encodeur `name` ; 'auto' choisit orjson s'il est installé, sinon json"""
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(f"Sérialiseur inconnu : {name} ({', '.join(SERIALIZERS)} ou auto)")
+
+
+class Payload(NamedTuple):
+    """Lot prêt à l'envoi"""
+    body: bytes                 # tableau JSON
+    ids: List[int]              # lignes de l'outbox incluses
+    watermark: Optional[str]    # horodatage ISO le plus récent du lot
+
+
+def encode_batch(rows: List[Tuple[int, Dict]], max_bytes: int,
+                 dumps: Optional[Callable] = None) -> Payload:
+    """Écrit le plus long début de `rows` tenant dans `max_bytes` (au moins une ligne)
+
+    Chaque présence n'est encodée qu'une fois : la taille du lot et sa
+    présence la plus récente sont calculées pendant l'écriture. Les
+    horodatages ISO de même format se comparent comme des chaînes.
+
+    Args:
+        rows: Paires (id outbox, présence {'matricule', 'timestamp'})
+        max_bytes: Taille maximale du corps JSON
+        dumps: Encodeur (get_serializer() par défaut)
+    """
+    dumps = dumps or get_serializer()
+    parts = []
+    ids = []
+    watermark = None
+    size = 1  # [ ... ] moins une virgule
+    for row_id, presence in rows:
+        part = dumps(presence)
+        size += len(part) + 1
+        if size > max_bytes and parts:
+            break
+        parts.append(part)
+        ids.append(row_id)
+        timestamp = presence['timestamp']
+        if watermark is None or timestamp > watermark:
+            watermark = timestamp
+    return Payload(b'[' + b','.join(parts) + b']', ids, watermark)
@@ -5,12 +5,15 @@ Fonctionne en tâche de fond sur Linux, Windows et macOS
 """
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import schedule
-import requests
 import json
+import gzip
 import logging
 from logging.handlers import RotatingFileHandler
-from pyzk_lib.zk import ZK
+from pyzk_lib.zk import ZK, AttendanceBatch
+from pyzk_lib.zk.batch import from_epoch
+from pyzk_lib.zk.exception import ZKErrorResponse, ZKNetworkError
 from datetime import datetime
 from typing import Optional, List, Dict
 import signal
@@ -19,6 +22,11 @@ import os
 import platform
 
 from config import config
+import http_client
+from outbox import Outbox
+from checkpoint import CheckpointStore
+from resilience import CircuitBreaker, backoff
+from serializer import encode_batch, get_serializer
 
 # Import conditionnel de la notification
 try:
@@ -65,50 +73,187 @@ def setup_logging():
 logger = setup_logging()
 
 # Variables globales
-sync_lock = threading.Lock()
 shutdown_flag = threading.Event()
+states_lock = threading.Lock()    # registre des états appareils
+device_states: Dict[str, "DeviceState"] = {}
+executor: Optional[ThreadPoolExecutor] = None
+outbox = Outbox(config.OUTBOX_FILE)
+# L'ancien état à la racine de SYNC_FILE est celui de l'appareil de la config
+checkpoints = CheckpointStore(config.SYNC_FILE, legacy_device=f"{config.DEVICE_IP}:{config.DEVICE_PORT}")
+api_breaker = CircuitBreaker("API", config.BREAKER_THRESHOLD, config.BREAKER_RESET)
+api_serializer = get_serializer(config.API_SERIALIZER)
 
 
-def load_last_sync() -> Optional[datetime]:
+def load_sync_state(device: str) -> Dict:
+    """Charge le point de reprise d'un appareil (dernière sync, série, curseur)"""
+    return checkpoints.load(device)
+
+
+def load_last_sync(device: str) -> Optional[datetime]:
     """Charge la dernière synchronisation"""
     try:
-        with open(config.SYNC_FILE, "r") as f:
-            data = json.load(f)
-            return datetime.fromisoformat(data.get("last_sync"))
-    except (FileNotFoundError, json.JSONDecodeError, ValueError):
+        return datetime.fromisoformat(load_sync_state(device).get("last_sync"))
+    except (TypeError, ValueError):
         return None
 
 
-def save_last_sync(sync_time: datetime) -> None:
-    """Sauvegarde la dernière synchronisation"""
+def save_last_sync(sync_time: Optional[datetime], cursor: Optional[Dict] = None,
+                   device: Optional[str] = None, serial: Optional[str] = None) -> None:
+    """Sauvegarde le point de reprise d'un appareil
+
+    La dernière synchronisation ne recule pas (sauf changement d'appareil) ;
+    curseur et numéro de série ne sont remplacés que s'ils sont fournis.
+    L'écriture est atomique.
+    """
     try:
-        with open(config.SYNC_FILE, "w") as f:
-            json.dump({"last_sync": sync_time.isoformat()}, f)
+        state = load_sync_state(device)
+        previous = load_last_sync(device)
+        if serial and state.get("serial") not in (None, serial):
+            previous = None
+        if sync_time is None or (previous is not None and previous > sync_time):
+            sync_time = previous
+        checkpoints.update(
+            device,
+            last_sync=sync_time.isoformat() if sync_time else None,
+            cursor=cursor or None,
+            serial=serial,
+            updated=datetime.now().isoformat()
+        )
     except Exception as e:
         logger.error(f"Erreur sauvegarde: {e}")
 
 
+def normalize_device(raw: Dict) -> Dict:
+    """Complète une entrée d'inventaire avec les valeurs par défaut"""
+    return {
+        "name": raw.get("name") or raw["ip"],
+        "ip": raw["ip"],
+        "port": int(raw.get("port", 4370)),
+        "password": int(raw.get("password", 0)),
+        "udp": bool(raw.get("udp", False)),
+        "interval": int(raw.get("interval", config.SYNC_INTERVAL)),
+        "interval_seconds": int(raw.get("interval_seconds", config.SYNC_INTERVAL_SECONDS)),
+        "timeout": int(raw.get("timeout", config.DEVICE_TIMEOUT)),
+    }
+
+
+def load_devices() -> List[Dict]:
+    """Charge l'inventaire des appareils (mode flotte) ou l'appareil de la config"""
+    if not config.DEVICES_FILE:
+        return [normalize_device({"ip": config.DEVICE_IP, "port": config.DEVICE_PORT})]
+    with open(config.DEVICES_FILE, "r") as f:
+        devices = [normalize_device(raw) for raw in json.load(f)]
+    keys = [device_key(device) for device in devices]
+    if len(set(keys)) != len(keys):
+        raise ValueError(f"Appareils en double dans {config.DEVICES_FILE}")
+    return devices
+
+
+def device_key(device: Dict) -> str:
+    """Identifiant d'un appareil (ip:port)"""
+    return f"{device['ip']}:{device['port']}"
+
+
+class DeviceState:
+    """État d'exécution d'un appareil : verrou de sync et métriques"""
+
+    def __init__(self, device: Dict):
+        self.device = device
+        self.lock = threading.Lock()
+        self.delivery_lock = threading.Lock()   # envoi de l'outbox
+        self.breaker = CircuitBreaker(device["name"], config.BREAKER_THRESHOLD, config.BREAKER_RESET)
+        self.attempts = 0                        # échecs consécutifs du cycle en cours
+        self.retry_at: Optional[float] = None    # reprise planifiée (time.monotonic)
+        self.syncs = 0
+        self.failures = 0
+        self.records = 0
+        self.last_run: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_records = 0
+        self.last_error: Optional[str] = None
+        self.last_delivered: Optional[str] = None  # présence la plus récente reçue par l'API
+
+    def record(self, duration: float, records: int, error: Optional[str] = None) -> None:
+        """Enregistre le résultat d'une synchronisation"""
+        self.last_run = datetime.now()
+        self.last_duration = duration
+        self.last_records = records
+        self.last_error = error
+        self.syncs += 1
+        self.records += records
+        if error:
+            self.failures += 1
+
+    def metrics(self) -> Dict:
+        """Métriques de l'appareil"""
+        return {
+            "device": self.device["name"],
+            "address": device_key(self.device),
+            "syncs": self.syncs,
+            "failures": self.failures,
+            "records": self.records,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_duration": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_records": self.last_records,
+            "last_error": self.last_error,
+            "circuit": self.breaker.state,
+            "last_delivered": self.last_delivered,
+        }
+
+
+def get_device_state(device: Dict) -> DeviceState:
+    """État d'exécution de l'appareil (créé au premier appel)"""
+    with states_lock:
+        key = device_key(device)
+        if key not in device_states:
+            device_states[key] = DeviceState(device)
+        return device_states[key]
+
+
 class ZKAttendanceAgent:
     """Agent de connexion à l'appareil ZKTeco"""
 
-    def __init__(self, ip: str, port: int = 4370, timeout: int = 60):
+    # Instances ZK conservées entre les cycles (cache de la table utilisateurs)
+    _clients: Dict = {}
+
+    def __init__(self, ip: str, port: int = 4370, timeout: int = 60,
+                 password: int = 0, force_udp: bool = False, state: Optional[str] = None):
         self.ip = ip
         self.port = port
         self.timeout = timeout
+        self.password = password
+        self.force_udp = force_udp
+        self.state = state or f"{ip}:{port}"
         self.zk = None
         self.conn = None
+        self.cursor = None
+        self.serial = None
+        self.capacity = 0   # capacité du log (rec_cap), connue après une lecture
 
     def __enter__(self):
         self.connect()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.disconnect()
+        self.disconnect(failed=exc_type is not None)
 
     def connect(self) -> None:
         """Connexion à l'appareil"""
         try:
-            self.zk = ZK(self.ip, port=self.port, timeout=self.timeout)
+            key = (self.ip, self.port)
+            if key not in self._clients:
+                self._clients[key] = ZK(
+                    self.ip, port=self.port, timeout=self.timeout,
+                    password=self.password, force_udp=self.force_udp,
+                    users_ttl=config.USERS_CACHE_TTL or None,
+                    read_window=config.DEVICE_READ_WINDOW,
+                    chunk_store=config.CHUNK_FILE or None
+                )
+            self.zk = self._clients[key]
+            if config.PERSISTENT_SESSION and self.zk.is_connect:
+                # Session persistante : pas de nouvelle poignée de main
+                self.conn = self.zk
+                return
             self.conn = self.zk.connect()
             logger.info(f"Connecté à {self.ip}")
         except Exception as e:
@@ -116,122 +261,552 @@ class ZKAttendanceAgent:
             # raise
             
 
-    def disconnect(self) -> None:
-        """Déconnexion de l'appareil"""
+    def disconnect(self, failed: bool = False) -> None:
+        """Déconnexion de l'appareil (session conservée en mode persistant)
+
+        Args:
+            failed: La sync a échoué ; la session, qui peut garder des paquets
+                non lus, est fermée même en mode persistant
+        """
+        if self.conn and config.PERSISTENT_SESSION and self.conn.is_connect and not failed:
+            return
         if self.conn:
             try:
                 self.conn.enable_device()
                 self.conn.disconnect()
             except Exception as e:
                 logger.error(f"Erreur déconnexion: {e}")
+            finally:
+                if failed:
+                    # Nouvelle poignée de main à la prochaine connexion
+                    self.conn.is_connect = False
 
-    def get_new_attendances(self) -> List[Dict]:
-        """Récupère les nouvelles présences"""
+    def call(self, method: str, *args):
+        """Appel sur la session, reconnexion transparente sur erreur réseau en mode persistant"""
+        try:
+            return getattr(self.conn, method)(*args)
+        except ZKNetworkError as e:
+            if not config.PERSISTENT_SESSION:
+                raise
+            logger.warning(f"Session perdue avec {self.ip} ({e}), reconnexion")
+            self.conn = self.zk.connect()
+            return getattr(self.conn, method)(*args)
+
+    def get_new_attendances(self) -> AttendanceBatch:
+        """Récupère les nouvelles présences
+
+        Returns:
+            Présences triées par heure, en colonnes (AttendanceBatch)
+        """
         
         if not self.conn:
             raise ConnectionError("Non connecté")
 
-        presences = []
-        last_sync = load_last_sync()
+        state = load_sync_state(self.state)
+        last_sync = load_last_sync(self.state)
+        cursor = state.get("cursor") if config.INCREMENTAL_SYNC else None
 
         try:
-            self.conn.disable_device()
-            all_presences = self.conn.get_attendance()
-
-            if all_presences:
-                for attendance in all_presences:
-                    ts = attendance.timestamp
-                    if last_sync is None or ts > last_sync:
-                        presences.append({
-                            'matricule': attendance.user_id,
-                            'timestamp': ts.isoformat()
-                        })
-                presences.sort(key=lambda x: x['timestamp'])
-
-            return presences
-        finally:
-            self.conn.enable_device()
-
-
-def fetch_and_send_attendance() -> None:
-    """Synchronisation principale"""
-    logger.info("=== Début sync ===")
+            self.serial = self.call('get_serialnumber')
+        except ZKErrorResponse:
+            self.serial = None
+        if self.serial and state.get("serial") and state["serial"] != self.serial:
+            # Autre appareil à la même adresse : son log repart de zéro
+            logger.warning(f"Appareil remplacé ({state['serial']} -> {self.serial}), lecture complète")
+            cursor = None
+            last_sync = None
 
-    if not sync_lock.acquire(blocking=False):
-        logger.info("Sync en cours, skip")
-        return
+        try:
+            self.call('disable_device')
+            # Lecture incrémentale : seuls les enregistrements ajoutés depuis le
+            # curseur sont téléchargés, lecture complète si le log a changé.
+            # Sans curseur, les présences antérieures à last_sync sont
+            # écartées sur l'heure brute de l'appareil, avant décodage de l'heure
+            since = last_sync if cursor is None else None
+            batch, self.cursor = self.call('get_new_attendance', cursor, True, since)
+            self.capacity = getattr(self.conn, 'rec_cap', 0) or 0
+            incremental = self.cursor.get('incremental')
+            logger.info(
+                f"Lecture {'incrémentale' if incremental else 'complète'}: "
+                f"{len(batch)} enregistrements ({self.cursor['records']} sur l'appareil)"
+            )
 
-    last_error = None
+            # >= : les présences de la même seconde que last_sync sont
+            # gardées, celles déjà stockées sont écartées par l'outbox
+            if not incremental:
+                batch = batch.filter(since=last_sync)
+            return batch.sort()
+        finally:
+            try:
+                self.call('enable_device')
+            except Exception as e:
+                # Ne masque pas l'erreur de lecture (disconnect réactive aussi)
+                logger.error(f"Erreur réactivation de l'appareil: {e}")
+
+
+def post_attendances(body: bytes, name: str) -> None:
+    """Envoie un lot JSON déjà sérialisé à l'API (exception si le statut n'est pas 200)
+
+    Le corps est compressé en gzip si API_GZIP est activé.
+    """
+    headers = {'Content-Type': 'application/json'}
+    if config.API_GZIP:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    # Lots idempotents (clé matricule/horodatage) : retentés par le client HTTP
+    response = http_client.post(config.API_URL, data=body, headers=headers)
+    if response.status_code != 200:
+        logger.warning(f"[{name}] Erreur API {response.status_code} : {response.text}")
+        raise Exception(f"API {response.status_code} : {response.text}")
+
+
+def deliver_outbox(device: Dict) -> int:
+    """Envoie les présences en attente d'un appareil par lots
+
+    Un lot compte au plus API_BATCH_SIZE présences et API_BATCH_BYTES octets
+    de JSON. Chaque lot reçu par l'API est acquitté dans l'outbox : une
+    erreur interrompt l'envoi et seul le reste sera repris. Rien n'est tenté
+    tant que le disjoncteur de l'API est ouvert.
+
+    Returns:
+        Nombre de présences envoyées
+    """
+    device_state = get_device_state(device)
+    if not device_state.delivery_lock.acquire(blocking=False):
+        return 0
+    key = device_key(device)
+    sent = 0
     try:
-        for attempt in range(1, config.MAX_RETRIES + 1):
+        while not shutdown_flag.is_set():
+            rows = outbox.pending(key, config.API_BATCH_SIZE)
+            if not rows:
+                break
+            if not sent and not api_breaker.allow():
+                raise ConnectionError("API indisponible (circuit ouvert)")
+            payload = encode_batch(rows, config.API_BATCH_BYTES, api_serializer)
             try:
-                with ZKAttendanceAgent(config.DEVICE_IP, config.DEVICE_PORT, config.DEVICE_TIMEOUT) as zk:
-                    new_attendances = zk.get_new_attendances()
-                    logger.info(f"{len(new_attendances)} présences détectées")
-
-                    if not new_attendances:
-                        logger.info("Aucune nouvelle présence")
-                        return
-
-                    # Envoi à l'API
-                    response = requests.post(
-                        config.API_URL,
-                        json=new_attendances,
-                        headers={'Content-Type': 'application/json'},
-                        timeout=config.API_TIMEOUT
-                    )
-
-                    if response.status_code == 200:
-                        last_sync_time = max(
-                            datetime.fromisoformat(att['timestamp'])
-                            for att in new_attendances
-                        )
-                        save_last_sync(last_sync_time)
-                        logger.info(f"✓ Sync réussie: {len(new_attendances)} présences")
-                        return
-                    else:
-                        logger.warning(f"Erreur API {response.status_code} : {response.text}")
-                        raise Exception(f"API {response.status_code} : {response.text}")
+                post_attendances(payload.body, device["name"])
+            except Exception:
+                if api_breaker.failure():
+                    logger.warning(f"Circuit API ouvert pour {config.BREAKER_RESET} s")
+                raise
+            api_breaker.success()
+            outbox.ack(payload.ids)
+            sent += len(payload.ids)
+            device_state.last_delivered = max(device_state.last_delivered or '', payload.watermark)
+    finally:
+        device_state.delivery_lock.release()
+    return sent
+
+
+def rotate_device_log(device: Dict, records: int, capacity: int) -> bool:
+    """Vide le log de l'appareil une fois archivé (LOG_ROTATION)
+
+    Le log n'est vidé que s'il atteint LOG_ROTATION_THRESHOLD de sa capacité,
+    que ses `records` enregistrements sont couverts par le point de reprise
+    (donc stockés dans l'outbox) et tous acquittés par l'API ; ils sont copiés
+    dans l'archive de l'outbox, jamais purgée, avant l'effacement. L'appareil est
+    désactivé de la vérification du nombre d'enregistrements jusqu'à
+    l'effacement : un pointage arrivé entre-temps reporte la rotation au
+    cycle suivant, qui le lira d'abord.
+
+    Returns:
+        True si le log a été vidé
+    """
+    name = device["name"]
+    key = device_key(device)
+    if not capacity or records < capacity * config.LOG_ROTATION_THRESHOLD:
+        return False
+    pending = outbox.count(key)
+    if pending:
+        logger.info(f"[{name}] Rotation du log reportée: {pending} présences non acquittées")
+        return False
+    state = load_sync_state(key)
+    if (state.get("cursor") or {}).get("records") != records:
+        logger.info(f"[{name}] Rotation du log reportée: point de reprise non à jour")
+        return False
+    # L'archive devient la seule copie des présences effacées de l'appareil
+    archived = outbox.archive(key)
+    logger.info(f"[{name}] {archived} présences archivées avant la rotation")
+
+    with ZKAttendanceAgent(device["ip"], device["port"], device["timeout"],
+                           device["password"], device["udp"], key) as zk:
+        if not zk.conn:
+            raise ConnectionError(f"Connexion impossible à {device['ip']}")
+        cleared = zk.call('clear_attendance_checked', records)
+    if not cleared:
+        logger.info(f"[{name}] Rotation du log reportée: nouveaux pointages pendant la vérification")
+        return False
+    # Log vide : la prochaine lecture repart de zéro (lecture complète)
+    checkpoints.update(
+        key,
+        cursor={"records": 0},
+        archived=state.get("archived", 0) + records,
+        rotated=datetime.now().isoformat()
+    )
+    logger.info(f"[{name}] ✓ Log de l'appareil vidé: {records}/{capacity} enregistrements archivés")
+    return True
+
+
+def fetch_and_send_attendance(device: Optional[Dict] = None) -> int:
+    """Synchronisation principale d'un appareil
+
+    Une seule tentative par appel : en cas d'échec de l'appareil, une reprise
+    est planifiée (retry_at) après un délai exponentiel, sans bloquer le
+    verrou ni le scheduler. L'envoi à l'API est une étape séparée.
+
+    Returns:
+        Nombre de présences envoyées
+    """
+    if device is None:
+        device = load_devices()[0]
+    name = device["name"]
+    key = device_key(device)
+    device_state = get_device_state(device)
+    logger.info(f"=== Début sync [{name}] ===")
+
+    if not device_state.lock.acquire(blocking=False):
+        logger.info(f"[{name}] Sync en cours, skip")
+        return 0
+
+    if not device_state.breaker.allow():
+        logger.info(f"[{name}] Circuit ouvert, lecture ignorée")
+        device_state.lock.release()
+        return 0
+
+    started = time.monotonic()
+    sent = 0
+    last_error = None
+    log_usage = None
+    try:
+        # Étape appareil : connexion et lecture, stockage local avant l'envoi
+        try:
+            with ZKAttendanceAgent(device["ip"], device["port"], device["timeout"],
+                                   device["password"], device["udp"], key) as zk:
+                new_attendances = zk.get_new_attendances()
+                logger.info(f"[{name}] {len(new_attendances)} présences détectées")
+
+                # Une panne de l'API n'impose plus de relire l'appareil
+                stored = outbox.add(device_key(device), new_attendances.to_payload())
+                if new_attendances:
+                    last_sync_time = from_epoch(new_attendances.max_time())
+                else:
+                    logger.info(f"[{name}] Aucune nouvelle présence")
+                    last_sync_time = None
+                save_last_sync(last_sync_time, zk.cursor, key, zk.serial)
+                log_usage = (zk.cursor.get("records", 0), zk.capacity)
+                if stored:
+                    logger.info(f"[{name}] {stored} présences ajoutées à l'outbox")
+            device_state.breaker.success()
+            device_state.attempts = 0
+            device_state.retry_at = None
+        except Exception as e:
+            last_error = str(e)
+            device_state.attempts += 1
+            if device_state.breaker.failure():
+                logger.warning(f"[{name}] Circuit ouvert pour {config.BREAKER_RESET} s")
+            if device_state.attempts < config.MAX_RETRIES:
+                delay = backoff(device_state.attempts - 1, config.RETRY_DELAY, config.RETRY_DELAY_MAX)
+                device_state.retry_at = time.monotonic() + delay
+                logger.error(f"[{name}] Tentative {device_state.attempts}/{config.MAX_RETRIES}: {e}, "
+                             f"nouvel essai dans {delay:.0f}s")
+                return sent
+
+            # Échec après toutes les tentatives - Envoyer notification
+            device_state.attempts = 0
+            device_state.retry_at = None
+            logger.critical(f"[{name}] ✗ Échec après retries: {e}")
+            if NOTIFICATIONS_ENABLED:
+                send_email_notification(
+                    subject=f"[ALERTE] Échec Synchronisation ZKTeco - {name} ({device['ip']})",
+                    message=f"⚠️ ÉCHEC DE SYNCHRONISATION\n\n"
+                            f"Le service ZKTeco n'a pas réussi à synchroniser les données de présence.\n\n"
+                            f"DÉTAILS DE L'ERREUR:\n"
+                            f"Appareil concerné: {name} - {device['ip']}:{device['port']}\n"
+                            f"Nombre de tentatives: {config.MAX_RETRIES}\n"
+                            f"Dernière erreur détectée: {last_error}\n"
+                            f"Date et heure: {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}\n\n"
+                            f"ACTION REQUISE:\n"
+                            f"Veuillez vérifier la connectivité de l'appareil et consulter les logs pour plus de détails."
+                )
+            return sent
+
+        # Étape API : envoi depuis l'outbox (les présences restent en attente en cas d'échec)
+        try:
+            sent = deliver_outbox(device)
+            logger.info(f"[{name}] ✓ Sync réussie: {sent} présences")
+        except Exception as e:
+            last_error = str(e)
+            logger.warning(f"[{name}] Envoi différé, {outbox.count(device_key(device))} présences en attente: {e}")
 
+        # Étape rotation (optionnelle) : log vidé une fois archivé et livré
+        if config.LOG_ROTATION and log_usage:
+            try:
+                rotate_device_log(device, *log_usage)
             except Exception as e:
-                last_error = str(e)
-                logger.error(f"Tentative {attempt}/{config.MAX_RETRIES}: {e}")
-                if attempt < config.MAX_RETRIES:
-                    time.sleep(config.RETRY_DELAY)
-
-        # Échec après toutes les tentatives - Envoyer notification
-        logger.critical("✗ Échec après retries")
-        if NOTIFICATIONS_ENABLED:
-            send_email_notification(
-                subject=f"[ALERTE] Échec Synchronisation ZKTeco - {config.DEVICE_IP}",
-                message=f"⚠️ ÉCHEC DE SYNCHRONISATION\n\n"
-                        f"Le service ZKTeco n'a pas réussi à synchroniser les données de présence.\n\n"
-                        f"DÉTAILS DE L'ERREUR:\n"
-                        f"Appareil concerné: {config.DEVICE_IP}:{config.DEVICE_PORT}\n"
-                        f"Nombre de tentatives: {config.MAX_RETRIES}\n"
-                        f"Dernière erreur détectée: {last_error}\n"
-                        f"Date et heure: {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}\n\n"
-                        f"ACTION REQUISE:\n"
-                        f"Veuillez vérifier la connectivité de l'appareil et consulter les logs pour plus de détails."
-            )
+                logger.error(f"[{name}] Rotation du log échouée: {e}")
 
     except Exception as e:
-        logger.error(f"Erreur: {e}")
+        last_error = str(e)
+        logger.error(f"[{name}] Erreur: {e}")
         if NOTIFICATIONS_ENABLED:
             send_email_notification(
-                subject=f"[CRITIQUE] Erreur Système ZKTeco - {config.DEVICE_IP}",
+                subject=f"[CRITIQUE] Erreur Système ZKTeco - {name} ({device['ip']})",
                 message=f"🚨 ERREUR CRITIQUE SYSTÈME\n\n"
                         f"Une erreur critique inattendue s'est produite dans le service de synchronisation ZKTeco.\n\n"
                         f"DÉTAILS DE L'ERREUR:\n"
                         f"Type d'erreur: Erreur système critique\n"
                         f"Message d'erreur: {str(e)}\n"
-                        f"Appareil: {config.DEVICE_IP}:{config.DEVICE_PORT}\n"
+                        f"Appareil: {name} - {device['ip']}:{device['port']}\n"
                         f"Date et heure: {datetime.now().strftime('%d/%m/%Y à %H:%M:%S')}\n\n"
                         f"ACTION REQUISE:\n"
                         f"Une intervention immédiate est nécessaire. Veuillez consulter les logs système pour diagnostiquer le problème."
             )
     finally:
-        sync_lock.release()
+        duration = time.monotonic() - started
+        device_state.record(duration, sent, last_error)
+        logger.info(f"[{name}] Durée {duration:.2f}s, {sent} présences envoyées")
+        device_state.lock.release()
+    return sent
+
+
+def submit_sync(device: Dict) -> bool:
+    """Planifie la sync d'un appareil dans le pool (ignorée si déjà en cours)
+
+    Returns:
+        True si la sync a été planifiée
+    """
+    if get_device_state(device).lock.locked():
+        logger.info(f"[{device['name']}] Sync en cours, skip")
+        return False
+    executor.submit(fetch_and_send_attendance, device)
+    return True
+
+
+def submit_retries(devices: List[Dict]) -> None:
+    """Lance les reprises d'appareils arrivées à échéance"""
+    now = time.monotonic()
+    for device in devices:
+        device_state = get_device_state(device)
+        retry_at = device_state.retry_at
+        if retry_at is not None and now >= retry_at:
+            # Effacée avant l'envoi : la sync peut planifier la reprise suivante
+            device_state.retry_at = None
+            if not submit_sync(device):
+                # Appareil occupé (keepalive, sync) : retentée au prochain tour
+                device_state.retry_at = retry_at
+
+
+def keepalive(device: Dict) -> None:
+    """Maintient la session persistante d'un appareil (ignoré pendant une sync)"""
+    zk = ZKAttendanceAgent._clients.get((device["ip"], device["port"]))
+    if zk is None or not zk.is_connect:
+        return
+    device_state = get_device_state(device)
+    if not device_state.lock.acquire(blocking=False):
+        return
+    try:
+        zk.read_sizes()
+    except ZKNetworkError as e:
+        logger.warning(f"[{device['name']}] Keepalive échoué ({e}), reconnexion")
+        try:
+            zk.connect()
+        except Exception as e:
+            # La prochaine sync refera une connexion complète
+            zk.is_connect = False
+            logger.error(f"[{device['name']}] Reconnexion impossible: {e}")
+    except Exception as e:
+        logger.error(f"[{device['name']}] Erreur keepalive: {e}")
+    finally:
+        device_state.lock.release()
+
+
+def deliver_pending(device: Dict) -> None:
+    """Reprise des envois en attente d'un appareil (étape indépendante de la lecture)"""
+    key = device_key(device)
+    if not outbox.count(key):
+        return
+    try:
+        sent = deliver_outbox(device)
+        if sent:
+            logger.info(f"[{device['name']}] ✓ {sent} présences en attente envoyées")
+    except Exception as e:
+        logger.warning(f"[{device['name']}] Envoi différé, {outbox.count(key)} présences en attente: {e}")
+
+
+def submit_delivery(device: Dict) -> None:
+    """Planifie la reprise des envois d'un appareil dans le pool"""
+    executor.submit(deliver_pending, device)
+
+
+def submit_keepalive(device: Dict) -> None:
+    """Planifie le keepalive d'un appareil dans le pool"""
+    executor.submit(keepalive, device)
+
+
+def close_sessions() -> None:
+    """Ferme les sessions persistantes"""
+    for (ip, _port), zk in list(ZKAttendanceAgent._clients.items()):
+        if zk.is_connect:
+            try:
+                zk.enable_device()
+                zk.disconnect()
+                logger.info(f"Session fermée: {ip}")
+            except Exception as e:
+                logger.error(f"Erreur fermeture session {ip}: {e}")
+
+
+class RealtimeForwarder:
+    """Transfert temps réel d'un appareil à partir de live_capture
+
+    Les événements sont passés à l'outbox par micro-lots (REALTIME_BATCH_SIZE
+    présences ou REALTIME_FLUSH_MS millisecondes) puis envoyés. Un balayage
+    incrémental, à chaque connexion puis toutes les REALTIME_RECONCILE_INTERVAL
+    minutes, rattrape les présences manquées pendant les déconnexions ; la
+    clé unique de l'outbox écarte celles déjà reçues en direct.
+    """
+
+    def __init__(self, device: Dict):
+        self.device = device
+        self.name = device["name"]
+        self.key = device_key(device)
+        self.state = get_device_state(device)
+        self.agent = ZKAttendanceAgent(device["ip"], device["port"], device["timeout"],
+                                       device["password"], device["udp"], self.key)
+        self.batch = AttendanceBatch()
+        self.batch_started: Optional[float] = None
+        self.retry_at = 0.0
+        self.thread = threading.Thread(target=self.run, name=f"zk-live-{device_key(device)}", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        self.thread.join(timeout)
+
+    def run(self) -> None:
+        """Boucle connexion, balayage, capture (reconnexion avec délai exponentiel)"""
+        failures = 0
+        with self.state.lock:
+            while not shutdown_flag.is_set():
+                try:
+                    if not (self.agent.conn and self.agent.conn.is_connect):
+                        # Après un balayage périodique, live_capture a rendu
+                        # la session (reg_event(0)) : elle est réutilisée
+                        self.agent.conn = None
+                        self.agent.connect()
+                    if not self.agent.conn:
+                        raise ConnectionError(f"Connexion impossible à {self.device['ip']}")
+                    self.reconcile()
+                    failures = 0
+                    self.capture()
+                except Exception as e:
+                    delay = backoff(failures, config.RETRY_DELAY, config.RETRY_DELAY_MAX)
+                    failures += 1
+                    logger.error(f"[{self.name}] Temps réel interrompu: {e}, reprise dans {delay:.0f}s")
+                    self.state.record(0.0, 0, str(e))
+                    if self.agent.zk is not None:
+                        # Nouvelle poignée de main au prochain tour
+                        self.agent.zk.is_connect = False
+                    shutdown_flag.wait(delay)
+            self.flush(force=True)
+            if self.agent.conn and self.agent.conn.is_connect:
+                # Session conservée en mode persistant (close_sessions)
+                self.agent.disconnect()
+
+    def capture(self) -> None:
+        """Capture en direct jusqu'au prochain balayage ou à l'arrêt"""
+        conn = self.agent.conn
+        reconcile_at = time.monotonic() + config.REALTIME_RECONCILE_INTERVAL * 60
+        logger.info(f"[{self.name}] Capture en direct")
+        # Le délai de réception sert d'horloge : live_capture rend None
+        # après REALTIME_FLUSH_MS sans événement
+        for attendance in conn.live_capture(new_timeout=config.REALTIME_FLUSH_MS / 1000.0):
+            if attendance is not None:
+                self.batch.append(attendance.user_id, attendance.timestamp, attendance.status,
+                                  attendance.punch, attendance.uid)
+                if self.batch_started is None:
+                    self.batch_started = time.monotonic()
+            self.flush()
+            if shutdown_flag.is_set() or (
+                    config.REALTIME_RECONCILE_INTERVAL > 0 and time.monotonic() >= reconcile_at):
+                # Termine le paquet en cours puis rend la main (reg_event(0))
+                conn.end_live_capture = True
+        self.flush(force=True)
+
+    def flush(self, force: bool = False) -> None:
+        """Passe le lot courant à l'outbox s'il est plein ou assez ancien, puis envoie"""
+        if not self.batch:
+            return
+        now = time.monotonic()
+        if (not force and len(self.batch) < config.REALTIME_BATCH_SIZE
+                and (now - self.batch_started) * 1000 < config.REALTIME_FLUSH_MS):
+            return
+        batch, started = self.batch, self.batch_started
+        self.batch, self.batch_started = AttendanceBatch(), None
+        # Heures en secondes epoch jusqu'ici, converties en ISO une seule fois
+        outbox.add(device_key(self.device), batch.to_payload())
+        save_last_sync(from_epoch(batch.max_time()), device=self.key)
+        if now < self.retry_at:
+            # API en échec : envoi repris par le balayage ou au prochain lot
+            return
+        sent = self.deliver()
+        if sent:
+            logger.info(f"[{self.name}] ✓ {sent} présences en direct "
+                        f"({(time.monotonic() - started) * 1000:.0f} ms)")
+
+    def deliver(self) -> int:
+        """Envoie l'outbox de l'appareil (pause de RETRY_DELAY après un échec)"""
+        started = time.monotonic()
+        try:
+            sent = deliver_outbox(self.device)
+        except Exception as e:
+            self.retry_at = time.monotonic() + config.RETRY_DELAY
+            self.state.record(time.monotonic() - started, 0, str(e))
+            logger.error(f"[{self.name}] Envoi temps réel échoué: {e}")
+            return 0
+        self.state.record(time.monotonic() - started, sent)
+        return sent
+
+    def reconcile(self) -> None:
+        """Balayage incrémental : passe les présences du log à l'outbox et envoie"""
+        batch = self.agent.get_new_attendances()
+        stored = outbox.add(device_key(self.device), batch.to_payload())
+        newest = from_epoch(batch.max_time()) if batch else None
+        save_last_sync(newest, self.agent.cursor, self.key, self.agent.serial)
+        logger.info(f"[{self.name}] Balayage: {stored} présences rattrapées")
+        self.retry_at = 0.0
+        self.deliver()
+
+
+def purge_outbox() -> None:
+    """Supprime de l'outbox les présences acquittées depuis OUTBOX_RETENTION_DAYS jours"""
+    try:
+        purged = outbox.purge(config.OUTBOX_RETENTION_DAYS, archive=config.LOG_ROTATION)
+        pending = outbox.count()
+        logger.info(f"Outbox: {pending} présences en attente"
+                    + (f", {purged} anciennes supprimées" if purged else ""))
+    except Exception as e:
+        logger.error(f"Erreur outbox: {e}")
+
+
+def report_fleet() -> None:
+    """Journalise (et écrit si configuré) les métriques par appareil"""
+    with states_lock:
+        metrics = [state.metrics() for state in device_states.values()]
+    for m in metrics:
+        duration = f"{m['last_duration']:.2f}s" if m['last_duration'] is not None else "-"
+        logger.info(
+            f"[{m['device']}] syncs {m['syncs']} (échecs {m['failures']}), "
+            f"dernière: {duration}, {m['last_records']} présences, total {m['records']}"
+            + (f", erreur: {m['last_error']}" if m['last_error'] else "")
+        )
+    if config.METRICS_FILE:
+        try:
+            with open(config.METRICS_FILE, "w") as f:
+                json.dump({"updated": datetime.now().isoformat(), "devices": metrics}, f, indent=2)
+        except Exception as e:
+            logger.error(f"Erreur écriture métriques: {e}")
 
 
 def run_scheduler() -> None:
@@ -261,25 +836,78 @@ def main():
 
     logger.info("=== Service ZKTeco ===")
     logger.info(f"OS: {platform.system()}")
-    logger.info(f"Appareil: {config.DEVICE_IP}:{config.DEVICE_PORT}")
+    devices = load_devices()
+    if config.DEVICES_FILE:
+        logger.info(f"Mode flotte: {len(devices)} appareils, {config.FLEET_WORKERS} workers")
+    for device in devices:
+        every = f"{device['interval_seconds']} s" if device["interval_seconds"] > 0 else f"{device['interval']} min"
+        logger.info(f"Appareil: {device['name']} - {device_key(device)} ({every})")
     logger.info(f"API: {config.API_URL}")
-    logger.info(f"Intervalle: {config.SYNC_INTERVAL} min")
+    purge_outbox()
 
-    if config.SYNC_INTERVAL > 0:
-        # Mode continu
-        schedule.every(config.SYNC_INTERVAL).minutes.do(fetch_and_send_attendance)
-        fetch_and_send_attendance()  # Première sync immédiate
+    if (not config.DEVICES_FILE and not config.REALTIME_MODE
+            and config.SYNC_INTERVAL <= 0 and config.SYNC_INTERVAL_SECONDS <= 0):
+        # Mode single-run
+        device_state = get_device_state(devices[0])
+        fetch_and_send_attendance(devices[0])
+        while device_state.retry_at is not None and not shutdown_flag.is_set():
+            shutdown_flag.wait(max(0.0, device_state.retry_at - time.monotonic()))
+            device_state.retry_at = None
+            fetch_and_send_attendance(devices[0])
+        close_sessions()
+        outbox.close()
+        return
 
-        try:
-            run_scheduler()
-        except KeyboardInterrupt:
-            logger.info("Arrêt (Ctrl+C)")
-        finally:
-            logger.info("Service arrêté")
+    global executor
+    executor = ThreadPoolExecutor(max_workers=max(1, config.FLEET_WORKERS), thread_name_prefix="zk-sync")
+    forwarders: List[RealtimeForwarder] = []
+    if config.REALTIME_MODE:
+        # Mode temps réel : une capture en direct par appareil
+        logger.info(
+            f"Temps réel: lots de {config.REALTIME_BATCH_SIZE} / {config.REALTIME_FLUSH_MS} ms, "
+            f"balayage toutes les {config.REALTIME_RECONCILE_INTERVAL} min"
+        )
+        for device in devices:
+            forwarder = RealtimeForwarder(device)
+            forwarder.start()
+            forwarders.append(forwarder)
     else:
-        # Mode single-run
-        fetch_and_send_attendance()
+        # Mode continu
+        for device in devices:
+            if device["interval_seconds"] > 0:
+                # Intervalles courts : à combiner avec PERSISTENT_SESSION
+                schedule.every(device["interval_seconds"]).seconds.do(submit_sync, device)
+            elif device["interval"] > 0:
+                schedule.every(device["interval"]).minutes.do(submit_sync, device)
+            submit_sync(device)  # Première sync immédiate
+        # Reprises des appareils en échec (délai exponentiel)
+        schedule.every(1).seconds.do(submit_retries, devices)
+    if config.OUTBOX_DELIVERY_INTERVAL > 0:
+        # Envoi des présences en attente, indépendant de la lecture des appareils
+        for device in devices:
+            schedule.every(config.OUTBOX_DELIVERY_INTERVAL).seconds.do(submit_delivery, device)
+    schedule.every().day.do(purge_outbox)
+    if config.DEVICES_FILE and config.FLEET_REPORT_INTERVAL > 0:
+        schedule.every(config.FLEET_REPORT_INTERVAL).minutes.do(report_fleet)
+    if config.PERSISTENT_SESSION and config.KEEPALIVE_INTERVAL > 0 and not config.REALTIME_MODE:
+        logger.info(f"Sessions persistantes, keepalive toutes les {config.KEEPALIVE_INTERVAL} s")
+        for device in devices:
+            schedule.every(config.KEEPALIVE_INTERVAL).seconds.do(submit_keepalive, device)
 
+    try:
+        run_scheduler()
+    except KeyboardInterrupt:
+        logger.info("Arrêt (Ctrl+C)")
+    finally:
+        shutdown_flag.set()
+        for forwarder in forwarders:
+            forwarder.join(config.DEVICE_TIMEOUT)
+        executor.shutdown(wait=True)
+        close_sessions()
+        report_fleet()
+        outbox.close()
+        http_client.close()
+        logger.info("Service arrêté")
 
 if __name__ == '__main__':
     main()